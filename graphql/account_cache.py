@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Cached account and meter point discovery
+
+Account numbers, properties and electricity meter points almost never
+change, so they are discovered with a single viewer query and kept on
+disk (keyed by a hash of the API key) for a configurable TTL. The cache
+is dropped automatically when a campaign query reports an unknown supply
+point, so a steady-state run only has to fetch the campaign events.
+"""
+
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from cache_file import CACHE_DIR, LockedJSONFile, cache_key
+from octopus_client import GraphQLClient, get_client, is_transient_error
+
+# Configuration
+DEFAULT_ACCOUNT_CACHE = os.getenv("OCTOPUS_ACCOUNT_CACHE", os.path.join(CACHE_DIR, "accounts.json"))
+DEFAULT_TTL = int(os.getenv("OCTOPUS_ACCOUNT_CACHE_TTL", str(24 * 60 * 60)))
+
+TOPOLOGY_QUERY = """
+query AccountTopologyQuery {
+  viewer {
+    accounts {
+      number
+      properties {
+        id
+        electricityMeterPoints {
+          mpan
+          direction
+          meters {
+            meterType
+            serialNumber
+          }
+          agreements {
+            validFrom
+            validTo
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+UNKNOWN_SUPPLY_POINT_RE = re.compile(
+    r"(unknown|invalid|not found|unable to find|does not (exist|belong)).*supply point"
+    r"|supply point.*(unknown|invalid|not found|does not (exist|belong))",
+    re.IGNORECASE
+)
+
+
+def fetch_account_topology(token: str, client: Optional[GraphQLClient] = None) -> List[Dict]:
+    """
+    Discover every account, property and electricity meter point in one request.
+
+    Args:
+        token: JWT authentication token
+        client: Optional client (defaults to the shared client)
+
+    Returns:
+        List of accounts, each with `number` and `properties`; each property
+        has `id` and `meter_points` with `mpan`, `direction`, `meter_types`,
+        `serial_numbers` and `agreements`
+    """
+    client = client or get_client()
+    return parse_account_topology(client.execute(TOPOLOGY_QUERY, token=token))
+
+
+def parse_account_topology(data: Dict) -> List[Dict]:
+    """
+    Convert a TOPOLOGY_QUERY result into the cached topology format.
+
+    Args:
+        data: The `data` member of the response
+
+    Returns:
+        Topology as described in fetch_account_topology()
+    """
+    accounts = []
+    for account in data["viewer"]["accounts"]:
+        properties = []
+        for prop in account.get("properties") or []:
+            meter_points = []
+            for meter_point in prop.get("electricityMeterPoints") or []:
+                meter_points.append({
+                    "mpan": meter_point.get("mpan"),
+                    "direction": meter_point.get("direction"),
+                    "meter_types": [m.get("meterType") for m in meter_point.get("meters") or []],
+                    "serial_numbers": [m["serialNumber"] for m in meter_point.get("meters") or [] if m.get("serialNumber")],
+                    "agreements": meter_point.get("agreements") or []
+                })
+            properties.append({"id": prop.get("id"), "meter_points": meter_points})
+        accounts.append({"number": account["number"], "properties": properties})
+
+    if not accounts:
+        raise Exception("No accounts found for authenticated user")
+
+    return accounts
+
+
+def is_import_meter_point(meter_point: Dict) -> bool:
+    """True for IMPORT meter points (as reported by direction or meter type)."""
+    return (
+        meter_point.get("direction") == "IMPORT"
+        or "ELECTRICITY_IMPORT" in meter_point.get("meter_types", [])
+    )
+
+
+def has_valid_agreement(meter_point: Dict, at: Optional[datetime] = None) -> bool:
+    """
+    True if the meter point has an agreement covering `at` (default: now).
+
+    Agreements without dates are treated as open-ended.
+    """
+    at = at or datetime.now(timezone.utc)
+    for agreement in meter_point.get("agreements", []):
+        valid_from = agreement.get("validFrom")
+        valid_to = agreement.get("validTo")
+        if valid_from and datetime.fromisoformat(valid_from.replace("Z", "+00:00")) > at:
+            continue
+        if valid_to and datetime.fromisoformat(valid_to.replace("Z", "+00:00")) <= at:
+            continue
+        return True
+    return False
+
+
+def import_mpans(
+    accounts: List[Dict],
+    account_number: Optional[str] = None,
+    require_agreement: bool = True
+) -> List[str]:
+    """
+    List IMPORT MPANs, optionally for a single account.
+
+    MPANs with a currently valid agreement come first.
+
+    Args:
+        accounts: Topology as returned by fetch_account_topology()
+        account_number: Restrict to this account (default: all accounts)
+        require_agreement: Skip meter points without any agreements
+
+    Returns:
+        List of MPAN strings
+    """
+    current = []
+    other = []
+    for account in accounts:
+        if account_number and account["number"] != account_number:
+            continue
+        for prop in account["properties"]:
+            for meter_point in prop["meter_points"]:
+                if not meter_point["mpan"] or not is_import_meter_point(meter_point):
+                    continue
+                if require_agreement and not meter_point["agreements"]:
+                    continue
+                if has_valid_agreement(meter_point):
+                    current.append(meter_point["mpan"])
+                else:
+                    other.append(meter_point["mpan"])
+    return current + other
+
+
+def all_mpans(accounts: List[Dict], account_number: Optional[str] = None) -> List[str]:
+    """List every MPAN regardless of direction, optionally for a single account."""
+    return [
+        meter_point["mpan"]
+        for account in accounts
+        if not account_number or account["number"] == account_number
+        for prop in account["properties"]
+        for meter_point in prop["meter_points"]
+        if meter_point["mpan"]
+    ]
+
+
+def is_unknown_supply_point_error(error: Exception) -> bool:
+    """True if an API error means the cached MPAN is no longer valid."""
+    return bool(UNKNOWN_SUPPLY_POINT_RE.search(str(error)))
+
+
+class AccountCache:
+    """
+    On-disk cache of account topology with a TTL.
+
+    Args:
+        path: Location of the JSON cache file
+        ttl: Seconds before a cached topology is re-discovered
+    """
+
+    def __init__(self, path: str = DEFAULT_ACCOUNT_CACHE, ttl: int = DEFAULT_TTL):
+        self.file = LockedJSONFile(path)
+        self.ttl = ttl
+
+    def get_accounts(
+        self,
+        api_key: str,
+        token: str,
+        client: Optional[GraphQLClient] = None,
+        refresh: bool = False
+    ) -> List[Dict]:
+        """
+        Return the account topology, discovering it only when stale.
+
+        An expired copy is still returned when no token is available or
+        discovery fails transiently (see is_transient_error()), unless
+        `refresh` is set.
+
+        Args:
+            api_key: API key the topology belongs to (used as the cache key)
+            token: JWT authentication token
+            client: Optional client (defaults to the shared client)
+            refresh: Ignore any cached copy
+
+        Returns:
+            Account topology (see fetch_account_topology())
+        """
+        key = cache_key(api_key)
+        requested_at = time.time()
+        with self.file.locked():
+            entry = self.file.read().get(key)
+        if not refresh and self._is_fresh(entry, token):
+            return entry["accounts"]
+
+        # Only one caller per API key discovers; the others wait and use its result
+        with self.file.key_locked(key):
+            with self.file.locked():
+                entry = self.file.read().get(key)
+            if entry and (entry["fetched_at"] >= requested_at or (not refresh and self._is_fresh(entry, token))):
+                return entry["accounts"]
+
+            try:
+                accounts = fetch_account_topology(token, client)
+            except Exception as e:
+                # Topology rarely changes, so an expired copy beats failing outright
+                if refresh or not entry or not is_transient_error(e):
+                    raise
+                print(f"Account discovery failed, using cached account details: {e}", file=sys.stderr)
+                return entry["accounts"]
+            with self.file.locked():
+                entries = self.file.read()
+                entries[key] = {"fetched_at": time.time(), "accounts": accounts}
+                self.file.write(entries)
+            return accounts
+
+    def _is_fresh(self, entry: Optional[Dict], token: str) -> bool:
+        return bool(entry) and (not token or time.time() - entry["fetched_at"] < self.ttl)
+
+    def invalidate(self, api_key: str) -> None:
+        """Forget the cached topology for an API key."""
+        key = cache_key(api_key)
+        with self.file.locked():
+            entries = self.file.read()
+            if entries.pop(key, None) is not None:
+                self.file.write(entries)
+
+
+_default_cache: Optional[AccountCache] = None
+
+
+def get_account_cache() -> AccountCache:
+    """Return the process-wide account cache."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = AccountCache()
+    return _default_cache
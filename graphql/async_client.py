@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Asyncio GraphQL client for event-loop hosts
+
+The finder helpers block on requests, so an asyncio host (a Home
+Assistant integration, an aiohttp app) would have to park them on
+executor threads. This module provides the same auth, account, MPAN and
+campaign event calls as coroutines, on top of the optional `httpx`
+package (pip install httpx):
+
+- every event loop gets one AsyncGraphQLClient (get_async_client()) whose
+  keep-alive connection pool is shared by all tasks on that loop
+- pool_size bounds the open connections; further requests wait for a free
+  one (within the retry deadline), so hundreds of concurrent fetches cost
+  one coroutine each
+- retries, backoff and the per-host circuit breaker are the sync client's
+  own (octopus_client.RetryState, settle_response() and graphql_data()),
+  so both clients treat every failure the same way
+- httpx takes care of HTTP itself: proxies from the environment, every
+  content encoding, interim responses and repeated headers
+- cancelling a task (or wrapping a call in asyncio.wait_for()) closes the
+  connection it was using and releases its pool slot
+
+Queries and response parsing are shared with the sync functions too. The
+sync client is not a wrapper around this one: the scripts keep requests as
+their only required dependency, they call the client from thread pools,
+and a blocking wrapper would need asyncio.run(), which fails in any thread
+that is already running an event loop.
+
+Example:
+
+    async def refresh(api_key):
+        token = await async_get_token_with_api_key(api_key)
+        accounts = await async_fetch_account_topology(token)
+        account_number = accounts[0]["number"]
+        mpan = import_mpans(accounts, account_number)[0]
+        return await async_get_free_electricity_sessions(token, account_number, mpan)
+"""
+
+import asyncio
+import json
+import weakref
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from account_cache import TOPOLOGY_QUERY, import_mpans, parse_account_topology
+from campaigns import (
+    CAMPAIGN_EVENTS_PAGE_QUERY,
+    DEFAULT_PAGE_SIZE,
+    FREE_ELECTRICITY_SLUG,
+    POWER_UP_SLUG,
+    build_campaign_events_query,
+    parse_events_page,
+    split_batch_response,
+)
+from event_model import CampaignEvent
+from metrics import record_http
+from octopus_client import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_READ_TIMEOUT,
+    GRAPHQL_URL,
+    OBTAIN_TOKEN_MUTATION,
+    VIEWER_ACCOUNTS_QUERY,
+    GraphQLError,
+    RetryableError,
+    RetryState,
+    graphql_data,
+    parse_account_numbers,
+    settle_response,
+)
+from resilience import RetryPolicy, get_breaker
+
+try:
+    import httpx
+except ImportError:  # Optional: only needed for the asyncio client
+    httpx = None
+
+USER_AGENT = "octopus-powerups-async/1.0"
+
+
+class AsyncGraphQLClient:
+    """
+    Asyncio GraphQL client with a keep-alive connection pool, retries and
+    the shared per-host circuit breaker.
+
+    A client belongs to the event loop it is first used on; use
+    get_async_client() to get the one for the running loop.
+
+    Args:
+        url: GraphQL endpoint
+        pool_size: Maximum number of open connections
+        connect_timeout: Seconds to wait for a connection to be established
+        read_timeout: Seconds to wait for the server to send a response
+        retry_policy: Backoff and deadline settings (default: RetryPolicy())
+    """
+
+    def __init__(
+        self,
+        url: str = GRAPHQL_URL,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        retry_policy: Optional[RetryPolicy] = None
+    ):
+        if httpx is None:
+            raise Exception("The asyncio client needs the httpx package (pip install httpx)")
+        self.url = url
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = get_breaker(urlsplit(url).netloc)
+        self.retries = 0
+        self.sent = 0
+        self.opened = 0
+        self._http: Optional["httpx.AsyncClient"] = None
+
+    @property
+    def http(self) -> "httpx.AsyncClient":
+        # Created on first use, on the loop the client belongs to
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                headers={"User-Agent": USER_AGENT},
+            )
+        return self._http
+
+    async def _trace(self, event: str, info: Dict) -> None:
+        # httpcore reports every new connection; reused ones skip the connect step
+        if event in ("connection.connect_tcp.complete", "connection.connect_unix_socket.complete"):
+            self.opened += 1
+
+    async def execute(self, query: str, variables: Optional[Dict] = None, token: Optional[str] = None) -> Dict:
+        """
+        Send a GraphQL document and return its `data` member.
+
+        Retries the same failures as GraphQLClient.execute().
+
+        Args:
+            query: GraphQL query or mutation
+            variables: Optional query variables
+            token: Optional JWT sent in the Authorization header
+
+        Returns:
+            The `data` dictionary from the response
+
+        Raises:
+            httpx.HTTPStatusError: on a non-2xx HTTP status
+            httpx.TransportError: on connection failures and timeouts
+            GraphQLError: if the response contains GraphQL errors
+            CircuitOpenError: if the API host has been failing repeatedly
+        """
+        payload = {"query": query}
+        if variables is not None:
+            payload["variables"] = variables
+        body = json.dumps(payload).encode("utf-8")
+
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = token
+
+        state = RetryState(self.retry_policy, self.breaker)
+        while True:
+            remaining = state.begin_attempt()
+            # Waiting for a free pooled connection counts against the call's deadline too
+            timeout = httpx.Timeout(
+                min(self.read_timeout, remaining), connect=min(self.connect_timeout, remaining), pool=remaining
+            )
+
+            try:
+                return graphql_data(await self._send(body, headers, timeout, remaining))
+            except RetryableError as e:
+                retry = e
+
+            delay = state.retry_delay(retry)
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def _send(self, body: bytes, headers: Dict[str, str], timeout: "httpx.Timeout", remaining: float) -> Dict:
+        """One HTTP attempt; raises RetryableError for failures worth retrying."""
+        try:
+            # httpx restarts its pool timeout whenever a queued request loses a
+            # freed connection to another one, so bound the whole attempt as well
+            async with asyncio.timeout(remaining):
+                response = await self.http.post(
+                    self.url, content=body, headers=headers, timeout=timeout, extensions={"trace": self._trace}
+                )
+        except httpx.PoolTimeout:
+            # Every pooled connection stayed busy; the host itself didn't fail
+            self.breaker.abandon_call()
+            raise
+        except TimeoutError:
+            # The call's deadline ran out, most likely while queued for a pooled connection
+            self.breaker.abandon_call()
+            raise httpx.TimeoutException(f"No response within the {remaining:.1f}s left before the deadline")
+        except httpx.TransportError as e:
+            record_http(None, 0, 0)
+            self.breaker.record_failure()
+            raise RetryableError(e)
+        except asyncio.CancelledError:
+            self.breaker.abandon_call()
+            raise
+
+        self.sent += 1
+        record_http(response.status_code, len(body), len(response.content))
+        settle_response(self.breaker, response.status_code, response.headers.get("Retry-After"), response.raise_for_status)
+        return response.json()
+
+    def connection_stats(self) -> Dict[str, int]:
+        """Same counters as GraphQLClient.connection_stats()."""
+        return {
+            "requests": self.sent,
+            "connections_opened": self.opened,
+            "connections_reused": max(self.sent - self.opened, 0)
+        }
+
+    async def close(self) -> None:
+        """Close all pooled connections."""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncGraphQLClient]" = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> AsyncGraphQLClient:
+    """Return the shared client of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncGraphQLClient()
+    return client
+
+
+async def async_obtain_kraken_token(token_input: Dict, client: Optional[AsyncGraphQLClient] = None) -> Dict:
+    """
+    Run the ObtainKrakenToken mutation and return its full payload.
+
+    Args:
+        token_input: ObtainJSONWebTokenInput, e.g. {"APIKey": ...} or {"refreshToken": ...}
+        client: Optional client (defaults to the loop's shared client)
+
+    Returns:
+        Dictionary with `token`, `refreshToken` and `refreshExpiresIn`
+    """
+    client = client or get_async_client()
+    data = await client.execute(OBTAIN_TOKEN_MUTATION, {"input": token_input})
+    return data["obtainKrakenToken"]
+
+
+async def async_get_token_with_api_key(api_key: str, client: Optional[AsyncGraphQLClient] = None) -> str:
+    """Get a JWT using an API key (see get_token_with_api_key())."""
+    return (await async_obtain_kraken_token({"APIKey": api_key}, client))["token"]
+
+
+async def async_get_token(email: str, password: str, client: Optional[AsyncGraphQLClient] = None) -> str:
+    """Get a JWT using email and password (see get_token())."""
+    return (await async_obtain_kraken_token({"email": email, "password": password}, client))["token"]
+
+
+async def async_get_account_numbers(token: str, client: Optional[AsyncGraphQLClient] = None) -> List[str]:
+    """List all account numbers visible to the authenticated user (see get_account_numbers())."""
+    client = client or get_async_client()
+    return parse_account_numbers(await client.execute(VIEWER_ACCOUNTS_QUERY, token=token))
+
+
+async def async_fetch_account_topology(token: str, client: Optional[AsyncGraphQLClient] = None) -> List[Dict]:
+    """Discover every account, property and meter point (see fetch_account_topology())."""
+    client = client or get_async_client()
+    return parse_account_topology(await client.execute(TOPOLOGY_QUERY, token=token))
+
+
+async def async_get_import_mpans(
+    token: str,
+    account_number: str,
+    client: Optional[AsyncGraphQLClient] = None
+) -> List[str]:
+    """
+    List the IMPORT MPANs of an account, ones with a current agreement first.
+
+    Args:
+        token: JWT authentication token
+        account_number: Octopus account number
+        client: Optional client (defaults to the loop's shared client)
+
+    Returns:
+        List of MPAN strings
+    """
+    accounts = await async_fetch_account_topology(token, client)
+    return import_mpans(accounts, account_number, require_agreement=False)
+
+
+async def async_iter_campaign_events(
+    token: str,
+    account_number: str,
+    mpan: str,
+    campaign_slug: str,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    ends_after: Optional[datetime] = None,
+    after: Optional[str] = None,
+    client: Optional[AsyncGraphQLClient] = None
+) -> AsyncIterator[CampaignEvent]:
+    """
+    Stream every event of a campaign, following `pageInfo` cursors
+    (see iter_campaign_events()).
+
+    Yields:
+        CampaignEvent records
+    """
+    client = client or get_async_client()
+    variables = {
+        "accountNumber": account_number,
+        "mpan": mpan,
+        "campaignSlug": campaign_slug,
+        "first": page_size,
+        "after": after
+    }
+    ends_after_epoch = ends_after.timestamp() if ends_after is not None else None
+
+    while True:
+        data = await client.execute(CAMPAIGN_EVENTS_PAGE_QUERY, variables, token=token)
+        events, cursor = parse_events_page(data["customerFlexibilityCampaignEvents"], ends_after_epoch)
+        for event in events:
+            yield event
+        if cursor is None:
+            return
+        variables["after"] = cursor
+
+
+async def async_get_campaign_events(
+    token: str,
+    account_number: str,
+    mpan: str,
+    campaign_slug: str,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    ends_after: Optional[datetime] = None,
+    after: Optional[str] = None,
+    client: Optional[AsyncGraphQLClient] = None
+) -> List[CampaignEvent]:
+    """Every event of a campaign as a list (see async_iter_campaign_events())."""
+    return [event async for event in async_iter_campaign_events(
+        token, account_number, mpan, campaign_slug,
+        page_size=page_size, ends_after=ends_after, after=after, client=client
+    )]
+
+
+async def async_get_free_electricity_sessions(
+    token: str,
+    account_number: str,
+    mpan: str,
+    client: Optional[AsyncGraphQLClient] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    ends_after: Optional[datetime] = None
+) -> List[CampaignEvent]:
+    """Fetch free electricity sessions (see get_free_electricity_sessions())."""
+    return await async_get_campaign_events(
+        token, account_number, mpan, FREE_ELECTRICITY_SLUG,
+        page_size=page_size, ends_after=ends_after, client=client
+    )
+
+
+async def async_get_power_up_events(
+    token: str,
+    account_number: str,
+    mpan: str,
+    client: Optional[AsyncGraphQLClient] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    ends_after: Optional[datetime] = None,
+    slug: str = POWER_UP_SLUG
+) -> List[CampaignEvent]:
+    """Fetch Power Up events, by default for OCTOPUS_POWER_UP_SLUG (see get_power_up_events())."""
+    return await async_get_campaign_events(
+        token, account_number, mpan, slug,
+        page_size=page_size, ends_after=ends_after, client=client
+    )
+
+
+async def async_fetch_campaign_events_batch(
+    token: str,
+    account_number: str,
+    targets: List[Tuple[str, str]],
+    page_size: int = DEFAULT_PAGE_SIZE,
+    client: Optional[AsyncGraphQLClient] = None
+) -> Tuple[Dict[Tuple[str, str], List[CampaignEvent]], Dict[Tuple[str, str], GraphQLError]]:
+    """
+    Fetch events for several (campaign slug, MPAN) pairs in one request
+    (see fetch_campaign_events_batch()).
+
+    Campaigns with more than one page are followed up concurrently.
+
+    Returns:
+        (results, errors) tuple, as from fetch_campaign_events_batch()
+    """
+    query, variables = build_campaign_events_query(targets, page_size)
+    variables["accountNumber"] = account_number
+
+    client = client or get_async_client()
+    try:
+        connections, errors = split_batch_response(targets, await client.execute(query, variables, token=token))
+    except GraphQLError as e:
+        connections, errors = split_batch_response(targets, e.data, e)
+
+    results = {}
+    follow_ups = {}
+    for (slug, mpan), connection in connections.items():
+        events, cursor = parse_events_page(connection)
+        results[(slug, mpan)] = events
+        if cursor is not None:
+            follow_ups[(slug, mpan)] = async_get_campaign_events(
+                token, account_number, mpan, slug, page_size=page_size, after=cursor, client=client
+            )
+
+    if follow_ups:
+        remaining = await asyncio.gather(*follow_ups.values(), return_exceptions=True)
+        for target, events in zip(follow_ups, remaining):
+            if isinstance(events, GraphQLError):
+                # A partial list would look like deleted events, so report the campaign as failed
+                del results[target]
+                errors[target] = events
+            elif isinstance(events, BaseException):
+                raise events
+            else:
+                results[target].extend(events)
+    return results, errors
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the finder scripts against the mock API
+
+Runs the shipped finders - fes_finder_graphql.py, power_up_finder_graphql.py
+and campaign_finder_graphql.py for one meter point (run_single_meter_point)
+and with OCTOPUS_ALL_METERS=1 (run_all_meter_points) - repeatedly against
+mock_server.py, each run in its own process exactly as cron or the GitHub
+workflow starts them, and reports per finder:
+
+- requests (and retries) per run, counted by the server
+- wall time per run, including interpreter start-up, and per stage from
+  the run's own metrics report (p50 / p99 / mean)
+- peak RSS of the run's process
+
+Runs get the default configuration: every OCTOPUS_* variable is replaced by
+the mock's URL and API key and a temporary cache directory, feed directory
+and metrics report, so feeds are never written to the repository. Every
+run starts from an empty cache (token, accounts and responses) unless
+--warm-cache is given, which keeps one cache across runs like a scheduled
+job does. Reports can be saved as JSON and compared with an earlier one to
+catch regressions.
+
+Usage:
+
+    python benchmark.py --runs 50 --events 500 --latency 0.02
+    python benchmark.py --json bench.json --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+import requests
+
+from metrics import STAGES
+from mock_server import add_dataset_arguments, server_options, start_mock_server
+
+MOCK_API_KEY = "sk_mock_benchmark"
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Finder name -> (script, extra environment)
+FINDERS: Dict[str, Tuple[str, Dict[str, str]]] = {
+    "free_electricity": ("fes_finder_graphql.py", {}),
+    "power_ups": ("power_up_finder_graphql.py", {}),
+    "campaign_finder": ("campaign_finder_graphql.py", {}),
+    "campaign_finder_all_meters": ("campaign_finder_graphql.py", {"OCTOPUS_ALL_METERS": "1"}),
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """p50, p99 and mean of durations in seconds, as milliseconds."""
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(values) * 1000, 3) if values else 0.0,
+    }
+
+
+def fetch_stats(url: str, reset: bool = True) -> Dict:
+    """Request counters from the mock server's /stats endpoint."""
+    response = requests.get(url.rstrip("/") + "/stats", params={"reset": "1"} if reset else None, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+
+def finder_env(url: str, cache_dir: str, feed_dir: str, metrics_path: str, extra: Dict[str, str]) -> Dict[str, str]:
+    """Environment for one finder run: default settings pointed at the mock and temporary directories."""
+    env = {key: value for key, value in os.environ.items() if not key.startswith("OCTOPUS_")}
+    env.update({
+        "OCTOPUS_API_KEY": MOCK_API_KEY,
+        "OCTOPUS_GRAPHQL_URL": url,
+        "OCTOPUS_REST_URL": url.rstrip("/") + "/v1",
+        "OCTOPUS_CACHE_DIR": cache_dir,
+        "OCTOPUS_FEED_DIR": feed_dir,
+        "OCTOPUS_METRICS_JSON": metrics_path,
+    })
+    env.update(extra)
+    return env
+
+
+def run_once(name: str, url: str, work_dir: str, cache_dir: str) -> Tuple[Dict[str, float], float, int, int]:
+    """
+    Run a finder script once in its own process.
+
+    Args:
+        name: Finder name (key of FINDERS)
+        url: Mock server URL
+        work_dir: Directory for the feeds, metrics report and output log
+        cache_dir: Cache directory for the run
+
+    Returns:
+        (stage durations in seconds, wall time in seconds, retries, peak RSS in bytes) tuple
+    """
+    script, extra = FINDERS[name]
+    feed_dir = os.path.join(work_dir, "feeds")
+    os.makedirs(feed_dir, exist_ok=True)
+    metrics_path = os.path.join(work_dir, "metrics.json")
+    log_path = os.path.join(work_dir, "output.log")
+
+    # The finders report progress on stdout/stderr; keep it out of the benchmark output
+    with open(log_path, "wb") as log:
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(SCRIPT_DIR, script)],
+            env=finder_env(url, cache_dir, feed_dir, metrics_path, extra),
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT
+        )
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        with open(log_path, errors="replace") as f:
+            last_line = (f.read().strip().splitlines() or [""])[-1]
+        raise Exception(f"{script} exited with {process.returncode}: {last_line}")
+
+    with open(metrics_path) as f:
+        stages = json.load(f)["stages"]
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return (
+        {stage: metrics["duration_seconds"] for stage, metrics in stages.items()},
+        wall,
+        sum(metrics["retries"] for metrics in stages.values()),
+        peak_rss,
+    )
+
+
+def benchmark(name: str, url: str, runs: int, warmup: int, warm_cache: bool) -> Dict:
+    """
+    Benchmark one finder.
+
+    Returns:
+        Report with run counts, requests and retries per run, wall and
+        per-stage timings and peak RSS
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        shared_cache = os.path.join(work_dir, "cache")
+
+        def run() -> Tuple[Dict[str, float], float, int, int]:
+            if warm_cache:
+                return run_once(name, url, work_dir, shared_cache)
+            with tempfile.TemporaryDirectory(dir=work_dir) as cache_dir:
+                return run_once(name, url, work_dir, cache_dir)
+
+        for _ in range(warmup):
+            run()
+        fetch_stats(url)
+
+        walls: List[float] = []
+        stages: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        retries = 0
+        peak_rss = 0
+        failures: Dict[str, int] = {}
+        for _ in range(runs):
+            try:
+                durations, wall, run_retries, run_rss = run()
+            except Exception as e:
+                print(f"  {name}: {e}", file=sys.stderr)
+                failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+                continue
+            walls.append(wall)
+            retries += run_retries
+            peak_rss = max(peak_rss, run_rss)
+            for stage in STAGES:
+                stages[stage].append(durations.get(stage, 0.0))
+
+    server_stats = fetch_stats(url)
+    return {
+        "runs": runs,
+        "failed": sum(failures.values()),
+        "failures": failures,
+        "requests_per_run": round(server_stats["requests"] / runs, 2),
+        "retries_per_run": round(retries / max(len(walls), 1), 2),
+        "bytes_per_run": round(server_stats["bytes_sent"] / runs),
+        "operations": server_stats["operations"],
+        "wall": summarize(walls),
+        "stages": {stage: summarize(values) for stage, values in stages.items()},
+        "peak_rss_bytes": peak_rss,
+    }
+
+
+def print_report(report: Dict) -> None:
+    for name, result in report["finders"].items():
+        print(f"\n{name}: {result['runs'] - result['failed']}/{result['runs']} run(s) ok, "
+              f"{result['requests_per_run']} request(s)/run, {result['retries_per_run']} retries/run, "
+              f"peak RSS {result['peak_rss_bytes'] / (1024 * 1024):.1f} MiB")
+        print(f"  {'stage':<18} {'p50 ms':>10} {'p99 ms':>10} {'mean ms':>10}")
+        for stage, timing in list(result["stages"].items()) + [("total", result["wall"])]:
+            print(f"  {stage:<18} {timing['p50_ms']:>10.2f} {timing['p99_ms']:>10.2f} {timing['mean_ms']:>10.2f}")
+        if result["failures"]:
+            print(f"  failures: {result['failures']}")
+
+
+def compare_reports(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Regressions of `report` against `baseline`.
+
+    A p50 timing more than `tolerance` (fraction) slower, or more requests
+    per run, counts as a regression.
+    """
+    regressions = []
+    for name, result in report["finders"].items():
+        before = baseline.get("finders", {}).get(name)
+        if not before:
+            continue
+        if result["requests_per_run"] > before["requests_per_run"]:
+            regressions.append(
+                f"{name}: requests/run {before['requests_per_run']} -> {result['requests_per_run']}"
+            )
+        timings = [("total", result["wall"], before["wall"])]
+        timings += [(stage, result["stages"][stage], before["stages"].get(stage)) for stage in result["stages"]]
+        for stage, now, then in timings:
+            if then and then["p50_ms"] and now["p50_ms"] > then["p50_ms"] * (1 + tolerance):
+                regressions.append(f"{name} {stage}: p50 {then['p50_ms']:.2f} ms -> {now['p50_ms']:.2f} ms")
+    return regressions
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Benchmark the finders against the mock GraphQL API")
+    parser.add_argument("--runs", type=int, default=20, help="Measured runs per finder")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured runs per finder first")
+    parser.add_argument("--finder", action="append", choices=sorted(FINDERS), help="Only these finders")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the token, account and response caches across runs")
+    parser.add_argument("--url", help="Use an already running mock_server.py instead of starting one")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--compare", help="Earlier JSON report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p50 slowdown (fraction)")
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        dataset, options = server_options(args)
+        server = start_mock_server(dataset, port=0, **options)
+        url = server.url
+
+    report: Dict = {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+        "finders": {},
+    }
+    try:
+        for name in args.finder or FINDERS:
+            print(f"Benchmarking {name} ({args.runs} run(s))...", file=sys.stderr)
+            report["finders"][name] = benchmark(name, url, args.runs, args.warmup, args.warm_cache)
+    finally:
+        if server:
+            server.shutdown()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_reports(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Small helpers for the on-disk caches kept by the GraphQL scripts
+
+Every cache is a JSON document guarded by an exclusive lock file, so it
+can be shared safely between threads, between the FES and Power Up
+finders, and between concurrent processes.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+# Configuration
+CACHE_DIR = os.getenv(
+    "OCTOPUS_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "octopus_powerups")
+)
+
+
+def cache_key(secret: str) -> str:
+    """Stable cache key for a secret such as an API key (the secret itself is never stored)."""
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+class LockedJSONFile:
+    """
+    A JSON file with restricted permissions, read and written under a lock.
+
+    Args:
+        path: Location of the JSON file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._thread_lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._key_locks_guard = threading.Lock()
+
+    @contextmanager
+    def _flock(self, lock_path: str, thread_lock: threading.Lock):
+        os.makedirs(os.path.dirname(self.path) or ".", mode=0o700, exist_ok=True)
+        with thread_lock:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    @contextmanager
+    def locked(self):
+        """Hold both the in-process and the cross-process lock on the whole file."""
+        with self._flock(self.lock_path, self._thread_lock):
+            yield
+
+    @contextmanager
+    def key_locked(self, key: str):
+        """
+        Hold a lock for a single entry.
+
+        Use this around slow work such as network calls that produce an
+        entry, so that other keys are not blocked while it runs.
+        """
+        with self._key_locks_guard:
+            thread_lock = self._key_locks.setdefault(key, threading.Lock())
+        with self._flock(f"{self.path}.{key[:16]}.lock", thread_lock):
+            yield
+
+    def read(self) -> Dict:
+        """Return the file contents, or an empty dict if missing or corrupt."""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def write(self, data: Dict) -> None:
+        """Atomically replace the file contents (mode 0600)."""
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
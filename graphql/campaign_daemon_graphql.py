@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Long-running campaign finder daemon with adaptive polling
+Runs the combined campaign finder in a loop, keeping the HTTP session and
+token warm between polls. Polls often during the usual announcement
+windows and in the run-up to known sessions, backs off while nothing
+changes, adds jitter, and re-fetches immediately on SIGHUP. With
+OCTOPUS_FEED_SERVER=1 it also serves the feeds over HTTP (see feed_server.py),
+swapping in new snapshots as soon as a poll writes them, and streams event
+changes to Server-Sent Events clients on /events.
+
+With the defaults that is about 44 polls a day (every 10 minutes across the
+six hours of announcement windows, backing off outside them) instead of
+the workflow's 4. Each poll is one batched request per meter point over a
+kept-alive connection, and a session announced in a window reaches the
+feeds within minutes rather than up to six hours later. Raise
+OCTOPUS_POLL_MIN_INTERVAL to trade that latency for fewer requests.
+
+Usage:
+
+    export OCTOPUS_API_KEY="sk_live_your_key"
+    python campaign_daemon_graphql.py
+"""
+
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from campaign_finder_graphql import run_all_meter_points, run_single_meter_point
+from event_model import CampaignEvent
+from feed_server import FeedStore, start_feed_server
+from feed_writer import report_changes, reset_results
+from metrics import export_metrics, reset_metrics, stage
+from notifications import ChangeBroadcaster, WebhookNotifier, notify_changes, webhook_notifier_from_env
+from octopus_client import get_client, is_transient_error
+from response_cache import StaleWhileRevalidateClient
+from token_store import get_cached_token
+
+# Configuration
+MIN_INTERVAL = float(os.getenv("OCTOPUS_POLL_MIN_INTERVAL", str(10 * 60)))
+MAX_INTERVAL = float(os.getenv("OCTOPUS_POLL_MAX_INTERVAL", str(6 * 60 * 60)))
+JITTER = float(os.getenv("OCTOPUS_POLL_JITTER", "0.1"))
+# Local (UK) times when new sessions are usually announced, e.g. "09:00-13:00,16:00-18:00"
+ANNOUNCEMENT_WINDOWS = os.getenv("OCTOPUS_ANNOUNCEMENT_WINDOWS", "09:00-13:00,16:00-18:00")
+# Poll at the minimum interval this long before a known session starts
+PRE_EVENT_LEAD = float(os.getenv("OCTOPUS_PRE_EVENT_LEAD", str(3 * 60 * 60)))
+LOCAL_TZ = ZoneInfo("Europe/London")
+
+
+def parse_windows(spec: str) -> List[Tuple[int, int]]:
+    """
+    Parse "HH:MM-HH:MM,..." into (start, end) minutes past local midnight.
+
+    Windows may wrap past midnight (e.g. "22:00-02:00").
+    """
+    windows = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        start, end = part.split("-")
+        start_h, start_m = map(int, start.split(":"))
+        end_h, end_m = map(int, end.split(":"))
+        windows.append((start_h * 60 + start_m, end_h * 60 + end_m))
+    return windows
+
+
+class AdaptiveScheduler:
+    """
+    Decides how long to wait before the next poll.
+
+    The interval doubles after every poll that changed nothing, up to
+    `max_interval`, and drops back to `min_interval` whenever a feed
+    changes. Inside an announcement window, or within `pre_event_lead`
+    seconds of a known session start, the minimum interval is always used.
+
+    Args:
+        min_interval: Shortest wait in seconds
+        max_interval: Longest wait in seconds
+        jitter: Random +/- fraction applied to every wait
+        windows: Announcement windows from parse_windows()
+        pre_event_lead: Seconds before a known start to poll quickly
+    """
+
+    def __init__(
+        self,
+        min_interval: float = MIN_INTERVAL,
+        max_interval: float = MAX_INTERVAL,
+        jitter: float = JITTER,
+        windows: Optional[List[Tuple[int, int]]] = None,
+        pre_event_lead: float = PRE_EVENT_LEAD
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.windows = parse_windows(ANNOUNCEMENT_WINDOWS) if windows is None else windows
+        self.pre_event_lead = pre_event_lead
+        self.interval = min_interval
+
+    def in_announcement_window(self, now: datetime) -> bool:
+        """True if `now` falls inside one of the announcement windows."""
+        local = now.astimezone(LOCAL_TZ)
+        minute = local.hour * 60 + local.minute
+        for start, end in self.windows:
+            if start <= end and start <= minute < end:
+                return True
+            if start > end and (minute >= start or minute < end):
+                return True
+        return False
+
+    def next_interval(self, changed: bool, upcoming_starts: List[datetime], now: Optional[datetime] = None) -> float:
+        """
+        Seconds to wait before the next poll.
+
+        Args:
+            changed: Whether the last poll changed any feed
+            upcoming_starts: Start times of known future sessions
+            now: Current time (default: now)
+        """
+        now = now or datetime.now(timezone.utc)
+        self.interval = self.min_interval if changed else min(self.interval * 2, self.max_interval)
+
+        interval = self.interval
+        if self.in_announcement_window(now):
+            interval = self.min_interval
+
+        for start in upcoming_starts:
+            until_start = (start - now).total_seconds()
+            if until_start <= self.pre_event_lead:
+                interval = self.min_interval
+            elif until_start - self.pre_event_lead < interval:
+                # Wake up in time for the run-up to this session
+                interval = max(until_start - self.pre_event_lead, self.min_interval)
+
+        # Never sleep through the start of the next announcement window
+        next_window = self.seconds_until_window(now)
+        if next_window is not None and 0 < next_window < interval:
+            interval = max(next_window, self.min_interval)
+
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def seconds_until_window(self, now: datetime) -> Optional[float]:
+        """Seconds until the next announcement window opens, or None if there are none."""
+        if not self.windows:
+            return None
+        local = now.astimezone(LOCAL_TZ)
+        midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+        candidates = []
+        for start, _ in self.windows:
+            for day in (0, 1):
+                opens = midnight + timedelta(days=day, minutes=start)
+                if opens > local:
+                    candidates.append((opens - local).total_seconds())
+        return min(candidates) if candidates else None
+
+
+def upcoming_starts(events: Dict[str, List[CampaignEvent]], now: Optional[datetime] = None) -> List[datetime]:
+    """Start times of all sessions, across campaigns, that have not started yet."""
+    now_epoch = (now or datetime.now(timezone.utc)).timestamp()
+    return [
+        datetime.fromtimestamp(start, timezone.utc)
+        for start in sorted(event.start for slug_events in events.values() for event in slug_events)
+        if start > now_epoch
+    ]
+
+
+def drain_webhooks(notifier: Optional[WebhookNotifier]) -> None:
+    """Wait for queued webhook deliveries and report how they went."""
+    if notifier is None:
+        return
+    delivered, failed = notifier.wait()
+    if delivered or failed:
+        print(f"Webhooks: {delivered} delivered, {failed} failed", file=sys.stderr)
+
+
+def poll_once(
+    api_key: str,
+    all_meters: bool,
+    feed_mode: str,
+    notifier: Optional[WebhookNotifier] = None,
+    broadcaster: Optional[ChangeBroadcaster] = None
+) -> Tuple[bool, Dict[str, List[CampaignEvent]]]:
+    """
+    Run one fetch-and-write cycle and push out any event changes.
+
+    Returns:
+        (changed, events) tuple: whether any feed changed, and the events
+        per campaign slug
+    """
+    reset_results()
+    reset_metrics()
+    try:
+        with stage("auth"):
+            token = get_cached_token(api_key)
+    except Exception as e:
+        if not is_transient_error(e):
+            raise
+        print(f"WARNING: Authentication failed, falling back to cached data: {e}", file=sys.stderr)
+        token = None
+
+    swr_client = StaleWhileRevalidateClient(get_client())
+    if all_meters:
+        events = run_all_meter_points(api_key, token, feed_mode, swr_client)
+    else:
+        events = run_single_meter_point(
+            api_key, token, os.getenv("OCTOPUS_ACCOUNT_NUMBER"), os.getenv("OCTOPUS_MPAN"), swr_client
+        )
+    swr_client.wait()
+    notify_changes(events, notifier, broadcaster)
+    return report_changes(), events
+
+
+def main():
+    """Main entry point."""
+    api_key = os.getenv("OCTOPUS_API_KEY")
+    all_meters = os.getenv("OCTOPUS_ALL_METERS", "").lower() in ("1", "true", "yes")
+    feed_mode = os.getenv("OCTOPUS_FEED_MODE", "combined")
+
+    if not api_key:
+        print("ERROR: OCTOPUS_API_KEY environment variable not set", file=sys.stderr)
+        sys.exit(1)
+
+    wake = threading.Event()
+    stop = threading.Event()
+
+    def on_sighup(signum, frame):
+        print("SIGHUP received, fetching now", file=sys.stderr)
+        wake.set()
+
+    def on_stop(signum, frame):
+        stop.set()
+        wake.set()
+
+    signal.signal(signal.SIGHUP, on_sighup)
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+
+    notifier = webhook_notifier_from_env()
+    store = None
+    broadcaster = None
+    if os.getenv("OCTOPUS_FEED_SERVER", "").lower() in ("1", "true", "yes"):
+        store = FeedStore()
+        broadcaster = ChangeBroadcaster()
+        start_feed_server(store, reload_interval=None, broadcaster=broadcaster)
+
+    scheduler = AdaptiveScheduler()
+    events: Dict[str, List[CampaignEvent]] = {}
+
+    while not stop.is_set():
+        # Cleared before polling, so a SIGHUP that arrives mid-poll triggers another one
+        wake.clear()
+        started = time.monotonic()
+        try:
+            changed, events = poll_once(api_key, all_meters, feed_mode, notifier, broadcaster)
+            export_metrics(success=True)
+        except Exception as e:
+            print(f"ERROR: Poll failed: {e}", file=sys.stderr)
+            export_metrics(success=False)
+            changed = False
+        drain_webhooks(notifier)
+
+        if store is not None and changed:
+            store.reload()
+        if stop.is_set():
+            break
+
+        interval = scheduler.next_interval(changed, upcoming_starts(events))
+        print(
+            f"[{datetime.now(timezone.utc).isoformat(timespec='seconds')}] "
+            f"poll took {time.monotonic() - started:.1f}s, next in {interval / 60:.1f} min",
+            file=sys.stderr
+        )
+        wake.wait(interval)
+
+    # Don't exit with deliveries still in flight
+    drain_webhooks(notifier)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Combined campaign finder using Octopus Energy GraphQL API
+Fetches every campaign in the campaign registry (by default Free Electricity
+Sessions and Power Ups) in a single batched request and writes the same JSON
+files as fes_finder_graphql.py and power_up_finder_graphql.py. Set
+OCTOPUS_ALL_METERS=1 to fetch every account and IMPORT MPAN concurrently
+instead of just the first, and see campaign_registry.py for configuring
+campaigns.
+"""
+
+import os
+import sqlite3
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import fes_finder_graphql
+from account_cache import get_account_cache, is_unknown_supply_point_error
+from campaign_registry import Campaign, CampaignRegistry, resolve_campaigns
+from campaigns import fetch_campaign_events_batch
+from change_log import record_feed_changes
+from event_model import CampaignEvent
+from feed_variants import write_feed_variants
+from feed_writer import report_changes
+from fanout import fetch_meter_points_concurrently, merge_events, meter_point_targets
+from history_store import HistoryStore, history_rows
+from metrics import run_instrumented, stage
+from notifications import notify_changes, webhook_notifier_from_env
+from octopus_client import GraphQLError, get_client, is_transient_error
+from response_cache import StaleWhileRevalidateClient, write_feed_metadata
+from token_store import get_cached_token
+
+
+def publish_feed(campaign: Campaign, events: List[CampaignEvent], filename: str, client: StaleWhileRevalidateClient) -> None:
+    """Write a campaign's feed, its compact variants, its metadata sidecar and its change log."""
+    with stage("output_write"):
+        output_path = campaign.write(events, filename)
+        write_feed_variants(output_path)
+        write_feed_metadata(output_path, client)
+        record_feed_changes(output_path, campaign.slug, events)
+
+
+def record_history(rows: List[Tuple]) -> None:
+    """Store this run's events in the history database; failures only warn."""
+    try:
+        with stage("output_write"):
+            HistoryStore().record(rows)
+    except (sqlite3.Error, OSError) as e:
+        print(f"WARNING: Could not record event history: {e}", file=sys.stderr)
+
+
+def per_mpan_filename(filename: str, mpan: str) -> str:
+    """Insert the MPAN before the extension, e.g. powerup_graphql_1234567890123.json."""
+    root, ext = os.path.splitext(filename)
+    return f"{root}_{mpan}{ext}"
+
+
+def run_all_meter_points(
+    api_key: str,
+    token: Optional[str],
+    feed_mode: str,
+    client: StaleWhileRevalidateClient,
+    registry: Optional[CampaignRegistry] = None
+) -> Dict[str, List[CampaignEvent]]:
+    """
+    Fetch every campaign for every account and IMPORT MPAN concurrently.
+    
+    Args:
+        api_key: Octopus Energy API key (used as the cache key)
+        token: JWT authentication token (None to serve cached data only)
+        feed_mode: `combined` for one merged feed per campaign, or
+            `per_mpan` for one feed per campaign and MPAN
+        client: Cache-backed client used for the campaign requests
+        registry: Campaign registry (default: campaign_registry.load_registry())
+    
+    Returns:
+        Events per campaign slug, merged across meter points; campaigns
+        that could not be fetched are left out and their feeds untouched
+    """
+    account_cache = get_account_cache()
+    with stage("account_discovery"):
+        accounts = account_cache.get_accounts(api_key, token)
+    with stage("mpan_discovery"):
+        meter_points = meter_point_targets(accounts)
+    if not meter_points:
+        raise Exception("No electricity meter points found on any account")
+    campaigns = resolve_campaigns(api_key, token, [account["number"] for account in accounts], registry)
+    
+    print(f"Fetching {len(campaigns)} campaign(s) for {len(meter_points)} meter point(s)...", file=sys.stderr)
+    with stage("event_fetch"):
+        results, errors = fetch_meter_points_concurrently(
+            token, meter_points, [campaign.slug for campaign in campaigns], client=client
+        )
+    
+    if any(is_unknown_supply_point_error(e) for e in errors.values()):
+        # Rediscover meter points on the next run
+        account_cache.invalidate(api_key)
+    if not results:
+        raise next(iter(errors.values()))
+    
+    events = {}
+    for campaign in campaigns:
+        slug = campaign.slug
+        if feed_mode == "per_mpan":
+            # Each meter point's feed stands alone, so publish the ones that were fetched
+            for (_, mpan), by_slug in results.items():
+                if slug in by_slug:
+                    publish_feed(campaign, by_slug[slug], per_mpan_filename(campaign.output, mpan), client)
+        
+        missing = [meter_point for meter_point in meter_points if slug not in results.get(meter_point, {})]
+        if missing:
+            # A merged feed without these meter points would report their events as removed
+            print(f"WARNING: {slug} not updated: fetch failed for {len(missing)} meter point(s)", file=sys.stderr)
+            continue
+        events[slug] = merge_events(by_slug[slug] for by_slug in results.values())
+        if feed_mode != "per_mpan":
+            publish_feed(campaign, events[slug], campaign.output, client)
+    
+    record_history([
+        row
+        for (account_number, mpan), by_slug in results.items()
+        for slug, slug_events in by_slug.items()
+        for row in history_rows(slug, mpan, slug_events, account_number)
+    ])
+    return events
+
+
+def run_single_meter_point(
+    api_key: str,
+    token: Optional[str],
+    account_number: Optional[str],
+    mpan: Optional[str],
+    client: StaleWhileRevalidateClient,
+    registry: Optional[CampaignRegistry] = None
+) -> Dict[str, List[CampaignEvent]]:
+    """
+    Fetch every campaign for one meter point in a single batched request.
+    
+    Args:
+        api_key: Octopus Energy API key (used as the cache key)
+        token: JWT authentication token (None to serve cached data only)
+        account_number: Account number, or None to auto-discover
+        mpan: MPAN, or None to auto-discover
+        client: Cache-backed client used for the campaign requests
+        registry: Campaign registry (default: campaign_registry.load_registry())
+    
+    Returns:
+        Events per campaign slug; campaigns that could not be fetched are
+        left out and their feeds untouched
+    """
+    discovered = not (account_number and mpan)
+    account_number, mpan = fes_finder_graphql.discover_account_and_mpan(api_key, token, account_number, mpan)
+    campaigns = {campaign.slug: campaign for campaign in resolve_campaigns(api_key, token, [account_number], registry)}
+    
+    targets = [(slug, mpan) for slug in campaigns]
+    print(f"Fetching {len(targets)} campaign(s) in one request...", file=sys.stderr)
+    try:
+        with stage("event_fetch"):
+            results, errors = fetch_campaign_events_batch(token, account_number, targets, client=client)
+    except GraphQLError as e:
+        if not is_unknown_supply_point_error(e):
+            raise
+        get_account_cache().invalidate(api_key)
+        if not discovered:
+            raise
+        print("Supply point rejected, refreshing account details...", file=sys.stderr)
+        account_number, mpan = fes_finder_graphql.discover_account_and_mpan(
+            api_key, token, os.getenv("OCTOPUS_ACCOUNT_NUMBER"), os.getenv("OCTOPUS_MPAN"), refresh=True
+        )
+        targets = [(slug, mpan) for slug in campaigns]
+        with stage("event_fetch"):
+            results, errors = fetch_campaign_events_batch(token, account_number, targets, client=client)
+    
+    if any(is_unknown_supply_point_error(e) for e in errors.values()):
+        # Rediscover meter points on the next run
+        get_account_cache().invalidate(api_key)
+    
+    events = {}
+    for slug, mpan in targets:
+        if (slug, mpan) in errors:
+            # Keep the previous feed rather than publish it without this campaign's events
+            print(f"WARNING: {slug} not updated: {errors[(slug, mpan)]}", file=sys.stderr)
+            continue
+        print(f"{slug}: {len(results[(slug, mpan)])} event(s)", file=sys.stderr)
+        publish_feed(campaigns[slug], results[(slug, mpan)], campaigns[slug].output, client)
+        events[slug] = results[(slug, mpan)]
+    
+    record_history([
+        row for slug, slug_events in events.items() for row in history_rows(slug, mpan, slug_events, account_number)
+    ])
+    return events
+
+
+def main():
+    """Main entry point."""
+    api_key = os.getenv("OCTOPUS_API_KEY")
+    account_number = os.getenv("OCTOPUS_ACCOUNT_NUMBER")  # Optional - will auto-discover if not provided
+    mpan = os.getenv("OCTOPUS_MPAN")  # Optional - will auto-fetch if not provided
+    all_meters = os.getenv("OCTOPUS_ALL_METERS", "").lower() in ("1", "true", "yes")
+    feed_mode = os.getenv("OCTOPUS_FEED_MODE", "combined")  # 'combined' or 'per_mpan'
+    
+    if not api_key:
+        print("ERROR: OCTOPUS_API_KEY environment variable not set", file=sys.stderr)
+        sys.exit(1)
+    
+    try:
+        print("Authenticating with Octopus Energy API using API key...", file=sys.stderr)
+        try:
+            with stage("auth"):
+                token = get_cached_token(api_key)
+        except Exception as e:
+            # Carry on through outages so that cached responses can still be served
+            if not is_transient_error(e):
+                raise
+            print(f"WARNING: Authentication failed, falling back to cached data: {e}", file=sys.stderr)
+            token = None
+        swr_client = StaleWhileRevalidateClient(get_client())
+        
+        if all_meters:
+            events = run_all_meter_points(api_key, token, feed_mode, swr_client)
+        else:
+            events = run_single_meter_point(api_key, token, account_number, mpan, swr_client)
+        
+        notifier = webhook_notifier_from_env()
+        notify_changes(events, notifier)
+        
+        if swr_client.stale:
+            print("WARNING: API unavailable - feeds were built from cached data", file=sys.stderr)
+        report_changes()
+        swr_client.wait()
+        if notifier:
+            delivered, failed = notifier.wait()
+            print(f"Webhooks: {delivered} delivered, {failed} failed", file=sys.stderr)
+        
+        stats = get_client().connection_stats()
+        print(
+            f"HTTP: {stats['requests']} request(s), {stats['connections_opened']} connection(s) opened, "
+            f"{stats['connections_reused']} reused",
+            file=sys.stderr
+        )
+    
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_instrumented(main)
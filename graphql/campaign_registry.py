@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Config-driven registry of the campaigns fetched by the combined finder
+
+Which campaigns are fetched, and how each one's feed is written, comes
+from a JSON file (OCTOPUS_CAMPAIGNS_CONFIG) rather than being hard-coded.
+Without a config file the registry holds the two campaigns the repository
+has always published:
+
+    {
+      "campaigns": [
+        {"slug": "free_electricity", "output": "free_electricity_session_graphql.json",
+         "format": "free_electricity"},
+        {"slug": "power_ups_ukpn", "output": "powerup_graphql.json", "format": "power_up"}
+      ],
+      "auto_detect": false,
+      "auto_detect_pattern": "^(free_electricity|power_ups_\\\\w+)$"
+    }
+
+Each campaign has a `slug`, an `output` file name and a `format`:
+
+- `free_electricity`: future sessions as {start, end, code}, as written by fes_finder_graphql.py
+- `power_up`: future events as {start, end}, as written by power_up_finder_graphql.py
+- `events`: future events as {name, code, start, end}
+
+A campaign can be switched off with `"enabled": false`. With
+`auto_detect` on (or OCTOPUS_CAMPAIGN_AUTO_DETECT=1) the campaigns each
+account is enrolled in are looked up as well, and any matching
+`auto_detect_pattern` that are not configured are added with default
+rules: `{slug}_graphql.json`, in the `power_up` format for `power_ups_*`
+slugs and the `events` format otherwise. Detected campaigns are cached
+for as long as the account topology.
+"""
+
+import json
+import os
+import re
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import fes_finder_graphql
+import power_up_finder_graphql
+from account_cache import DEFAULT_TTL
+from cache_file import CACHE_DIR, LockedJSONFile, cache_key
+from campaigns import FREE_ELECTRICITY_SLUG, POWER_UPS_UKPN_SLUG
+from event_model import CampaignEvent, not_ended, sort_by_start
+from feed_writer import FEED_DIR, output_results, write_json_if_changed
+from octopus_client import GraphQLClient, get_client
+
+# Configuration
+CAMPAIGNS_CONFIG = os.getenv("OCTOPUS_CAMPAIGNS_CONFIG")
+AUTO_DETECT = os.getenv("OCTOPUS_CAMPAIGN_AUTO_DETECT", "").lower() in ("1", "true", "yes")
+DEFAULT_CAMPAIGN_CACHE = os.getenv("OCTOPUS_CAMPAIGN_CACHE", os.path.join(CACHE_DIR, "campaigns.json"))
+DEFAULT_AUTO_DETECT_PATTERN = r"^(free_electricity|power_ups_\w+)$"
+
+ACCOUNT_CAMPAIGNS_QUERY = """
+query AccountCampaignsQuery($accountNumber: String!) {
+  account(accountNumber: $accountNumber) {
+    campaigns {
+      slug
+      startDate
+      expiryDate
+    }
+  }
+}
+"""
+
+
+def write_free_electricity_output(events: List[CampaignEvent], filename: str, output_dir: Optional[str] = None) -> str:
+    """Write Free Electricity Sessions exactly as the FES finder does."""
+    return fes_finder_graphql.write_sessions_to_file(events, filename, output_dir)
+
+
+def write_power_up_output(events: List[CampaignEvent], filename: str, output_dir: Optional[str] = None) -> str:
+    """Write Power Up events exactly as the Power Up finder does."""
+    future_events = power_up_finder_graphql.filter_future_events(events)
+    output_file = power_up_finder_graphql.write_events_to_file(future_events, filename, output_dir)
+    if output_results().get(output_file):
+        print(f"Written {len(future_events)} future Power Up event(s) to {output_file}", file=sys.stderr)
+    else:
+        print(f"Unchanged: {len(future_events)} future Power Up event(s) already in {output_file}", file=sys.stderr)
+    return output_file
+
+
+def write_events_output(events: List[CampaignEvent], filename: str, output_dir: Optional[str] = None) -> str:
+    """Write future events of any campaign with their name and code, sorted by start."""
+    output = [
+        {"name": event.name, "code": event.code, "start": event.start_iso, "end": event.end_iso}
+        for event in sort_by_start(not_ended(events))
+    ]
+    if output_dir is None:
+        output_dir = FEED_DIR
+    output_file = os.path.join(output_dir, filename)
+    write_json_if_changed(output_file, output)
+    return output_file
+
+
+# Format name -> output writer
+FORMATS: Dict[str, Callable[[List[CampaignEvent], str, Optional[str]], str]] = {
+    "free_electricity": write_free_electricity_output,
+    "power_up": write_power_up_output,
+    "events": write_events_output,
+}
+
+
+class Campaign:
+    """
+    One campaign and the rules for its feed.
+
+    Args:
+        slug: Campaign slug as used by customerFlexibilityCampaignEvents
+        output: Feed file name, relative to OCTOPUS_FEED_DIR (the repository root)
+        format: Key of FORMATS
+        enabled: Whether the campaign is fetched at all
+        detected: True if the campaign was added by auto-detection
+    """
+
+    def __init__(self, slug: str, output: str, format: str = "events", enabled: bool = True, detected: bool = False):
+        if format not in FORMATS:
+            raise Exception(f"Unknown output format '{format}' for campaign '{slug}' (expected one of {sorted(FORMATS)})")
+        self.slug = slug
+        self.output = output
+        self.format = format
+        self.enabled = enabled
+        self.detected = detected
+
+    @classmethod
+    def with_defaults(cls, slug: str, detected: bool = False) -> "Campaign":
+        """A campaign with the default rules for its slug."""
+        return cls(slug, f"{slug}_graphql.json", "power_up" if slug.startswith("power_ups_") else "events",
+                   detected=detected)
+
+    def write(self, events: List[CampaignEvent], filename: Optional[str] = None, output_dir: Optional[str] = None) -> str:
+        """
+        Write the campaign's feed.
+
+        Args:
+            events: Fetched events of this campaign
+            filename: Override the configured output file name
+            output_dir: Directory to write to (default: OCTOPUS_FEED_DIR)
+
+        Returns:
+            Path of the written file
+        """
+        return FORMATS[self.format](events, filename or self.output, output_dir)
+
+    def __repr__(self) -> str:
+        return f"Campaign({self.slug!r}, {self.output!r}, {self.format!r})"
+
+
+class CampaignRegistry:
+    """
+    Configured campaigns, in config order.
+
+    Args:
+        campaigns: Configured campaigns
+        auto_detect: Also fetch campaigns the accounts are enrolled in
+        auto_detect_pattern: Only detected slugs matching this regex are added
+    """
+
+    def __init__(
+        self,
+        campaigns: Iterable[Campaign],
+        auto_detect: bool = False,
+        auto_detect_pattern: str = DEFAULT_AUTO_DETECT_PATTERN
+    ):
+        self.campaigns: Dict[str, Campaign] = {}
+        for campaign in campaigns:
+            if campaign.slug in self.campaigns:
+                raise Exception(f"Campaign '{campaign.slug}' is configured more than once")
+            self.campaigns[campaign.slug] = campaign
+        self.auto_detect = auto_detect
+        self.auto_detect_pattern = re.compile(auto_detect_pattern)
+
+    def get(self, slug: str) -> Campaign:
+        """The configured campaign, or one with default rules for an unknown slug."""
+        return self.campaigns.get(slug) or Campaign.with_defaults(slug)
+
+    def enabled(self) -> List[Campaign]:
+        return [campaign for campaign in self.campaigns.values() if campaign.enabled]
+
+    def add_detected(self, slugs: Iterable[str]) -> List[Campaign]:
+        """
+        Add detected campaigns that match the pattern and are not configured.
+
+        Returns:
+            The campaigns that were added
+        """
+        added = []
+        for slug in slugs:
+            if slug not in self.campaigns and self.auto_detect_pattern.search(slug):
+                self.campaigns[slug] = Campaign.with_defaults(slug, detected=True)
+                added.append(self.campaigns[slug])
+        return added
+
+
+DEFAULT_CONFIG: Dict = {
+    "campaigns": [
+        {"slug": FREE_ELECTRICITY_SLUG, "output": "free_electricity_session_graphql.json", "format": "free_electricity"},
+        {"slug": POWER_UPS_UKPN_SLUG, "output": "powerup_graphql.json", "format": "power_up"},
+    ],
+}
+
+
+def registry_from_config(config: Dict) -> CampaignRegistry:
+    """Build a registry from a parsed config document (see the module docstring)."""
+    campaigns = []
+    for entry in config.get("campaigns", []):
+        if "slug" not in entry:
+            raise Exception(f"Campaign entry without a slug: {entry}")
+        defaults = Campaign.with_defaults(entry["slug"])
+        campaigns.append(Campaign(
+            entry["slug"],
+            entry.get("output", defaults.output),
+            entry.get("format", defaults.format),
+            entry.get("enabled", True)
+        ))
+    return CampaignRegistry(
+        campaigns,
+        auto_detect=config.get("auto_detect", False),
+        auto_detect_pattern=config.get("auto_detect_pattern", DEFAULT_AUTO_DETECT_PATTERN)
+    )
+
+
+def load_registry(path: Optional[str] = CAMPAIGNS_CONFIG, auto_detect: bool = AUTO_DETECT) -> CampaignRegistry:
+    """
+    Load the campaign registry.
+
+    Args:
+        path: JSON config file (default: OCTOPUS_CAMPAIGNS_CONFIG, or the
+            built-in free_electricity and power_ups_ukpn campaigns)
+        auto_detect: Turn auto-detection on even if the config leaves it off
+
+    Returns:
+        CampaignRegistry
+    """
+    config = DEFAULT_CONFIG
+    if path:
+        try:
+            with open(path) as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            raise Exception(f"Could not read campaign config {path}: {e}")
+    registry = registry_from_config(config)
+    registry.auto_detect = registry.auto_detect or auto_detect
+    return registry
+
+
+def fetch_enrolled_campaigns(token: str, account_number: str, client: Optional[GraphQLClient] = None) -> List[str]:
+    """
+    List the slugs of the campaigns an account is enrolled in.
+
+    Args:
+        token: JWT authentication token
+        account_number: Octopus account number
+        client: Optional client (defaults to the shared client)
+
+    Returns:
+        Campaign slugs
+    """
+    client = client or get_client()
+    data = client.execute(ACCOUNT_CAMPAIGNS_QUERY, {"accountNumber": account_number}, token=token)
+    return [campaign["slug"] for campaign in (data.get("account") or {}).get("campaigns") or [] if campaign.get("slug")]
+
+
+class CampaignDetector:
+    """
+    Enrolled campaigns per account, cached on disk with a TTL.
+
+    Args:
+        path: Location of the JSON cache file
+        ttl: Seconds before an account's campaigns are looked up again
+    """
+
+    def __init__(self, path: str = DEFAULT_CAMPAIGN_CACHE, ttl: int = DEFAULT_TTL):
+        self.file = LockedJSONFile(path)
+        self.ttl = ttl
+
+    def detect(
+        self,
+        api_key: str,
+        token: Optional[str],
+        account_numbers: Iterable[str],
+        client: Optional[GraphQLClient] = None
+    ) -> List[str]:
+        """
+        Slugs of the campaigns any of the accounts is enrolled in.
+
+        Lookup failures only warn: the configured campaigns are still fetched.
+
+        Args:
+            api_key: API key the accounts belong to (used as the cache key)
+            token: JWT authentication token (None to use cached results only)
+            account_numbers: Accounts to look up
+            client: Optional client (defaults to the shared client)
+
+        Returns:
+            Campaign slugs in first-seen order
+        """
+        key = cache_key(api_key)
+        with self.file.locked():
+            entries = self.file.read().get(key, {})
+
+        slugs: Dict[str, None] = {}
+        fetched = {}
+        for account_number in account_numbers:
+            entry = entries.get(account_number)
+            if entry and (not token or time.time() - entry["fetched_at"] < self.ttl):
+                slugs.update(dict.fromkeys(entry["slugs"]))
+                continue
+            if not token:
+                continue
+            try:
+                account_slugs = fetch_enrolled_campaigns(token, account_number, client)
+            except Exception as e:
+                print(f"WARNING: Campaign detection failed for {account_number}: {e}", file=sys.stderr)
+                if entry:
+                    slugs.update(dict.fromkeys(entry["slugs"]))
+                continue
+            fetched[account_number] = {"fetched_at": time.time(), "slugs": account_slugs}
+            slugs.update(dict.fromkeys(account_slugs))
+
+        if fetched:
+            with self.file.locked():
+                all_entries = self.file.read()
+                all_entries.setdefault(key, {}).update(fetched)
+                self.file.write(all_entries)
+        return list(slugs)
+
+
+def resolve_campaigns(
+    api_key: str,
+    token: Optional[str],
+    account_numbers: Iterable[str],
+    registry: Optional[CampaignRegistry] = None,
+    client: Optional[GraphQLClient] = None
+) -> List[Campaign]:
+    """
+    The campaigns to fetch: the enabled configured ones, plus any detected
+    ones when auto-detection is on.
+
+    Args:
+        api_key: API key (used as the detection cache key)
+        token: JWT authentication token
+        account_numbers: Accounts whose enrolments are detected
+        registry: Campaign registry (default: load_registry())
+        client: Optional client (defaults to the shared client)
+
+    Returns:
+        Campaigns in config order, detected campaigns last
+    """
+    registry = registry or load_registry()
+    if registry.auto_detect:
+        for campaign in registry.add_detected(CampaignDetector().detect(api_key, token, account_numbers, client)):
+            print(f"Detected campaign '{campaign.slug}', writing it to {campaign.output}", file=sys.stderr)
+    campaigns = registry.enabled()
+    if not campaigns:
+        raise Exception("No campaigns enabled in the campaign registry")
+    return campaigns
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Flexibility campaign queries shared by the GraphQL finder scripts
+
+`customerFlexibilityCampaignEvents` is the same query for every campaign;
+only the slug and supply point change. This module builds a single
+aliased GraphQL document covering any number of (campaign, MPAN) pairs,
+so all campaigns can be fetched in one HTTP request.
+"""
+
+import os
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from event_model import CampaignEvent
+from octopus_client import GraphQLClient, GraphQLError, get_client
+
+FREE_ELECTRICITY_SLUG = "free_electricity"
+POWER_UPS_UKPN_SLUG = "power_ups_ukpn"
+# Power Up campaign of the Power Up finders (sync and async), e.g. another DNO region's power_ups_* slug
+POWER_UP_SLUG = os.getenv("OCTOPUS_POWER_UP_SLUG", POWER_UPS_UKPN_SLUG)
+DEFAULT_PAGE_SIZE = int(os.getenv("OCTOPUS_PAGE_SIZE", "50"))
+
+EVENT_NODE_FIELDS = """
+          node {
+            name
+            code
+            startAt
+            endAt
+          }"""
+
+CAMPAIGN_EVENTS_PAGE_QUERY = """
+query CampaignEventsPage($accountNumber: String!, $mpan: String!, $campaignSlug: String!, $first: Int!, $after: String) {
+  customerFlexibilityCampaignEvents(
+    accountNumber: $accountNumber
+    supplyPointIdentifier: $mpan
+    campaignSlug: $campaignSlug
+    first: $first
+    after: $after
+  ) {
+    edges {%s
+    }
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+  }
+}
+""" % EVENT_NODE_FIELDS
+
+
+def iter_campaign_events(
+    token: str,
+    account_number: str,
+    mpan: str,
+    campaign_slug: str,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    ends_after: Optional[datetime] = None,
+    after: Optional[str] = None,
+    client: Optional[GraphQLClient] = None
+) -> Iterator[CampaignEvent]:
+    """
+    Stream every event of a campaign, following `pageInfo` cursors.
+
+    Events are yielded as each page arrives, so only one page is held in
+    memory at a time. The API does not document the order of events, so
+    every page is fetched; `ends_after` only filters out ended events.
+
+    Args:
+        token: JWT authentication token
+        account_number: Octopus account number
+        mpan: Supply point identifier
+        campaign_slug: Campaign slug (e.g. free_electricity)
+        page_size: Events requested per page
+        ends_after: Skip events that end at or before this time
+        after: Cursor to resume from
+        client: Optional client (defaults to the shared client)
+
+    Yields:
+        CampaignEvent records
+    """
+    client = client or get_client()
+    variables = {
+        "accountNumber": account_number,
+        "mpan": mpan,
+        "campaignSlug": campaign_slug,
+        "first": page_size,
+        "after": after
+    }
+    ends_after_epoch = ends_after.timestamp() if ends_after is not None else None
+
+    while True:
+        data = client.execute(CAMPAIGN_EVENTS_PAGE_QUERY, variables, token=token)
+        events, cursor = parse_events_page(data["customerFlexibilityCampaignEvents"], ends_after_epoch)
+        yield from events
+        if cursor is None:
+            return
+        variables["after"] = cursor
+
+
+def parse_events_page(
+    connection: Dict,
+    ends_after_epoch: Optional[float] = None
+) -> Tuple[List[CampaignEvent], Optional[str]]:
+    """
+    Parse one page of a customerFlexibilityCampaignEvents connection.
+
+    Args:
+        connection: The connection (`edges` and `pageInfo`) from the response
+        ends_after_epoch: Drop events ending at or before this Unix time
+
+    Returns:
+        (events, cursor) tuple; the cursor is None when there is no next page
+    """
+    events = []
+    for edge in connection["edges"]:
+        event = CampaignEvent.from_node(edge["node"])
+        if ends_after_epoch is not None and event.end <= ends_after_epoch:
+            continue
+        events.append(event)
+
+    page_info = connection.get("pageInfo") or {}
+    if not page_info.get("hasNextPage") or not page_info.get("endCursor"):
+        return events, None
+    return events, page_info["endCursor"]
+
+
+def build_campaign_events_query(
+    targets: List[Tuple[str, str]],
+    first: int = DEFAULT_PAGE_SIZE
+) -> Tuple[str, Dict]:
+    """
+    Build one aliased query for several (campaign slug, MPAN) pairs.
+
+    Args:
+        targets: List of (campaign_slug, mpan) pairs
+        first: Page size requested for every campaign
+
+    Returns:
+        (query, variables) tuple; the result for targets[i] is under alias `c{i}`
+    """
+    params = ["$accountNumber: String!", "$first: Int!"]
+    variables: Dict = {"first": first}
+    fields = []
+
+    for i, (slug, mpan) in enumerate(targets):
+        params.append(f"$slug{i}: String!")
+        params.append(f"$mpan{i}: String!")
+        variables[f"slug{i}"] = slug
+        variables[f"mpan{i}"] = mpan
+        fields.append(f"""
+      c{i}: customerFlexibilityCampaignEvents(
+        accountNumber: $accountNumber
+        supplyPointIdentifier: $mpan{i}
+        campaignSlug: $slug{i}
+        first: $first
+      ) {{
+        edges {{{EVENT_NODE_FIELDS}
+        }}
+        pageInfo {{
+          hasNextPage
+          endCursor
+        }}
+      }}""")
+
+    query = f"""
+    query CampaignEventsBatch({", ".join(params)}) {{{"".join(fields)}
+    }}
+    """
+    return query, variables
+
+
+def split_batch_response(
+    targets: List[Tuple[str, str]],
+    data: Optional[Dict],
+    error: Optional[GraphQLError] = None
+) -> Tuple[Dict[Tuple[str, str], Dict], Dict[Tuple[str, str], GraphQLError]]:
+    """
+    Split a batched response into per-target connections and per-target errors.
+
+    A GraphQL error on one alias (e.g. an MPAN not enrolled in a campaign)
+    nulls only that alias, so the other campaigns are still usable. Errors
+    are matched to aliases by the first element of their `path`.
+
+    Args:
+        targets: The (campaign_slug, mpan) pairs the query was built for
+        data: The (possibly partial) `data` member of the response
+        error: The GraphQLError raised for the response, if any
+
+    Returns:
+        (connections, errors) tuple keyed by target
+
+    Raises:
+        GraphQLError: `error` itself, if no alias came back at all
+    """
+    data = data or {}
+    connections = {}
+    errors = {}
+    for i, target in enumerate(targets):
+        alias = f"c{i}"
+        if data.get(alias) is not None:
+            connections[target] = data[alias]
+            continue
+        alias_errors = [e for e in (error.errors if error else []) if (e.get("path") or [None])[0] == alias]
+        errors[target] = GraphQLError(alias_errors or (error.errors if error else [{"message": f"No data for {alias}"}]))
+
+    if error is not None and not connections:
+        raise error
+    return connections, errors
+
+
+def fetch_campaign_events_batch(
+    token: str,
+    account_number: str,
+    targets: List[Tuple[str, str]],
+    page_size: int = DEFAULT_PAGE_SIZE,
+    client: Optional[GraphQLClient] = None
+) -> Tuple[Dict[Tuple[str, str], List[CampaignEvent]], Dict[Tuple[str, str], GraphQLError]]:
+    """
+    Fetch events for several (campaign slug, MPAN) pairs in a single request.
+
+    The first page of every campaign comes back in one round trip; only
+    campaigns with more events than fit on a page need follow-up requests.
+    A GraphQL error on one campaign does not lose the others: it is
+    reported in `errors` instead.
+
+    Args:
+        token: JWT authentication token
+        account_number: Octopus account number
+        targets: List of (campaign_slug, mpan) pairs
+        page_size: Events requested per campaign per page
+        client: Optional client (defaults to the shared client)
+
+    Returns:
+        (results, errors) tuple: results maps each (campaign_slug, mpan)
+        pair that was fetched to its CampaignEvent records; errors maps the
+        pairs that failed to their GraphQLError
+
+    Raises:
+        GraphQLError: if every campaign failed (e.g. an unknown supply point)
+    """
+    query, variables = build_campaign_events_query(targets, page_size)
+    variables["accountNumber"] = account_number
+
+    client = client or get_client()
+    try:
+        connections, errors = split_batch_response(targets, client.execute(query, variables, token=token))
+    except GraphQLError as e:
+        connections, errors = split_batch_response(targets, e.data, e)
+
+    results = {}
+    for (slug, mpan), connection in connections.items():
+        events, cursor = parse_events_page(connection)
+        if cursor is not None:
+            try:
+                events.extend(iter_campaign_events(
+                    token, account_number, mpan, slug,
+                    page_size=page_size, after=cursor, client=client
+                ))
+            except GraphQLError as e:
+                # A partial list would look like deleted events, so report the campaign as failed
+                errors[(slug, mpan)] = e
+                continue
+        results[(slug, mpan)] = events
+    return results, errors
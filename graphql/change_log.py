@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Append-only change log next to each feed
+
+Every feed gets a JSON Lines file (e.g. `powerup_graphql.changes.jsonl`)
+of numbered `added`, `changed` and `removed` records keyed by event
+`code`, so clients can sync incrementally by asking for everything after
+the last sequence number they saw instead of diffing whole snapshots.
+
+The current state is rebuilt from the log itself, so the first run logs
+every known event as `added` and a run that could not be committed is
+simply logged again by the next one. Once more than
+OCTOPUS_CHANGELOG_COMPACT_AT records have been appended since the last
+compaction the log is compacted: only the latest record per code is kept,
+and `removed` records older than OCTOPUS_CHANGELOG_TOMBSTONE_DAYS are
+dropped. A compacted log starts with a
+`{"compacted_through": N, "last_seq": M, "compacted_records": K}` line; a
+client that last saw a sequence number below N must discard its state and
+rebuild it from the records returned with `reset: true`. K, the number of
+records the compaction kept, means a feed with more live events than
+OCTOPUS_CHANGELOG_COMPACT_AT is not compacted again on every run.
+"""
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from cache_file import CACHE_DIR, LockedJSONFile, cache_key
+from event_model import CampaignEvent
+from feed_writer import append_bytes, write_bytes_if_changed
+from notifications import diff_events, event_index
+
+# Configuration
+DEFAULT_COMPACT_AT = int(os.getenv("OCTOPUS_CHANGELOG_COMPACT_AT", "500"))
+DEFAULT_TOMBSTONE_DAYS = float(os.getenv("OCTOPUS_CHANGELOG_TOMBSTONE_DAYS", "30"))
+
+
+def changes_path(output_path: str) -> str:
+    """Change log path for a feed, e.g. powerup_graphql.changes.jsonl."""
+    root, _ = os.path.splitext(output_path)
+    return f"{root}.changes.jsonl"
+
+
+def parse_log(content: bytes) -> Tuple[Dict, List[Dict]]:
+    """
+    Split change log contents into its header and records.
+
+    Returns:
+        ({"compacted_through": N, "last_seq": M, "compacted_records": K}, records) tuple
+    """
+    header = {"compacted_through": 0, "last_seq": 0, "compacted_records": 0}
+    records = []
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if "compacted_through" in item:
+            header.update(item)
+        else:
+            records.append(item)
+            header["last_seq"] = max(header["last_seq"], item["seq"])
+    return header, records
+
+
+def changes_since(content: bytes, since: int) -> Dict:
+    """
+    Answer a `since=<seq>` query from change log contents.
+
+    Args:
+        content: Change log file contents
+        since: Last sequence number the client has applied (0 for everything)
+
+    Returns:
+        See select_changes()
+    """
+    header, records = parse_log(content)
+    return select_changes(header, records, since)
+
+
+def select_changes(header: Dict, records: List[Dict], since: int) -> Dict:
+    """
+    Answer a `since=<seq>` query from a parsed change log.
+
+    Returns:
+        {"seq": latest sequence number, "reset": bool, "changes": [...]};
+        when `reset` is true the client must drop its state and apply the
+        returned changes to an empty one
+    """
+    reset = since < header["compacted_through"]
+    return {
+        "seq": header["last_seq"],
+        "reset": reset,
+        "changes": records if reset else [record for record in records if record["seq"] > since]
+    }
+
+
+def current_events(records: List[Dict]) -> Dict[str, Dict]:
+    """Replay records into the current event index (same shape as event_index())."""
+    events = {}
+    for record in records:
+        if record["type"] == "removed":
+            events.pop(record["code"], None)
+        else:
+            events[record["code"]] = {"name": record["name"], "start": record["start"], "end": record["end"]}
+    return events
+
+
+def compact_records(records: List[Dict], tombstone_days: float, now: float) -> Tuple[List[Dict], int]:
+    """
+    Keep only the latest record per code and drop expired `removed` records.
+
+    Returns:
+        (kept records in sequence order, highest sequence number of a dropped tombstone)
+    """
+    latest = {}
+    for record in records:
+        latest[record["code"]] = record
+
+    kept = []
+    dropped_through = 0
+    for record in sorted(latest.values(), key=lambda r: r["seq"]):
+        recorded_at = datetime.fromisoformat(record["recorded_at"]).timestamp()
+        if record["type"] == "removed" and now - recorded_at > tombstone_days * 86400:
+            dropped_through = max(dropped_through, record["seq"])
+        else:
+            kept.append(record)
+    return kept, dropped_through
+
+
+class ChangeLog:
+    """
+    The change log for one feed.
+
+    Args:
+        path: Location of the .changes.jsonl file
+        compact_at: Compact once this many more records were appended since the last compaction
+        tombstone_days: How long `removed` records survive compaction
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compact_at: int = DEFAULT_COMPACT_AT,
+        tombstone_days: float = DEFAULT_TOMBSTONE_DAYS
+    ):
+        self.path = path
+        self.compact_at = compact_at
+        self.tombstone_days = tombstone_days
+        # Lock lives in the cache directory so the feed directory (the repository) stays clean
+        self._lock = LockedJSONFile(
+            os.path.join(CACHE_DIR, "changelogs", cache_key(os.path.abspath(path))[:16] + ".json")
+        )
+
+    def _content(self) -> bytes:
+        try:
+            with open(self.path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return b""
+
+    def since(self, seq: int) -> Dict:
+        """Records after `seq`; see changes_since()."""
+        return changes_since(self._content(), seq)
+
+    def record(self, campaign: str, events: List[CampaignEvent]) -> List[Dict]:
+        """
+        Append records for every difference between the logged state and `events`.
+
+        Args:
+            campaign: Campaign slug the events belong to
+            events: This run's events for the feed
+
+        Returns:
+            The records that were appended
+        """
+        with self._lock.locked():
+            header, records = parse_log(self._content())
+            recorded_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+            appended = []
+            seq = header["last_seq"]
+            for change in diff_events(campaign, current_events(records), event_index(events)):
+                seq += 1
+                appended.append({"seq": seq, "recorded_at": recorded_at, **change})
+
+            append_bytes(self.path, b"".join(json.dumps(record).encode() + b"\n" for record in appended))
+
+            if len(records) + len(appended) - header["compacted_records"] > self.compact_at:
+                self._compact(header, records + appended)
+        return appended
+
+    def _compact(self, header: Dict, records: List[Dict]) -> None:
+        kept, dropped_through = compact_records(records, self.tombstone_days, time.time())
+        compacted_through = max(header["compacted_through"], dropped_through)
+        last_seq = max([header["last_seq"]] + [record["seq"] for record in records])
+
+        lines = [json.dumps({"compacted_through": compacted_through, "last_seq": last_seq, "compacted_records": len(kept)})]
+        lines += [json.dumps(record) for record in kept]
+        write_bytes_if_changed(self.path, ("\n".join(lines) + "\n").encode())
+
+
+def record_feed_changes(output_path: str, campaign: str, events: List[CampaignEvent]) -> List[Dict]:
+    """Append this run's changes to the change log next to a feed."""
+    return ChangeLog(changes_path(output_path)).record(campaign, events)
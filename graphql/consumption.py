@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Half-hourly consumption during campaign sessions
+
+Measures how much energy each household actually used in its Free
+Electricity Sessions and Power Ups. For every IMPORT MPAN on the account
+the half-hourly import readings are downloaded from the REST API into a
+local SQLite cache, and every past session in the history store is
+compared with a baseline: the same half hours on the preceding days,
+skipping days that had a session of their own.
+
+Readings are fetched page by page (OCTOPUS_CONSUMPTION_PAGE_SIZE, default
+25000 half hours, about 17 months) and written to the cache as each page
+arrives, so memory stays bounded however much history is downloaded.
+Later runs only fetch readings newer than the cache, plus a short overlap
+for readings that arrive late.
+
+The interval join - summing the readings inside every session and
+baseline window - runs on sorted arrays with prefix sums and one binary
+search per window boundary, so years of readings across many meters are
+analysed in well under a second. NumPy is used when it is installed;
+otherwise the same algorithm runs on lists with the bisect module.
+
+Usage:
+
+    python consumption.py                    # every campaign and IMPORT MPAN
+    python consumption.py --campaign free_electricity --baseline-days 14 --json usage.json
+    python consumption.py --offline          # analyse the cached readings only
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, timezone
+from itertools import accumulate
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from account_cache import get_account_cache, is_import_meter_point
+from cache_file import CACHE_DIR
+from event_model import parse_timestamp
+from fanout import DEFAULT_MAX_WORKERS
+from history_store import EventRow, HistoryStore
+from metrics import run_instrumented, stage
+from octopus_client import REST_URL, GraphQLClient, get_client
+from token_store import get_cached_token
+from window_index import SLOT_SECONDS, WindowIndex
+
+try:
+    import numpy as np
+except ImportError:  # Optional: window_sums() falls back to bisect
+    np = None
+
+# Configuration
+DEFAULT_CONSUMPTION_DB = os.getenv("OCTOPUS_CONSUMPTION_DB", os.path.join(CACHE_DIR, "consumption.sqlite3"))
+DEFAULT_PAGE_SIZE = int(os.getenv("OCTOPUS_CONSUMPTION_PAGE_SIZE", "25000"))
+DEFAULT_BASELINE_DAYS = int(os.getenv("OCTOPUS_BASELINE_DAYS", "10"))
+REFETCH_OVERLAP = 2 * 24 * 60 * 60  # Readings can arrive a day or more late
+
+DAY_SECONDS = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    mpan TEXT NOT NULL,
+    serial TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    kwh REAL NOT NULL,
+    PRIMARY KEY (mpan, serial, start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS fetched (
+    mpan TEXT NOT NULL,
+    serial TEXT NOT NULL,
+    from_ts INTEGER NOT NULL,
+    until_ts INTEGER NOT NULL,
+    PRIMARY KEY (mpan, serial)
+) WITHOUT ROWID;
+"""
+
+Reading = Tuple[int, float]  # (slot start epoch seconds, kWh)
+
+
+class ReadingStore:
+    """
+    SQLite cache of half-hourly readings per MPAN and meter serial, and
+    of the period already downloaded for each.
+
+    Args:
+        path: Database file
+    """
+
+    def __init__(self, path: str = DEFAULT_CONSUMPTION_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def fetched(self, mpan: str, serial: str) -> Optional[Tuple[int, int]]:
+        """The (from, until) period already downloaded, or None."""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT from_ts, until_ts FROM fetched WHERE mpan = ? AND serial = ?", (mpan, serial)
+            ).fetchone()
+
+    def record(self, mpan: str, serial: str, readings: List[Reading], period: Tuple[int, int]) -> None:
+        """Upsert one page of readings and widen the downloaded period, in one transaction."""
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO readings (mpan, serial, start, kwh) VALUES (?, ?, ?, ?)",
+                [(mpan, serial, start, kwh) for start, kwh in readings]
+            )
+            conn.execute(
+                "INSERT INTO fetched (mpan, serial, from_ts, until_ts) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (mpan, serial) DO UPDATE SET "
+                "from_ts = MIN(from_ts, excluded.from_ts), until_ts = MAX(until_ts, excluded.until_ts)",
+                (mpan, serial) + period
+            )
+
+    def readings(self, mpan: str, start: Optional[int] = None, end: Optional[int] = None) -> Tuple[List[int], List[float]]:
+        """
+        Readings of an MPAN in [start, end), summed across its meters.
+
+        Returns:
+            (slot starts, kWh) lists sorted by slot start
+        """
+        sql = "SELECT start, SUM(kwh) FROM readings WHERE mpan = ?"
+        params: List = [mpan]
+        if start is not None:
+            sql += " AND start >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND start < ?"
+            params.append(end)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql + " GROUP BY start ORDER BY start", params).fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows]
+
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def iter_consumption_pages(
+    api_key: str,
+    mpan: str,
+    serial: str,
+    period_from: int,
+    period_to: Optional[int] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    client: Optional[GraphQLClient] = None
+) -> Iterator[List[Reading]]:
+    """
+    Stream half-hourly readings from the REST API one page at a time, oldest first.
+
+    Args:
+        api_key: Octopus Energy API key (REST basic auth)
+        mpan: Import MPAN
+        serial: Meter serial number
+        period_from: First slot to fetch (epoch seconds)
+        period_to: Fetch up to this time (default: now)
+        page_size: Readings per page (the API allows up to 25000)
+        client: Optional client (defaults to the shared client)
+
+    Yields:
+        Lists of (slot start, kWh) readings
+    """
+    client = client or get_client()
+    url = f"{REST_URL}/electricity-meter-points/{mpan}/meters/{serial}/consumption/"
+    params: Optional[Dict] = {"period_from": _iso(period_from), "page_size": page_size, "order_by": "period"}
+    if period_to is not None:
+        params["period_to"] = _iso(period_to)
+
+    while url:
+        data = client.get_json(url, params, auth=(api_key, ""))
+        yield [(parse_timestamp(row["interval_start"])[0], float(row["consumption"])) for row in data["results"]]
+        # `next` already carries the query string
+        url, params = data.get("next"), None
+
+
+def sync_readings(
+    api_key: str,
+    mpan: str,
+    serial: str,
+    since: int,
+    store: ReadingStore,
+    client: Optional[GraphQLClient] = None
+) -> int:
+    """
+    Download the readings of one meter that are not cached yet.
+
+    Returns:
+        Number of readings downloaded
+    """
+    now = int(time.time())
+    fetched = store.fetched(mpan, serial)
+    if fetched is None:
+        periods = [(since, None)]
+    else:
+        periods = [(max(fetched[1] - REFETCH_OVERLAP, fetched[0]), None)]
+        if since < fetched[0]:
+            periods.insert(0, (since, fetched[0]))
+
+    downloaded = 0
+    for period_from, period_to in periods:
+        for page in iter_consumption_pages(api_key, mpan, serial, period_from, period_to, client=client):
+            until = page[-1][0] + SLOT_SECONDS if page else period_from
+            store.record(mpan, serial, page, (period_from, min(until, period_to or now)))
+            downloaded += len(page)
+    return downloaded
+
+
+def window_sums(
+    starts: Sequence[int],
+    kwh: Sequence[float],
+    window_starts: Sequence[int],
+    window_ends: Sequence[int]
+) -> Tuple[List[float], List[int]]:
+    """
+    Sum the readings whose slot starts inside each [start, end) window.
+
+    Args:
+        starts: Slot starts, sorted ascending
+        kwh: kWh per slot
+        window_starts: Window starts
+        window_ends: Window ends
+
+    Returns:
+        (kWh per window, readings per window) lists
+    """
+    if np is not None:
+        slot_starts = np.asarray(starts, dtype=np.int64)
+        cumulative = np.concatenate(([0.0], np.cumsum(np.asarray(kwh, dtype=np.float64))))
+        lo = np.searchsorted(slot_starts, np.asarray(window_starts, dtype=np.int64), side="left")
+        hi = np.searchsorted(slot_starts, np.asarray(window_ends, dtype=np.int64), side="left")
+        return (cumulative[hi] - cumulative[lo]).tolist(), (hi - lo).tolist()
+
+    cumulative = [0.0]
+    cumulative.extend(accumulate(kwh))
+    sums = []
+    counts = []
+    for window_start, window_end in zip(window_starts, window_ends):
+        lo = bisect_left(starts, window_start)
+        hi = bisect_left(starts, window_end)
+        sums.append(cumulative[hi] - cumulative[lo])
+        counts.append(hi - lo)
+    return sums, counts
+
+
+def analyse_sessions(
+    sessions: List[EventRow],
+    starts: Sequence[int],
+    kwh: Sequence[float],
+    baseline_days: int = DEFAULT_BASELINE_DAYS,
+    busy: Optional[WindowIndex] = None
+) -> List[Dict]:
+    """
+    Usage in each session against the mean usage in the same half hours
+    on up to `baseline_days` preceding days.
+
+    A session (or baseline day) only counts if every half hour in it has a
+    reading. Baseline days overlapping a window in `busy` are skipped.
+
+    Args:
+        sessions: History rows of one MPAN
+        starts: Slot starts of the MPAN's readings, sorted ascending
+        kwh: kWh per slot
+        baseline_days: Preceding days to compare with
+        busy: Windows to keep out of the baseline (default: the sessions)
+
+    Returns:
+        One dictionary per session with `kwh`, `baseline_kwh` and
+        `shifted_kwh` (None where there is not enough data)
+    """
+    busy = busy or WindowIndex((row[5], row[6]) for row in sessions)
+    window_starts = []
+    window_ends = []
+    for row in sessions:
+        # Align to whole half hours; the session itself is day offset 0
+        first = row[5] - row[5] % SLOT_SECONDS
+        last = row[6] + (-row[6]) % SLOT_SECONDS
+        for day in range(baseline_days + 1):
+            window_starts.append(first - day * DAY_SECONDS)
+            window_ends.append(last - day * DAY_SECONDS)
+
+    sums, counts = window_sums(starts, kwh, window_starts, window_ends)
+
+    results = []
+    per_session = baseline_days + 1
+    for i, (campaign, mpan, code, _, name, start, end) in enumerate(sessions):
+        offset = i * per_session
+        expected = (window_ends[offset] - window_starts[offset]) // SLOT_SECONDS
+        used = sums[offset] if counts[offset] == expected else None
+
+        baseline = [
+            sums[j] for j in range(offset + 1, offset + per_session)
+            if counts[j] == expected and not busy.windows_between(window_starts[j], window_ends[j])
+        ]
+        baseline_kwh = sum(baseline) / len(baseline) if baseline else None
+
+        results.append({
+            "campaign": campaign,
+            "mpan": mpan,
+            "code": code,
+            "name": name,
+            "start": _iso(start),
+            "end": _iso(end),
+            "kwh": round(used, 3) if used is not None else None,
+            "baseline_kwh": round(baseline_kwh, 3) if baseline_kwh is not None else None,
+            "baseline_days": len(baseline),
+            "shifted_kwh": round(used - baseline_kwh, 3) if used is not None and baseline_kwh is not None else None,
+        })
+    return results
+
+
+def summarize(results: List[Dict]) -> Dict[str, Dict]:
+    """Totals per campaign over the sessions that could be measured."""
+    summary: Dict[str, Dict] = {}
+    for result in results:
+        totals = summary.setdefault(result["campaign"], {
+            "sessions": 0, "measured": 0, "kwh": 0.0, "baseline_kwh": 0.0, "shifted_kwh": 0.0
+        })
+        totals["sessions"] += 1
+        if result["shifted_kwh"] is not None:
+            totals["measured"] += 1
+            totals["kwh"] += result["kwh"]
+            totals["baseline_kwh"] += result["baseline_kwh"]
+            totals["shifted_kwh"] += result["shifted_kwh"]
+    for totals in summary.values():
+        for key in ("kwh", "baseline_kwh", "shifted_kwh"):
+            totals[key] = round(totals[key], 3)
+    return summary
+
+
+def import_meters(accounts: List[Dict]) -> Dict[str, List[str]]:
+    """Serial numbers of every IMPORT MPAN in the account topology."""
+    meters: Dict[str, List[str]] = {}
+    for account in accounts:
+        for prop in account["properties"]:
+            for meter_point in prop["meter_points"]:
+                if meter_point["mpan"] and is_import_meter_point(meter_point):
+                    meters.setdefault(meter_point["mpan"], []).extend(meter_point.get("serial_numbers", []))
+    return meters
+
+
+def discover_meters(api_key: str, token: Optional[str]) -> Dict[str, List[str]]:
+    """IMPORT MPANs and their meter serials, rediscovering topologies cached before serials were."""
+    account_cache = get_account_cache()
+    with stage("mpan_discovery"):
+        meters = import_meters(account_cache.get_accounts(api_key, token))
+        if token and meters and not all(meters.values()):
+            meters = import_meters(account_cache.get_accounts(api_key, token, refresh=True))
+    return meters
+
+
+def print_results(results: List[Dict], summary: Dict[str, Dict]) -> None:
+    for result in results:
+        def kwh(key: str) -> str:
+            return f"{result[key]:7.2f}" if result[key] is not None else "      -"
+        print(f"{result['campaign']:<18} {result['start'][:16].replace('T', ' ')}  "
+              f"used {kwh('kwh')} kWh  baseline {kwh('baseline_kwh')} kWh  shifted {kwh('shifted_kwh')} kWh")
+    for campaign, totals in summary.items():
+        print(f"\n{campaign}: {totals['measured']}/{totals['sessions']} session(s) measured, "
+              f"{totals['kwh']:.2f} kWh used against a {totals['baseline_kwh']:.2f} kWh baseline "
+              f"({totals['shifted_kwh']:+.2f} kWh shifted)")
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Measure consumption during campaign sessions")
+    parser.add_argument("--campaign", action="append", help="Only this campaign slug (repeatable)")
+    parser.add_argument("--mpan", action="append", help="Only this MPAN (repeatable)")
+    parser.add_argument("--since", help="Only sessions starting on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--baseline-days", type=int, default=DEFAULT_BASELINE_DAYS,
+                        help="Preceding days the baseline is averaged over")
+    parser.add_argument("--offline", action="store_true", help="Don't download readings, use the cache only")
+    parser.add_argument("--db", default=DEFAULT_CONSUMPTION_DB, help="Readings cache database")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--profile", action="store_true", help="Print a cProfile and tracemalloc summary to stderr")
+    args = parser.parse_args()
+
+    api_key = os.getenv("OCTOPUS_API_KEY")
+    if not api_key:
+        print("ERROR: OCTOPUS_API_KEY environment variable not set", file=sys.stderr)
+        sys.exit(1)
+
+    token = None
+    if not args.offline:
+        with stage("auth"):
+            token = get_cached_token(api_key)
+    meters = discover_meters(api_key, token)
+    if args.mpan:
+        meters = {mpan: serials for mpan, serials in meters.items() if mpan in args.mpan}
+    if not meters:
+        print("ERROR: No IMPORT meter points found", file=sys.stderr)
+        sys.exit(1)
+
+    now = int(time.time())
+    since = int(datetime.fromisoformat(args.since).replace(tzinfo=timezone.utc).timestamp()) if args.since else None
+    history = HistoryStore()
+    sessions: Dict[str, List[EventRow]] = {}
+    for mpan in meters:
+        rows = [
+            row for campaign in (args.campaign or [None])
+            for row in history.events(campaign, mpan, since, now) if row[6] <= now
+        ]
+        sessions[mpan] = sorted(rows, key=lambda row: row[5])
+    if not any(sessions.values()):
+        print("No past sessions in the history store for these meters", file=sys.stderr)
+        return
+
+    store = ReadingStore(args.db)
+    if not args.offline:
+        def sync(mpan: str) -> int:
+            first = sessions[mpan][0][5] - args.baseline_days * DAY_SECONDS
+            return sum(sync_readings(api_key, mpan, serial, first, store) for serial in meters[mpan])
+
+        with stage("consumption_fetch"), ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS) as pool:
+            to_sync = [mpan for mpan in meters if sessions[mpan]]
+            for mpan, downloaded in zip(to_sync, pool.map(sync, to_sync)):
+                print(f"{mpan}: {downloaded} reading(s) downloaded", file=sys.stderr)
+
+    results = []
+    with stage("analysis"):
+        for mpan, rows in sessions.items():
+            if not rows:
+                continue
+            starts, kwh = store.readings(mpan, rows[0][5] - args.baseline_days * DAY_SECONDS, rows[-1][6])
+            # Keep every stored session out of the baseline, not just the selected campaigns
+            busy = WindowIndex((row[5], row[6]) for row in history.events(mpan=mpan))
+            results.extend(analyse_sessions(rows, starts, kwh, args.baseline_days, busy))
+    summary = summarize(results)
+
+    print_results(results, summary)
+    if args.json:
+        with stage("output_write"), open(args.json, "w") as f:
+            json.dump({"sessions": results, "summary": summary}, f, indent=2)
+        print(f"\nResults written to {args.json}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    run_instrumented(main)
@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+"""
+Power Up and Free Electricity Session finder for a local mailbox
+
+A Python port of the Apps Script finders in gapps_scripts/ that reads a
+local mbox file or Maildir instead of searching Gmail. An mbox is
+memory-mapped and split into messages on `From ` lines; only the header
+block of each message is looked at until it is known to come from Octopus,
+so years of unrelated mail are skipped at disk speed. Octopus messages are
+parsed on a process pool.
+
+Parsed messages are remembered by Message-ID in OCTOPUS_EMAIL_INDEX
+(default `~/.cache/octopus_powerups/email_index.json`) together with the
+sessions found in them, so a rerun only parses new mail. The output has the
+same format as the Apps Script endpoints: future sessions as
+`{"start": ..., "end": ...}` in UTC, sorted by start, or a single entry
+with null times when there are none.
+
+Usage:
+
+    python email_finder.py ~/Mail/octopus.mbox                 # Power Ups -> powerup.json
+    python email_finder.py ~/Maildir --kind fes                # -> free_electricity_session.json
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import mmap
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from email import policy
+from email.parser import BytesParser
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from cache_file import CACHE_DIR, LockedJSONFile
+from feed_writer import report_changes, write_bytes_if_changed
+
+# Configuration
+DEFAULT_EMAIL_INDEX = os.getenv("OCTOPUS_EMAIL_INDEX", os.path.join(CACHE_DIR, "email_index.json"))
+EMAIL_SENDER = os.getenv("OCTOPUS_EMAIL_SENDER", "octopus.energy")
+DEFAULT_EMAIL_WORKERS = int(os.getenv("OCTOPUS_EMAIL_WORKERS", str(os.cpu_count() or 1)))
+REQUIRE_AUTH = os.getenv("OCTOPUS_EMAIL_REQUIRE_AUTH", "0") == "1"
+# Times in the emails are UK local time
+EMAIL_TIMEZONE = ZoneInfo(os.getenv("OCTOPUS_EMAIL_TIMEZONE", "Europe/London"))
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KIND_OUTPUTS = {
+    "powerup": "powerup.json",
+    "fes": "free_electricity_session.json",
+}
+
+HEADER_END = re.compile(rb"\r?\n\r?\n")
+MESSAGE_ID_HEADER = re.compile(rb"^Message-ID:\s*(<[^>]*>)", re.I | re.M)
+FROM_HEADER = re.compile(rb"^From:(.*(?:\r?\n[ \t].*)*)", re.I | re.M)
+
+# Power Ups: "Power-ups: Opt in ... at 2:00 PM - 3:00 PM on 25/10/24"
+POWER_UP_SUBJECT = re.compile(r"power-ups:\s*opt in", re.I)
+SUBJECT_EXTRACT = re.compile(r".*[0-9]{2}/[0-9]{2}/(?:\d{4}|\d{2})", re.S)
+SUBJECT_START = re.compile(r"(?<=at )(?:[0-9]{2}|[0-9]):[0-9]{2} (?:AM|PM)", re.I)
+SUBJECT_END = re.compile(r"(?<= - )(?:[0-9]{2}|[0-9]):[0-9]{2} (?:AM|PM)", re.I)
+SUBJECT_DATE = re.compile(r"([0-9]{2}|[0-9])/([0-9]{2}|[0-9])/(\d{4}|\d{2})")
+
+# Free Electricity Sessions: "9-10pm Friday 24th October", "12 (noon) - 2pm, 3rd November"
+MONTHS = ("january", "february", "march", "april", "may", "june",
+          "july", "august", "september", "october", "november", "december")
+MONTH_NAMES = "|".join(MONTHS)
+TIME_DATE = re.compile(
+    r"(\d{1,2}(?::\d{2})?(?:\s*\(noon\))?(?:\s*[ap]m)?)\s*[-–—]\s*(\d{1,2}(?::\d{2})?)([ap]m)[,]?\s*"
+    r"(?:\b(Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday)\b[,]?\s*)?"
+    rf"(\d{{1,2}})(?:st|nd|rd|th)?\s+({MONTH_NAMES})",
+    re.I
+)
+SESSION_SNIPPETS = (
+    re.compile(r"Fill your boots on.+?\.", re.S),
+    re.compile(r"Shift your electricity use to.+?\.", re.S),
+    re.compile(r"Use more power on.+?\.", re.S),
+    re.compile(
+        r"Free Electricity Session\s+\d{1,2}(?::\d{2})?(?:\s*\(noon\))?\s*[-–—]\s*\d{1,2}(?::\d{2})?[ap]m,?"
+        rf"\s*(?:\w+\s+)?\d{{1,2}}(?:st|nd|rd|th)?\s+(?:{MONTH_NAMES})!?",
+        re.I
+    ),
+)
+CLOCK_TIME = re.compile(r"^(\d{1,2})(?::(\d{2}))?\s*([ap]m)$", re.I)
+
+
+class RawMessage:
+    """
+    One message in a mailbox, read lazily.
+
+    `headers` holds just the raw header block; `read()` returns the whole
+    message.
+    """
+
+    __slots__ = ("headers", "_source", "_start", "_end")
+
+    def __init__(self, headers: bytes, source, start: int = 0, end: Optional[int] = None):
+        self.headers = headers
+        self._source = source
+        self._start = start
+        self._end = end
+
+    def read(self) -> bytes:
+        if isinstance(self._source, str):
+            with open(self._source, "rb") as f:
+                return f.read()
+        return self._source[self._start:self._end]
+
+
+def iter_mbox(path: str) -> Iterator[RawMessage]:
+    """Stream the messages of an mbox file from a memory map, one at a time."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            pos = 0 if mm[:5] == b"From " else mm.find(b"\nFrom ")
+            while 0 <= pos < size:
+                # Skip the "From sender date" envelope line
+                start = mm.find(b"\n", pos + 1) + 1 or size
+                next_pos = mm.find(b"\nFrom ", start - 1)
+                end = next_pos + 1 if next_pos >= 0 else size
+                match = HEADER_END.search(mm, start, end)
+                yield RawMessage(mm[start:match.start() if match else end], mm, start, end)
+                pos = next_pos
+
+
+def iter_maildir(path: str) -> Iterator[RawMessage]:
+    """Stream the messages in the cur/ and new/ folders of a Maildir."""
+    for folder in ("cur", "new"):
+        try:
+            entries = sorted(os.scandir(os.path.join(path, folder)), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            with open(entry.path, "rb") as f:
+                head = b""
+                while True:
+                    chunk = f.read(65536)
+                    head += chunk
+                    match = HEADER_END.search(head)
+                    if match or not chunk:
+                        break
+            yield RawMessage(head[:match.start()] if match else head, entry.path)
+
+
+def iter_mailbox(path: str) -> Iterator[RawMessage]:
+    """Stream the messages of an mbox file or a Maildir directory."""
+    if os.path.isdir(path):
+        return iter_maildir(path)
+    return iter_mbox(path)
+
+
+def message_key(headers: bytes) -> str:
+    """The Message-ID of a message, or a hash of its headers if it has none."""
+    match = MESSAGE_ID_HEADER.search(headers)
+    if match:
+        return match.group(1).decode("ascii", "replace")
+    return "sha256:" + hashlib.sha256(headers).hexdigest()
+
+
+def is_from_sender(headers: bytes, sender: str = EMAIL_SENDER) -> bool:
+    """True if the From header mentions `sender` (case-insensitive)."""
+    match = FROM_HEADER.search(headers)
+    return bool(match) and sender.lower().encode() in match.group(1).lower()
+
+
+def check_headers(headers: Optional[str]) -> bool:
+    """
+    Port of checkHeaders(): True if an Authentication-Results style header
+    reports dkim=pass, arc=pass and dmarc=pass.
+    """
+    if not headers:
+        return False
+    blocks = headers.split()
+    return "dkim=pass" in blocks and "arc=pass" in blocks and "dmarc=pass" in blocks
+
+
+def convert_time(time_string: Optional[str]) -> Optional[dt_time]:
+    """Port of convertTime(): "2:30 PM" or "10am" to a time, None if unparseable."""
+    if not time_string:
+        return None
+    match = CLOCK_TIME.match(time_string.strip())
+    if not match:
+        return None
+    hour = int(match.group(1))
+    minute = int(match.group(2) or 0)
+    period = match.group(3).upper()
+    if period == "PM" and hour != 12:
+        hour += 12
+    if period == "AM" and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return dt_time(hour, minute)
+
+
+def find_time_in_string(time_string: Optional[str], period_hint: Optional[str] = None) -> Optional[dt_time]:
+    """
+    Port of findTimeInString(): parse "2pm", "2:30pm", "noon", "14" or a
+    bare "2" with an AM/PM hint. Returns None when ambiguous.
+    """
+    if not time_string:
+        return None
+    raw = re.sub(r"[,!.]+$", "", time_string.strip()).strip()
+    if re.search(r"noon", raw, re.I):
+        return dt_time(12)
+    if re.search(r"midnight", raw, re.I):
+        return dt_time(0)
+    raw = re.sub(r"\s+", " ", raw)
+
+    parsed = convert_time(raw)
+    if parsed:
+        return parsed
+
+    match = re.match(r"^(\d{1,2})$", raw)
+    if not match:
+        return None
+    hour = int(match.group(1))
+    if hour >= 24:
+        return None
+    if hour > 12:
+        return dt_time(hour)
+    if period_hint:
+        return convert_time(f"{hour}:00 {period_hint}")
+    return None
+
+
+def _start_hint(start_num: int, end_num: int, end_period: str) -> Optional[str]:
+    """The start's AM/PM when only the end has one, e.g. "11-12pm" or "12-3pm"."""
+    if end_period == "pm":
+        if start_num == 12:
+            return "PM"
+        if end_num == 12:
+            return "AM" if start_num <= 11 else "PM"
+        return "PM" if start_num < end_num else "AM"
+    if end_period == "am":
+        if start_num == 12:
+            return "AM"
+        if end_num == 12:
+            return "PM" if start_num < 12 else "AM"
+        return "AM" if start_num < end_num else "PM"
+    return None
+
+
+def _isoformat(dt: datetime) -> str:
+    """UTC timestamp formatted like JavaScript's Date.toISOString()."""
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def _local(day: date, at: dt_time) -> datetime:
+    return datetime.combine(day, at, tzinfo=EMAIL_TIMEZONE)
+
+
+def parse_session_match(match: re.Match, sent: datetime) -> Optional[Tuple[str, str]]:
+    """
+    Turn one TIME_DATE match into a (start, end) pair, following the
+    start-period heuristics of the Apps Script.
+
+    The year is taken from when the email was sent; a date more than six
+    months before that is taken to be in the following year.
+    """
+    start_raw = (match.group(1) or "").strip()
+    end_numeric = (match.group(2) or "").strip()
+    end_period = (match.group(3) or "").strip().lower()
+
+    end_time = find_time_in_string(end_numeric + end_period)
+    if not end_time:
+        return None
+
+    start_time = None
+    hint = None
+    if re.search(r"[ap]m", start_raw, re.I) or re.search(r"noon", start_raw, re.I):
+        start_time = find_time_in_string(start_raw)
+    elif end_period:
+        start_num = re.search(r"\d{1,2}", start_raw)
+        end_num = re.search(r"\d{1,2}", end_numeric)
+        if start_num and end_num:
+            hint = _start_hint(int(start_num.group()), int(end_num.group()), end_period)
+            if hint:
+                start_time = find_time_in_string(start_raw, hint)
+    if not start_time:
+        fallback = "AM" if end_time.hour < 12 else "PM"
+        start_time = find_time_in_string(start_raw, fallback)
+        hint = hint or fallback
+    if not start_time:
+        return None
+
+    month = MONTHS.index(match.group(6).lower()) + 1
+    try:
+        day = date(sent.year, month, int(match.group(5)))
+        if day < sent.date() - timedelta(days=183):
+            day = date(sent.year + 1, month, int(match.group(5)))
+    except ValueError:
+        return None
+
+    start_dt = _local(day, start_time)
+    end_dt = _local(day, end_time)
+    if start_dt >= end_dt:
+        # e.g. "11-12pm": try the other half of the day for the start
+        alternate = find_time_in_string(start_raw, "PM" if hint and hint.upper() == "AM" else "AM")
+        if alternate and _local(day, alternate) < end_dt:
+            start_dt = _local(day, alternate)
+    if start_dt >= end_dt:
+        return None
+    return _isoformat(start_dt), _isoformat(end_dt)
+
+
+def parse_fes_body(body: str, sent: datetime) -> List[Tuple[str, str]]:
+    """Free Electricity Sessions announced in a plain-text email body."""
+    matches = list(TIME_DATE.finditer(body))
+    if not matches:
+        # Fall back to the sentence announcing the session
+        for pattern in SESSION_SNIPPETS:
+            snippet = pattern.search(body)
+            if snippet:
+                matches = list(TIME_DATE.finditer(snippet.group()))
+                break
+    sessions = []
+    for match in matches:
+        session = parse_session_match(match, sent)
+        if session:
+            sessions.append(session)
+    return sessions
+
+
+def parse_power_up_subject(subject: str) -> List[Tuple[str, str]]:
+    """The Power Up in a "Power-ups: Opt in" subject line (DD/MM/YY dates, 12-hour times)."""
+    extract = SUBJECT_EXTRACT.match(subject)
+    if not extract:
+        return []
+    text = extract.group()
+    date_match = SUBJECT_DATE.search(text)
+    start_match = SUBJECT_START.search(text)
+    end_match = SUBJECT_END.search(text)
+    if not (date_match and start_match and end_match):
+        return []
+
+    day_str, month_str, year_str = date_match.groups()
+    year = int(year_str) + 2000 if len(year_str) == 2 else int(year_str)
+    start_time = convert_time(start_match.group())
+    end_time = convert_time(end_match.group())
+    try:
+        day = date(year, int(month_str), int(day_str))
+    except ValueError:
+        return []
+    if not (start_time and end_time):
+        return []
+    return [(_isoformat(_local(day, start_time)), _isoformat(_local(day, end_time)))]
+
+
+def _plain_body(message) -> str:
+    part = message.get_body(preferencelist=("plain", "html"))
+    if part is None:
+        return ""
+    try:
+        content = part.get_content()
+    except (LookupError, UnicodeError):
+        content = (part.get_payload(decode=True) or b"").decode("utf-8", "replace")
+    if part.get_content_subtype() == "html":
+        content = html.unescape(re.sub(r"<[^>]+>", " ", content))
+    return content
+
+
+def parse_message(raw: bytes, kind: str) -> Dict:
+    """
+    Parse one message (runs in a worker process).
+
+    Args:
+        raw: The complete message
+        kind: "powerup" or "fes"
+
+    Returns:
+        {"authentic": bool, "sessions": [[start, end], ...]}
+    """
+    message = BytesParser(policy=policy.default).parsebytes(raw)
+    auth_headers = message.get_all("ARC-Authentication-Results") or message.get_all("Authentication-Results") or []
+    authentic = any(check_headers(str(header)) for header in auth_headers)
+
+    if kind == "powerup":
+        subject = str(message.get("Subject", ""))
+        sessions = parse_power_up_subject(subject) if POWER_UP_SUBJECT.search(subject) else []
+    else:
+        try:
+            sent = parsedate_to_datetime(str(message["Date"]))
+        except (TypeError, ValueError):
+            sent = datetime.now(timezone.utc)
+        sessions = parse_fes_body(_plain_body(message), sent)
+
+    return {"authentic": authentic, "sessions": [list(session) for session in sessions]}
+
+
+def parse_messages(
+    pending: Iterable[Tuple[str, bytes]],
+    kind: str,
+    workers: int = DEFAULT_EMAIL_WORKERS
+) -> Iterator[Tuple[str, Dict]]:
+    """
+    Parse (key, raw message) pairs on a process pool, yielding (key, result).
+
+    At most a few messages per worker are read ahead, so memory use does not
+    grow with the size of the mailbox.
+    """
+    if workers <= 1:
+        for key, raw in pending:
+            yield key, parse_message(raw, kind)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        for key, raw in pending:
+            in_flight[pool.submit(parse_message, raw, kind)] = key
+            if len(in_flight) >= workers * 4:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future.result()
+        for future in as_completed(in_flight):
+            yield in_flight[future], future.result()
+
+
+def scan_mailboxes(
+    paths: List[str],
+    kind: str,
+    index: Dict[str, Dict],
+    workers: int = DEFAULT_EMAIL_WORKERS,
+    sender: str = EMAIL_SENDER
+) -> Tuple[int, int, int]:
+    """
+    Parse every message from `sender` that is not already in `index`.
+
+    Args:
+        paths: mbox files and/or Maildir directories
+        kind: "powerup" or "fes"
+        index: Message-ID -> parse_message() result; updated in place
+        workers: Worker processes (1 parses in this process)
+        sender: Substring of the From header of the messages to parse
+
+    Returns:
+        (messages scanned, messages from the sender, messages parsed) tuple
+    """
+    counts = {"scanned": 0, "matched": 0}
+
+    def pending() -> Iterator[Tuple[str, bytes]]:
+        queued = set()
+        for path in paths:
+            for message in iter_mailbox(path):
+                counts["scanned"] += 1
+                if not is_from_sender(message.headers, sender):
+                    continue
+                counts["matched"] += 1
+                key = message_key(message.headers)
+                if key in index or key in queued:
+                    continue
+                queued.add(key)
+                yield key, message.read()
+
+    parsed = 0
+    for key, result in parse_messages(pending(), kind, workers):
+        index[key] = result
+        parsed += 1
+    return counts["scanned"], counts["matched"], parsed
+
+
+def sessions_output(index: Dict[str, Dict], require_auth: bool = REQUIRE_AUTH, now: Optional[datetime] = None) -> List[Dict]:
+    """
+    Future sessions from an index in the Apps Script output format.
+
+    Returns:
+        [{"start": ..., "end": ...}, ...] sorted by start, or
+        [{"start": None, "end": None}] if there are none
+    """
+    now_iso = _isoformat(now or datetime.now(timezone.utc))
+    sessions = {
+        (start, end)
+        for result in index.values()
+        if result["authentic"] or not require_auth
+        for start, end in result["sessions"]
+        if end >= now_iso
+    }
+    if not sessions:
+        return [{"start": None, "end": None}]
+    return [{"start": start, "end": end} for start, end in sorted(sessions)]
+
+
+def main():
+    """Scan mailboxes, update the Message-ID index and write the feed."""
+    parser = argparse.ArgumentParser(description="Find Power Ups or Free Electricity Sessions in a local mailbox")
+    parser.add_argument("mailbox", nargs="+", help="mbox file or Maildir directory")
+    parser.add_argument("--kind", choices=sorted(KIND_OUTPUTS), default="powerup", help="What to look for")
+    parser.add_argument("--output", help="Feed to write (default: powerup.json or free_electricity_session.json)")
+    parser.add_argument("--index", default=DEFAULT_EMAIL_INDEX, help="Message-ID index")
+    parser.add_argument("--workers", type=int, default=DEFAULT_EMAIL_WORKERS, help="Parser processes")
+    parser.add_argument("--sender", default=EMAIL_SENDER, help="Only parse mail whose From header contains this")
+    parser.add_argument("--require-auth", action="store_true", default=REQUIRE_AUTH,
+                        help="Ignore mail without dkim=pass, arc=pass and dmarc=pass")
+    parser.add_argument("--rescan", action="store_true", help="Ignore the index and parse everything again")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(REPO_ROOT, KIND_OUTPUTS[args.kind])
+    index_file = LockedJSONFile(args.index)
+    started = time.monotonic()
+
+    with index_file.locked():
+        state = index_file.read()
+        index = {} if args.rescan else state.get(args.kind, {})
+        scanned, matched, parsed = scan_mailboxes(args.mailbox, args.kind, index, args.workers, args.sender)
+        state[args.kind] = index
+        index_file.write(state)
+
+    print(f"Scanned {scanned} message(s) in {time.monotonic() - started:.2f}s: "
+          f"{matched} from {args.sender}, {parsed} new", file=sys.stderr)
+
+    entries = sessions_output(index, args.require_auth)
+    write_bytes_if_changed(output, json.dumps(entries, separators=(",", ":")).encode())
+    print(f"Wrote {len(entries) if entries[0]['start'] else 0} session(s) to {output}", file=sys.stderr)
+    report_changes()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Compact campaign event record
+
+Campaign event nodes are converted once, as they are read from the API,
+into CampaignEvent objects whose timestamps are already parsed into epoch
+seconds. Filtering and sorting then compare integers instead of
+re-parsing ISO strings (and sort correctly across mixed UTC offsets),
+and `__slots__` keeps each record far smaller than the dict it replaces.
+The original ISO strings are kept so the feeds stay byte-for-byte the
+same.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def parse_timestamp(value: str) -> Tuple[int, int]:
+    """
+    Parse an ISO 8601 timestamp (naive means UTC).
+
+    Returns:
+        (epoch seconds, UTC offset in seconds) tuple
+    """
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp()), int(dt.utcoffset().total_seconds())
+
+
+class CampaignEvent:
+    """
+    One campaign event (Free Electricity Session, Power Up, ...).
+
+    Attributes:
+        code: Event code (may be None)
+        name: Event name (may be None)
+        start: Start time in epoch seconds
+        end: End time in epoch seconds
+        start_iso: Start time exactly as returned by the API
+        end_iso: End time exactly as returned by the API
+        utc_offset: UTC offset of the API's start time, in seconds
+    """
+
+    __slots__ = ("code", "name", "start", "end", "start_iso", "end_iso", "utc_offset")
+
+    def __init__(self, code: Optional[str], name: Optional[str], start_iso: str, end_iso: str):
+        self.code = code
+        self.name = name
+        self.start_iso = start_iso
+        self.end_iso = end_iso
+        self.start, self.utc_offset = parse_timestamp(start_iso)
+        self.end, _ = parse_timestamp(end_iso)
+
+    @classmethod
+    def from_node(cls, node: Dict) -> "CampaignEvent":
+        """Build an event from a GraphQL node with `code`, `name`, `startAt` and `endAt`."""
+        return cls(node.get("code"), node.get("name"), node["startAt"], node["endAt"])
+
+    def start_datetime(self) -> datetime:
+        """Start time as an aware datetime in the API's original offset."""
+        return datetime.fromtimestamp(self.start, timezone(timedelta(seconds=self.utc_offset)))
+
+    def end_datetime(self) -> datetime:
+        """End time as an aware datetime in the same offset as the start."""
+        return datetime.fromtimestamp(self.end, timezone(timedelta(seconds=self.utc_offset)))
+
+    def __repr__(self) -> str:
+        return f"CampaignEvent(code={self.code!r}, start={self.start_iso!r}, end={self.end_iso!r})"
+
+
+def events_from_nodes(nodes: Iterable[Dict]) -> List[CampaignEvent]:
+    """Convert GraphQL event nodes into CampaignEvent records."""
+    return [CampaignEvent.from_node(node) for node in nodes]
+
+
+def not_ended(events: Iterable[CampaignEvent], now: Optional[float] = None) -> List[CampaignEvent]:
+    """Events that have not ended yet, in their original order."""
+    now = datetime.now(timezone.utc).timestamp() if now is None else now
+    return [event for event in events if event.end > now]
+
+
+def sort_by_start(events: Iterable[CampaignEvent]) -> List[CampaignEvent]:
+    """Events ordered by their actual start instant."""
+    return sorted(events, key=lambda event: event.start)
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Lightweight HTTP server for the JSON feeds
+Holds the latest feeds in memory as pre-serialized (and pre-gzipped)
+bytes and serves them with strong ETags and Last-Modified, answering
+conditional requests with 304 Not Modified. Snapshots are rebuilt only
+when a feed file changes on disk and are swapped in atomically, so a
+request always sees one complete version of a feed. When given a
+ChangeBroadcaster it also streams event changes to Server-Sent Events
+clients on `/events`. A feed requested with `?since=<seq>` returns only
+the records of its change log (see change_log.py) after that sequence
+number.
+
+Usage:
+
+    python feed_server.py --port 8080
+
+    curl -H 'Accept-Encoding: gzip' http://localhost:8080/powerup_graphql.json
+"""
+
+import argparse
+import fnmatch
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from change_log import changes_path, parse_log, select_changes
+from feed_writer import FEED_DIR
+
+# Configuration
+DEFAULT_HOST = os.getenv("OCTOPUS_FEED_SERVER_HOST", "0.0.0.0")
+DEFAULT_PORT = int(os.getenv("OCTOPUS_FEED_SERVER_PORT", "8080"))
+DEFAULT_FEED_DIR = FEED_DIR
+# Feed files to serve (glob patterns, comma separated); covers every campaign's `{name}_graphql` feed
+# (including registry and auto-detected ones), per-MPAN feeds, .meta.json sidecars, .min.json variants,
+# .changes.jsonl change logs and the feed manifest
+DEFAULT_FEED_PATTERNS = os.getenv(
+    "OCTOPUS_FEED_PATTERNS",
+    "*_graphql*.json,*_graphql*.changes.jsonl,feeds.manifest.json"
+)
+# How often the feed directory is checked for changed files
+DEFAULT_RELOAD_INTERVAL = float(os.getenv("OCTOPUS_FEED_RELOAD_INTERVAL", "5"))
+DEFAULT_MAX_AGE = int(os.getenv("OCTOPUS_FEED_MAX_AGE", "60"))
+# Seconds between keep-alive comments on idle SSE connections
+DEFAULT_SSE_KEEPALIVE = float(os.getenv("OCTOPUS_SSE_KEEPALIVE", "15"))
+
+
+class FeedSnapshot:
+    """
+    One immutable version of a feed, ready to be written to a socket.
+
+    Args:
+        body: Feed contents
+        mtime: Modification time of the file the contents came from
+    """
+
+    def __init__(self, body: bytes, mtime: float):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+        self.etag = f'"{digest}"'
+        # The gzip representation has different bytes, so it needs its own strong ETag
+        self.gzip_etag = f'"{digest}-gz"'
+        self.mtime = int(mtime)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self._log: Optional[Tuple[Dict, List[Dict]]] = None
+
+    def parsed_log(self) -> Tuple[Dict, List[Dict]]:
+        """The snapshot parsed as a change log (parsed once, on first use)."""
+        if self._log is None:
+            self._log = parse_log(self.body)
+        return self._log
+
+
+class FeedStore:
+    """
+    In-memory snapshots of every feed file in a directory.
+
+    Args:
+        directory: Directory holding the feed files
+        patterns: Glob patterns selecting which files are feeds
+    """
+
+    def __init__(self, directory: str = DEFAULT_FEED_DIR, patterns: Optional[List[str]] = None):
+        self.directory = directory
+        self.patterns = patterns or [p.strip() for p in DEFAULT_FEED_PATTERNS.split(",") if p.strip()]
+        self._snapshots: Dict[str, FeedSnapshot] = {}
+        self._stamps: Dict[str, Tuple[int, int]] = {}
+        self._reload_lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[FeedSnapshot]:
+        """Current snapshot of a feed, or None if there is no such feed."""
+        return self._snapshots.get(name)
+
+    def names(self) -> List[str]:
+        return sorted(self._snapshots)
+
+    def reload(self) -> List[str]:
+        """
+        Rebuild snapshots for feed files that changed on disk and swap them in.
+
+        Returns:
+            Names of the feeds that were added, changed or removed
+        """
+        with self._reload_lock:
+            snapshots = dict(self._snapshots)
+            stamps = dict(self._stamps)
+            seen = set()
+            changed = []
+
+            for name in os.listdir(self.directory):
+                if not any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name), "rb") as f:
+                        stat = os.fstat(f.fileno())
+                        seen.add(name)
+                        stamp = (stat.st_mtime_ns, stat.st_size)
+                        if stamps.get(name) == stamp:
+                            continue
+                        body = f.read()
+                except FileNotFoundError:
+                    continue
+                if name not in snapshots or snapshots[name].body != body:
+                    snapshots[name] = FeedSnapshot(body, stat.st_mtime)
+                    changed.append(name)
+                stamps[name] = stamp
+
+            for name in set(snapshots) - seen:
+                del snapshots[name]
+                del stamps[name]
+                changed.append(name)
+
+            # Publish the new set in one assignment; in-flight requests keep the old snapshots
+            self._snapshots = snapshots
+            self._stamps = stamps
+            return changed
+
+
+def accepts_gzip(header: Optional[str]) -> bool:
+    """True if an Accept-Encoding header allows gzip."""
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag (RFC 9110)."""
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    """Serves snapshots from `server.store`."""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "OctopusFeedServer/1.0"
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        url = urlsplit(self.path)
+        name = url.path.lstrip("/")
+        if name == "events" and self.server.broadcaster is not None:
+            self._stream_events(send_body)
+            return
+
+        since = parse_qs(url.query).get("since")
+        if since is not None:
+            self._serve_changes(name, since[0], send_body)
+            return
+
+        snapshot = self.server.store.get(name)
+        if snapshot is None:
+            self._send(404, b'{"error": "not found"}\n', {"Content-Type": "application/json"}, send_body)
+            return
+
+        use_gzip = accepts_gzip(self.headers.get("Accept-Encoding"))
+        etag = snapshot.gzip_etag if use_gzip else snapshot.etag
+        headers = {
+            "Content-Type": "application/json",
+            "ETag": etag,
+            "Last-Modified": snapshot.last_modified,
+            "Cache-Control": f"public, max-age={self.server.max_age}",
+            "Vary": "Accept-Encoding"
+        }
+
+        if self._not_modified(snapshot):
+            self._send(304, b"", headers, send_body, content_length=False)
+            return
+
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            self._send(200, snapshot.gzip_body, headers, send_body)
+        else:
+            self._send(200, snapshot.body, headers, send_body)
+
+    def _serve_changes(self, name: str, since: str, send_body: bool):
+        """Serve the change log records of feed `name` after sequence number `since`."""
+        snapshot = self.server.store.get(changes_path(name))
+        if snapshot is None:
+            self._send(404, b'{"error": "no change log for this feed"}\n', {"Content-Type": "application/json"}, send_body)
+            return
+        try:
+            since_seq = int(since)
+        except ValueError:
+            self._send(400, b'{"error": "since must be an integer"}\n', {"Content-Type": "application/json"}, send_body)
+            return
+
+        headers = {
+            "Content-Type": "application/json",
+            "ETag": f'{snapshot.etag[:-1]}-{since_seq}"',
+            "Last-Modified": snapshot.last_modified,
+            "Cache-Control": f"public, max-age={self.server.max_age}"
+        }
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None and etag_matches(if_none_match, headers["ETag"]):
+            self._send(304, b"", headers, send_body, content_length=False)
+            return
+
+        body = json.dumps(select_changes(*snapshot.parsed_log(), since_seq)).encode()
+        self._send(200, body, headers, send_body)
+
+    def _stream_events(self, send_body: bool):
+        """Stream changes as Server-Sent Events until the client disconnects."""
+        broadcaster = self.server.broadcaster
+        try:
+            last_id = int(self.headers.get("Last-Event-ID", ""))
+        except ValueError:
+            last_id = broadcaster.last_id
+
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if not send_body:
+            return
+
+        try:
+            self.wfile.write(b"retry: 10000\n\n")
+            self.wfile.flush()
+            while True:
+                items = broadcaster.wait_for(last_id, self.server.sse_keepalive)
+                if not items:
+                    self.wfile.write(b": keepalive\n\n")
+                for item_id, change in items:
+                    self.wfile.write(f"id: {item_id}\nevent: {change['type']}\ndata: {json.dumps(change)}\n\n".encode())
+                    last_id = item_id
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _not_modified(self, snapshot: FeedSnapshot) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, snapshot.etag) or etag_matches(if_none_match, snapshot.gzip_etag)
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return snapshot.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send(self, status: int, body: bytes, headers: Dict[str, str], send_body: bool, content_length: bool = True):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if content_length:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body and body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Per-request logging to stderr dominates the cost of a 304; only log when asked
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FeedServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server bound to a FeedStore.
+
+    Args:
+        address: (host, port) to listen on
+        store: Snapshots to serve
+        max_age: Cache-Control max-age in seconds
+        verbose: Log every request to stderr
+        broadcaster: Optional ChangeBroadcaster streamed on /events
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        store: FeedStore,
+        max_age: int = DEFAULT_MAX_AGE,
+        verbose: bool = False,
+        broadcaster=None,
+        sse_keepalive: float = DEFAULT_SSE_KEEPALIVE
+    ):
+        super().__init__(address, FeedRequestHandler)
+        self.store = store
+        self.max_age = max_age
+        self.verbose = verbose
+        self.broadcaster = broadcaster
+        self.sse_keepalive = sse_keepalive
+
+
+def start_feed_server(
+    store: FeedStore,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    reload_interval: Optional[float] = DEFAULT_RELOAD_INTERVAL,
+    verbose: bool = False,
+    broadcaster=None
+) -> FeedServer:
+    """
+    Load the feeds and serve them from background threads.
+
+    Args:
+        store: Snapshots to serve (reloaded once before serving starts)
+        host: Address to bind
+        port: Port to bind
+        reload_interval: Seconds between checks for changed feed files,
+            or None if the caller calls store.reload() itself
+        verbose: Log every request to stderr
+        broadcaster: Optional ChangeBroadcaster streamed on /events
+
+    Returns:
+        The running server (call shutdown() to stop it)
+    """
+    store.reload()
+    server = FeedServer((host, port), store, verbose=verbose, broadcaster=broadcaster)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    if reload_interval:
+        def watch():
+            while True:
+                time.sleep(reload_interval)
+                try:
+                    changed = store.reload()
+                except OSError as e:
+                    print(f"WARNING: Could not reload feeds: {e}", file=sys.stderr)
+                    continue
+                if changed:
+                    print(f"Reloaded feed(s): {', '.join(changed)}", file=sys.stderr)
+
+        threading.Thread(target=watch, daemon=True).start()
+
+    print(f"Serving {len(store.names())} feed(s) on http://{host}:{port}/", file=sys.stderr)
+    return server
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Serve the JSON feeds over HTTP with ETags and gzip")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to bind")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to bind")
+    parser.add_argument("--dir", default=DEFAULT_FEED_DIR, help="Directory holding the feed files")
+    parser.add_argument("--reload-interval", type=float, default=DEFAULT_RELOAD_INTERVAL,
+                        help="Seconds between checks for changed feed files")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    server = start_feed_server(FeedStore(args.dir), args.host, args.port, args.reload_interval, args.verbose)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
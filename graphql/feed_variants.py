@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Compact and precompressed variants of the JSON feeds, with a manifest
+
+Next to every feed (e.g. powerup_graphql.json) the output stage writes:
+
+- powerup_graphql.min.json: the same data without whitespace
+- powerup_graphql.json.gz / powerup_graphql.json.br: the feed exactly as
+  published, compressed once at maximum level, for static hosts and CDNs
+  that serve precompressed siblings (nginx gzip_static/brotli_static, S3
+  objects with Content-Encoding)
+- powerup_graphql.msgpack: MessagePack with `start` / `end` as epoch
+  seconds instead of ISO strings
+
+and records the SHA-256 and size of each file in feeds.manifest.json, so a
+client can compare one small file with its last copy and skip downloading
+feeds that did not change.
+
+Brotli and MessagePack variants need the optional `brotli` and `msgpack`
+packages and are skipped without them. Everything is written with
+feed_writer, so unchanged variants are not rewritten; gzip output carries
+no timestamp for the same reason.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from event_model import parse_timestamp
+from feed_writer import write_bytes_if_changed, write_json_if_changed
+
+try:
+    import brotli
+except ImportError:  # Optional: no .br variants
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # Optional: no .msgpack variants
+    msgpack = None
+
+# Configuration
+# Variants to write (comma separated); empty disables them and the manifest
+FEED_VARIANTS = [
+    v.strip() for v in os.getenv("OCTOPUS_FEED_VARIANTS", "min,gzip,br,msgpack").split(",") if v.strip()
+]
+MANIFEST_NAME = os.getenv("OCTOPUS_FEED_MANIFEST", "feeds.manifest.json")
+# Fields converted to epoch seconds in the binary variant
+TIMESTAMP_FIELDS = ("start", "end")
+
+_manifest_lock = threading.Lock()
+
+
+def minify(body: bytes) -> bytes:
+    """The feed as compact JSON (same data, key order preserved)."""
+    return json.dumps(json.loads(body), separators=(",", ":")).encode()
+
+
+def gzip_compress(body: bytes) -> bytes:
+    """Deterministic gzip (level 9, no timestamp)."""
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def brotli_compress(body: bytes) -> bytes:
+    return brotli.compress(body, quality=11, mode=brotli.MODE_TEXT)
+
+
+def with_epoch_timestamps(data: Any) -> Any:
+    """Copy of feed data with every ISO `start` / `end` replaced by epoch seconds."""
+    if isinstance(data, list):
+        return [with_epoch_timestamps(item) for item in data]
+    if isinstance(data, dict):
+        return {
+            key: parse_timestamp(value)[0] if key in TIMESTAMP_FIELDS and isinstance(value, str)
+            else with_epoch_timestamps(value)
+            for key, value in data.items()
+        }
+    return data
+
+
+def msgpack_encode(body: bytes) -> bytes:
+    return msgpack.packb(with_epoch_timestamps(json.loads(body)), use_bin_type=True)
+
+
+# Variant name -> path (from the feed's root and extension), encoder, and whether its package is installed
+VARIANTS: Dict[str, Dict[str, Any]] = {
+    "min": {"path": lambda root, ext: f"{root}.min{ext}", "encode": minify, "available": True},
+    "gzip": {"path": lambda root, ext: f"{root}{ext}.gz", "encode": gzip_compress, "available": True},
+    "br": {"path": lambda root, ext: f"{root}{ext}.br", "encode": brotli_compress, "available": brotli is not None},
+    "msgpack": {"path": lambda root, ext: f"{root}.msgpack", "encode": msgpack_encode, "available": msgpack is not None},
+}
+
+
+def variant_path(output_path: str, variant: str) -> str:
+    """Path of one variant of a feed, e.g. powerup_graphql.json.gz."""
+    path: Callable[[str, str], str] = VARIANTS[variant]["path"]
+    return path(*os.path.splitext(output_path))
+
+
+def _describe(content: bytes) -> Dict:
+    return {"sha256": hashlib.sha256(content).hexdigest(), "bytes": len(content)}
+
+
+def write_feed_variants(output_path: str, variants: Optional[List[str]] = None) -> Dict:
+    """
+    Write the variants of a feed that was just written, and update the manifest.
+
+    Args:
+        output_path: Path of the feed
+        variants: Variant names (default: OCTOPUS_FEED_VARIANTS)
+
+    Returns:
+        The feed's manifest entry
+    """
+    variants = FEED_VARIANTS if variants is None else variants
+    if not variants:
+        return {}
+    with open(output_path, "rb") as f:
+        body = f.read()
+
+    entry = _describe(body)
+    entry["variants"] = {}
+    for variant in variants:
+        if variant not in VARIANTS:
+            raise Exception(f"Unknown feed variant '{variant}' (expected one of {sorted(VARIANTS)})")
+        if not VARIANTS[variant]["available"]:
+            continue
+        path = variant_path(output_path, variant)
+        content = VARIANTS[variant]["encode"](body)
+        write_bytes_if_changed(path, content)
+        entry["variants"][variant] = {"path": os.path.basename(path), **_describe(content)}
+
+    update_manifest(output_path, entry)
+    return entry
+
+
+def update_manifest(output_path: str, entry: Dict) -> None:
+    """
+    Record a feed's entry in the manifest next to it, dropping feeds whose
+    file no longer exists. Feeds are listed in name order, so the manifest
+    only changes when a feed does.
+    """
+    directory = os.path.dirname(os.path.abspath(output_path))
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    with _manifest_lock:
+        try:
+            with open(manifest_path) as f:
+                feeds = json.load(f).get("feeds", {})
+        except (FileNotFoundError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"WARNING: Rebuilding unreadable manifest {manifest_path}: {e}", file=sys.stderr)
+            feeds = {}
+
+        feeds[os.path.basename(output_path)] = entry
+        feeds = {name: feeds[name] for name in sorted(feeds) if os.path.exists(os.path.join(directory, name))}
+        write_json_if_changed(manifest_path, {"feeds": feeds})
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Change-aware, atomic output writer for the JSON feeds
+
+Feeds are serialized exactly as before (`json.dumps(..., indent=2)`) and
+compared by content hash with the file already on disk. Unchanged files
+are left alone, so their modification time and git state do not churn;
+changed files are written to a temporary file, fsynced and renamed into
+place so readers never see a half-written feed. Every write is recorded
+so a run can report whether anything changed and downstream publishing
+can be skipped when nothing did.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from typing import Any, Dict, Optional
+
+# Configuration
+# Directory the feeds are written to (and served from); defaults to the repository root
+FEED_DIR = os.getenv("OCTOPUS_FEED_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_results: Dict[str, bool] = {}
+_results_lock = threading.Lock()
+
+
+def serialize(data: Any) -> bytes:
+    """Canonical feed serialization (2-space indent, key order preserved)."""
+    return json.dumps(data, indent=2).encode()
+
+
+def _file_digest(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def write_bytes_if_changed(path: str, content: bytes) -> bool:
+    """
+    Atomically replace a file unless it already has exactly this content.
+
+    Args:
+        path: Destination path
+        content: New file contents
+
+    Returns:
+        True if the file was written, False if it was already up to date
+    """
+    changed = _file_digest(path) != hashlib.sha256(content).hexdigest()
+
+    if changed:
+        directory = os.path.dirname(os.path.abspath(path))
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        # Make the rename itself durable
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    with _results_lock:
+        _results[path] = _results.get(path, False) or changed
+    return changed
+
+
+def write_json_if_changed(path: str, data: Any) -> bool:
+    """
+    Serialize `data` canonically and write it only if it differs from `path`.
+
+    Returns:
+        True if the file was written, False if it was already up to date
+    """
+    return write_bytes_if_changed(path, serialize(data))
+
+
+def append_bytes(path: str, content: bytes) -> None:
+    """
+    Append to a file (e.g. an append-only change log) and fsync it.
+
+    The file is recorded as changed whenever `content` is not empty.
+    """
+    if content:
+        with open(path, "ab") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+
+    with _results_lock:
+        _results[path] = _results.get(path, False) or bool(content)
+
+
+def output_results() -> Dict[str, bool]:
+    """Map of every path written during this run to whether it changed."""
+    with _results_lock:
+        return dict(_results)
+
+
+def reset_results() -> None:
+    """Forget recorded writes, e.g. between polling cycles of a long-running process."""
+    with _results_lock:
+        _results.clear()
+
+
+def report_changes() -> bool:
+    """
+    Print which outputs changed and, under GitHub Actions, set the step
+    output `changed=true|false` so later steps can be skipped.
+
+    Returns:
+        True if any output changed
+    """
+    results = output_results()
+    changed = [path for path, was_changed in results.items() if was_changed]
+    print(f"Outputs: {len(changed)} changed, {len(results) - len(changed)} unchanged", file=sys.stderr)
+    for path in changed:
+        print(f"  changed: {path}", file=sys.stderr)
+
+    github_output = os.getenv("GITHUB_OUTPUT")
+    if github_output:
+        with open(github_output, "a") as f:
+            f.write(f"changed={'true' if changed else 'false'}\n")
+
+    return bool(changed)
@@ -7,133 +7,44 @@ import os
 import sys
 import json
 import requests
-from datetime import datetime, timezone
-from typing import Dict, List
+from datetime import datetime
+from typing import List, Optional, Tuple
 
-# Configuration
-GRAPHQL_URL = "https://api.octopus.energy/v1/graphql/"
+from account_cache import fetch_account_topology, get_account_cache, import_mpans, is_unknown_supply_point_error
+from campaigns import DEFAULT_PAGE_SIZE, FREE_ELECTRICITY_SLUG, iter_campaign_events
+from event_model import CampaignEvent, not_ended, sort_by_start
+from feed_variants import write_feed_variants
+from feed_writer import FEED_DIR, report_changes, write_json_if_changed
+from metrics import run_instrumented, stage
+from octopus_client import (
+    GraphQLClient,
+    GraphQLError,
+    get_client,
+    get_account_numbers,
+    is_transient_error,
+    get_token,
+    get_token_with_api_key,
+)
+from response_cache import StaleWhileRevalidateClient, write_feed_metadata
+from token_store import get_cached_token
 
 
-def get_token_with_api_key(api_key: str) -> str:
-    """
-    Get JWT token using API key via ObtainKrakenToken mutation.
-    
-    Args:
-        api_key: Your Octopus Energy API key
-    
-    Returns:
-        JWT token string
-    """
-    mutation = """
-    mutation ObtainKrakenToken($input: ObtainJSONWebTokenInput!) {
-        obtainKrakenToken(input: $input) {
-            token
-            refreshToken
-            refreshExpiresIn
-        }
-    }
-    """
-    
-    variables = {
-        "input": {
-            "APIKey": api_key
-        }
-    }
-    
-    response = requests.post(
-        GRAPHQL_URL,
-        json={"query": mutation, "variables": variables}
-    )
-    response.raise_for_status()
-    data = response.json()
-    
-    if "errors" in data:
-        raise Exception(f"GraphQL errors: {data['errors']}")
-    
-    return data["data"]["obtainKrakenToken"]["token"]
-
-
-def get_token(email: str, password: str) -> str:
-    """
-    Get JWT token using email/password via ObtainKrakenToken mutation.
-    
-    Args:
-        email: Your Octopus Energy account email
-        password: Your Octopus Energy account password
-    
-    Returns:
-        JWT token string
-    """
-    mutation = """
-    mutation ObtainKrakenToken($input: ObtainJSONWebTokenInput!) {
-        obtainKrakenToken(input: $input) {
-            token
-            refreshToken
-            refreshExpiresIn
-        }
-    }
-    """
-    
-    variables = {
-        "input": {
-            "email": email,
-            "password": password
-        }
-    }
-    
-    response = requests.post(
-        GRAPHQL_URL,
-        json={"query": mutation, "variables": variables}
-    )
-    response.raise_for_status()
-    data = response.json()
-    
-    if "errors" in data:
-        raise Exception(f"GraphQL errors: {data['errors']}")
-    
-    return data["data"]["obtainKrakenToken"]["token"]
-
-
-def get_account_number(token: str) -> str:
+def get_account_number(token: str, client: Optional[GraphQLClient] = None) -> str:
     """
     Auto-discover account number for the authenticated user.
     Returns the first account number found via the viewer query.
     
     Args:
         token: JWT authentication token
+        client: Optional client (defaults to the shared client)
     
     Returns:
         Account number string (e.g., A-12345678)
     """
-    query = """
-    query ViewerQuery {
-      viewer {
-        accounts {
-          number
-        }
-      }
-    }
-    """
-    
-    headers = {"Authorization": token}
-    response = requests.post(
-        GRAPHQL_URL,
-        json={"query": query},
-        headers=headers
-    )
-    response.raise_for_status()
-    data = response.json()
-    
-    if "errors" in data:
-        raise Exception(f"GraphQL errors: {data['errors']}")
-    
-    accounts = data["data"]["viewer"]["accounts"]
-    
-    if not accounts:
-        raise Exception("No accounts found for authenticated user")
+    accounts = get_account_numbers(token, client)
     
     # Return the first account number
-    account_number = accounts[0]["number"]
+    account_number = accounts[0]
     print(f"Auto-discovered account number: {account_number}")
     
     if len(accounts) > 1:
@@ -142,139 +53,59 @@ def get_account_number(token: str) -> str:
     return account_number
 
 
-def get_account_mpans(token: str, account_number: str) -> List[str]:
+def get_account_mpans(token: str, account_number: str, client: Optional[GraphQLClient] = None) -> List[str]:
     """
     Fetch electricity meter point MPANs for an account.
     Only returns IMPORT meter points (excludes EXPORT meters like solar export).
     
+    The finder itself reads these from the account cache; this fetches the
+    account topology directly.
+    
     Args:
         token: JWT authentication token
         account_number: Your Octopus account number (e.g., A-12345678)
+        client: Optional client (defaults to the shared client)
     
     Returns:
-        List of MPAN strings for import meters only
-    """
-    query = """
-    query AccountPropertiesQuery($accountNumber: String!) {
-      account(accountNumber: $accountNumber) {
-        properties {
-          electricityMeterPoints {
-            mpan
-            direction
-            agreements {
-              validFrom
-              validTo
-            }
-          }
-        }
-      }
-    }
+        List of MPAN strings for import meters with agreements only
     """
-    
-    variables = {
-        "accountNumber": account_number
-    }
-    
-    headers = {
-        "Authorization": token,
-        "Content-Type": "application/json"
-    }
-    
-    response = requests.post(
-        GRAPHQL_URL,
-        json={"query": query, "variables": variables},
-        headers=headers
-    )
-    response.raise_for_status()
-    data = response.json()
-    
-    if "errors" in data:
-        raise Exception(f"GraphQL errors: {data['errors']}")
-    
-    # Extract MPANs from properties, filtering for IMPORT meters only
-    mpans = []
-    properties = data.get("data", {}).get("account", {}).get("properties", [])
-    for prop in properties:
-        for meter_point in prop.get("electricityMeterPoints", []):
-            mpan = meter_point.get("mpan")
-            direction = meter_point.get("direction")
-            
-            if mpan and direction == "IMPORT":
-                # Check if this meter point has active agreements
-                agreements = meter_point.get("agreements", [])
-                if agreements:  # Only include meter points with agreements
-                    mpans.append(mpan)
-    
-    return mpans
+    return import_mpans(fetch_account_topology(token, client), account_number)
 
 
 def get_free_electricity_sessions(
     token: str,
     account_number: str,
-    supply_point_identifier: str
-) -> List[Dict]:
+    supply_point_identifier: str,
+    client: Optional[GraphQLClient] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    ends_after: Optional[datetime] = None
+) -> List[CampaignEvent]:
     """
-    Fetch free electricity campaign events.
+    Fetch free electricity campaign events, following pagination cursors.
     
     Args:
         token: JWT authentication token
         account_number: Your Octopus account number (e.g., A-12345678)
         supply_point_identifier: The MPAN of your electricity meter
+        client: Optional client (defaults to the shared client)
+        page_size: Events requested per page
+        ends_after: Skip sessions that end at or before this time
     
     Returns:
         List of free electricity session events
     """
-    query = """
-    query FreeElectricityEventsQuery($accountNumber: String!, $supplyPointIdentifier: String!, $campaignSlug: String!, $first: Int!) {
-      customerFlexibilityCampaignEvents(
-        accountNumber: $accountNumber
-        supplyPointIdentifier: $supplyPointIdentifier
-        campaignSlug: $campaignSlug
-        first: $first
-      ) {
-        edges {
-          node {
-            name
-            code
-            startAt
-            endAt
-          }
-        }
-        edgeCount
-      }
-    }
-    """
-    
-    variables = {
-        "accountNumber": account_number,
-        "supplyPointIdentifier": supply_point_identifier,
-        "campaignSlug": "free_electricity",
-        "first": 50
-    }
-    
-    headers = {
-        "Authorization": token,
-        "Content-Type": "application/json"
-    }
-    
-    response = requests.post(
-        GRAPHQL_URL,
-        json={"query": query, "variables": variables},
-        headers=headers
-    )
-    response.raise_for_status()
-    
-    data = response.json()
-    
-    if "errors" in data:
-        raise Exception(f"GraphQL errors: {data['errors']}")
-    
-    # Extract nodes from edges
-    edges = data["data"]["customerFlexibilityCampaignEvents"]["edges"]
-    return [edge["node"] for edge in edges]
+    return list(iter_campaign_events(
+        token,
+        account_number,
+        supply_point_identifier,
+        FREE_ELECTRICITY_SLUG,
+        page_size=page_size,
+        ends_after=ends_after,
+        client=client
+    ))
 
 
-def format_sessions_human(sessions: List[Dict]) -> None:
+def format_sessions_human(sessions: List[CampaignEvent]) -> None:
     """Pretty print the sessions for human reading."""
     if not sessions:
         print("No free electricity sessions found.")
@@ -283,32 +114,34 @@ def format_sessions_human(sessions: List[Dict]) -> None:
     print(f"\nFound {len(sessions)} free electricity session(s):\n")
     
     for session in sessions:
-        start = datetime.fromisoformat(session["startAt"].replace("Z", "+00:00"))
-        end = datetime.fromisoformat(session["endAt"].replace("Z", "+00:00"))
-        name = session.get("name", "N/A")
-        code = session.get("code", "N/A")
+        start = session.start_datetime()
+        end = session.end_datetime()
         
-        print(f"Name: {name}")
-        print(f"  Code:  {code}")
+        print(f"Name: {session.name if session.name is not None else 'N/A'}")
+        print(f"  Code:  {session.code if session.code is not None else 'N/A'}")
         print(f"  Start: {start.strftime('%Y-%m-%d %H:%M %Z')}")
         print(f"  End:   {end.strftime('%Y-%m-%d %H:%M %Z')}")
         print()
 
 
-def format_sessions_json(sessions: List[Dict]) -> str:
+def format_sessions_json(sessions: List[CampaignEvent]) -> str:
     """Format sessions as JSON (for GitHub Actions output)."""
     formatted = []
     for session in sessions:
         formatted.append({
-            "name": session["name"],
-            "code": session["code"],
-            "start": session["startAt"],
-            "end": session["endAt"]
+            "name": session.name,
+            "code": session.code,
+            "start": session.start_iso,
+            "end": session.end_iso
         })
     return json.dumps(formatted, indent=2)
 
 
-def write_sessions_to_file(sessions: List[Dict], filename: str = "free_electricity_session_graphql.json") -> None:
+def write_sessions_to_file(
+    sessions: List[CampaignEvent],
+    filename: str = "free_electricity_session_graphql.json",
+    output_dir: Optional[str] = None
+) -> str:
     """
     Write sessions to JSON file matching Google Apps Script format.
     
@@ -318,23 +151,15 @@ def write_sessions_to_file(sessions: List[Dict], filename: str = "free_electrici
     - If no sessions found, outputs [{ "start": null, "end": null, "code": null }]
     
     Args:
-        sessions: List of session dictionaries
+        sessions: Free electricity sessions
         filename: Output filename (default: free_electricity_session_graphql.json)
-    """
-    now = datetime.now(timezone.utc)
-    
-    # Filter for future sessions only (end time > now)
-    future_sessions = []
-    for session in sessions:
-        end_dt = datetime.fromisoformat(session["endAt"].replace("Z", "+00:00"))
-        # Ensure end_dt is timezone-aware for comparison
-        if end_dt.tzinfo is None:
-            end_dt = end_dt.replace(tzinfo=timezone.utc)
-        if end_dt > now:
-            future_sessions.append(session)
+        output_dir: Directory to write to (default: OCTOPUS_FEED_DIR, the repository root)
     
-    # Sort by start time
-    future_sessions.sort(key=lambda s: s["startAt"])
+    Returns:
+        Path of the written file
+    """
+    # Future sessions only (end time > now), sorted by start time
+    future_sessions = sort_by_start(not_ended(sessions))
     
     # Format for output matching Google Apps Script format
     if not future_sessions:
@@ -344,20 +169,79 @@ def write_sessions_to_file(sessions: List[Dict], filename: str = "free_electrici
         output = []
         for session in future_sessions:
             output.append({
-                "start": session["startAt"],
-                "end": session["endAt"],
-                "code": session.get("code", "")
+                "start": session.start_iso,
+                "end": session.end_iso,
+                "code": session.code if session.code is not None else ""
             })
     
-    # Write to file at repo root (one level up from script directory)
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    repo_root = os.path.dirname(script_dir)  # Go up one level to repo root
-    output_path = os.path.join(repo_root, filename)
+    # Write to file at repo root (or OCTOPUS_FEED_DIR) unless told otherwise
+    if output_dir is None:
+        output_dir = FEED_DIR
+    output_path = os.path.join(output_dir, filename)
     
-    with open(output_path, 'w') as f:
-        json.dump(output, f, indent=2)
+    if write_json_if_changed(output_path, output):
+        print(f"Written {len(future_sessions)} future session(s) to {output_path}", file=sys.stderr)
+    else:
+        print(f"Unchanged: {len(future_sessions)} future session(s) already in {output_path}", file=sys.stderr)
+    return output_path
+
+
+def discover_account_and_mpan(
+    api_key: str,
+    token: str,
+    account_number: Optional[str] = None,
+    mpan: Optional[str] = None,
+    refresh: bool = False
+) -> Tuple[str, str]:
+    """
+    Resolve the account number and MPAN to use, auto-discovering whichever
+    was not provided from the cached account topology.
+    
+    Args:
+        api_key: Octopus Energy API key (used as the cache key)
+        token: JWT authentication token
+        account_number: Account number, or None to auto-discover
+        mpan: MPAN, or None to auto-discover
+        refresh: Ignore the cached topology and rediscover it
+    
+    Returns:
+        (account_number, mpan) tuple
+    """
+    accounts = []
+    if not account_number or not mpan:
+        with stage("account_discovery"):
+            accounts = get_account_cache().get_accounts(api_key, token, refresh=refresh)
+    
+    # Auto-discover account number if not provided
+    if not account_number:
+        print("No account number provided, auto-discovering from authenticated user...", file=sys.stderr)
+        account_number = accounts[0]["number"]
+        print(f"Auto-discovered account number: {account_number}")
+        if len(accounts) > 1:
+            print(f"Note: Found {len(accounts)} accounts, using first: {account_number}")
+    else:
+        print(f"Using provided account number: {account_number}", file=sys.stderr)
+    
+    # Auto-fetch MPAN if not provided
+    if not mpan:
+        print("No MPAN provided, fetching from account...", file=sys.stderr)
+        with stage("mpan_discovery"):
+            mpans = import_mpans(accounts, account_number)
+        
+        if not mpans:
+            print("ERROR: No electricity meter points found on account", file=sys.stderr)
+            sys.exit(1)
+        
+        if len(mpans) > 1:
+            print(f"Found {len(mpans)} electricity meter points:", file=sys.stderr)
+            for i, m in enumerate(mpans, 1):
+                print(f"  {i}. {m}", file=sys.stderr)
+            print("\nUsing first MPAN. Set OCTOPUS_MPAN environment variable to use a different one.", file=sys.stderr)
+        
+        mpan = mpans[0]
+        print(f"Using MPAN: {mpan}", file=sys.stderr)
     
-    print(f"Written {len(future_sessions)} future session(s) to {output_path}", file=sys.stderr)
+    return account_number, mpan
 
 
 def main():
@@ -375,44 +259,59 @@ def main():
     
     try:
         print("Authenticating with Octopus Energy API using API key...", file=sys.stderr)
-        token = get_token_with_api_key(api_key)
+        try:
+            with stage("auth"):
+                token = get_cached_token(api_key)
+        except Exception as e:
+            # Carry on through outages so that cached responses can still be served
+            if not is_transient_error(e):
+                raise
+            print(f"WARNING: Authentication failed, falling back to cached data: {e}", file=sys.stderr)
+            token = None
+        swr_client = StaleWhileRevalidateClient(get_client())
         
-        # Auto-discover account number if not provided
-        if not account_number:
-            print("No account number provided, auto-discovering from authenticated user...", file=sys.stderr)
-            account_number = get_account_number(token)
-        else:
-            print(f"Using provided account number: {account_number}", file=sys.stderr)
-        
-        # Auto-fetch MPAN if not provided
-        if not mpan:
-            print("No MPAN provided, fetching from account...", file=sys.stderr)
-            mpans = get_account_mpans(token, account_number)
-            
-            if not mpans:
-                print("ERROR: No electricity meter points found on account", file=sys.stderr)
-                sys.exit(1)
-            
-            if len(mpans) > 1:
-                print(f"Found {len(mpans)} electricity meter points:", file=sys.stderr)
-                for i, m in enumerate(mpans, 1):
-                    print(f"  {i}. {m}", file=sys.stderr)
-                print("\nUsing first MPAN. Set OCTOPUS_MPAN environment variable to use a different one.", file=sys.stderr)
-            
-            mpan = mpans[0]
-            print(f"Using MPAN: {mpan}", file=sys.stderr)
+        account_cache = get_account_cache()
+        discovered = not (account_number and mpan)
+        account_number, mpan = discover_account_and_mpan(api_key, token, account_number, mpan)
         
         print("Fetching free electricity sessions...", file=sys.stderr)
-        sessions = get_free_electricity_sessions(token, account_number, mpan)
+        try:
+            with stage("event_fetch"):
+                sessions = get_free_electricity_sessions(token, account_number, mpan, swr_client)
+        except GraphQLError as e:
+            if not is_unknown_supply_point_error(e):
+                raise
+            # Cached account details are out of date - forget them and rediscover once
+            account_cache.invalidate(api_key)
+            if not discovered:
+                raise
+            print("Supply point rejected, refreshing account details...", file=sys.stderr)
+            account_number, mpan = discover_account_and_mpan(
+                api_key, token, os.getenv("OCTOPUS_ACCOUNT_NUMBER"), os.getenv("OCTOPUS_MPAN"), refresh=True
+            )
+            with stage("event_fetch"):
+                sessions = get_free_electricity_sessions(token, account_number, mpan, swr_client)
         
         # Always write to JSON file (matching Google Apps Script format)
-        write_sessions_to_file(sessions)
+        with stage("output_write"):
+            output_path = write_sessions_to_file(sessions)
+            write_feed_variants(output_path)
+            write_feed_metadata(output_path, swr_client)
+        report_changes()
+        swr_client.wait()
         
         # Also print to stdout if requested
         if output_format == "json":
             print(format_sessions_json(sessions))
         else:
             format_sessions_human(sessions)
+        
+        stats = get_client().connection_stats()
+        print(
+            f"HTTP: {stats['requests']} request(s), {stats['connections_opened']} connection(s) opened, "
+            f"{stats['connections_reused']} reused",
+            file=sys.stderr
+        )
             
     except requests.exceptions.HTTPError as e:
         print(f"ERROR: HTTP request failed: {e}", file=sys.stderr)
@@ -425,4 +324,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    run_instrumented(main)
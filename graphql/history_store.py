@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Persistent event history in SQLite
+
+The feeds only ever contain future events. This store keeps every event
+ever fetched - per campaign, MPAN and code, with start and end as epoch
+seconds - so past sessions remain available for reporting and for
+backtesting automations. Each run upserts all of its events in a single
+transaction; indexes on (campaign, start) and (mpan, start) keep range
+queries fast with hundreds of thousands of rows across tenants.
+
+Usage:
+
+    python history_store.py                       # sessions per month, all campaigns
+    python history_store.py --campaign free_electricity --mpan 1234567890123
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Iterable, List, Optional, Tuple
+
+from cache_file import CACHE_DIR
+from event_model import CampaignEvent
+
+# Configuration
+DEFAULT_HISTORY_DB = os.getenv("OCTOPUS_HISTORY_DB", os.path.join(CACHE_DIR, "history.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    campaign TEXT NOT NULL,
+    mpan TEXT NOT NULL,
+    code TEXT NOT NULL,
+    account TEXT,
+    name TEXT,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    first_seen INTEGER NOT NULL,
+    last_seen INTEGER NOT NULL,
+    PRIMARY KEY (campaign, mpan, code)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS events_campaign_start ON events (campaign, start);
+CREATE INDEX IF NOT EXISTS events_mpan_start ON events (mpan, start);
+"""
+
+UPSERT = """
+INSERT INTO events (campaign, mpan, code, account, name, start, end, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (campaign, mpan, code) DO UPDATE SET
+    account = COALESCE(excluded.account, account),
+    name = excluded.name,
+    start = excluded.start,
+    end = excluded.end,
+    last_seen = excluded.last_seen
+"""
+
+# Row returned by the query methods
+EventRow = Tuple[str, str, str, Optional[str], Optional[str], int, int]
+
+
+def history_rows(
+    campaign: str,
+    mpan: str,
+    events: Iterable[CampaignEvent],
+    account: Optional[str] = None
+) -> List[Tuple]:
+    """
+    Turn campaign events into rows for HistoryStore.record().
+
+    Events without a code are keyed by their start time instead.
+    """
+    return [
+        (campaign, mpan, event.code or event.start_iso, account, event.name, event.start, event.end)
+        for event in events
+    ]
+
+
+def _filters(
+    campaign: Optional[str],
+    mpan: Optional[str],
+    start: Optional[int],
+    end: Optional[int]
+) -> Tuple[str, List]:
+    clauses = []
+    params: List = []
+    for clause, value in (
+        ("campaign = ?", campaign),
+        ("mpan = ?", mpan),
+        ("start >= ?", start),
+        ("start < ?", end),
+    ):
+        if value is not None:
+            clauses.append(clause)
+            params.append(value)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+class HistoryStore:
+    """
+    SQLite-backed event history.
+
+    A connection is opened per call, so one store can be shared between
+    threads (e.g. the tenant batch runner's workers); WAL mode lets
+    readers run while a run is being recorded.
+
+    Args:
+        path: Database file
+    """
+
+    def __init__(self, path: str = DEFAULT_HISTORY_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def record(self, rows: List[Tuple], seen_at: Optional[int] = None) -> int:
+        """
+        Upsert rows from history_rows() in one transaction.
+
+        Returns:
+            Number of rows written
+        """
+        seen_at = int(seen_at or time.time())
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(UPSERT, [row + (seen_at, seen_at) for row in rows])
+        return len(rows)
+
+    def events(
+        self,
+        campaign: Optional[str] = None,
+        mpan: Optional[str] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> List[EventRow]:
+        """
+        Events starting in [start, end), oldest first.
+
+        Returns:
+            (campaign, mpan, code, account, name, start, end) tuples
+        """
+        where, params = _filters(campaign, mpan, start, end)
+        sql = f"SELECT campaign, mpan, code, account, name, start, end FROM events{where} ORDER BY start"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with closing(self._connect()) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def count(
+        self,
+        campaign: Optional[str] = None,
+        mpan: Optional[str] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None
+    ) -> int:
+        """Number of events starting in [start, end)."""
+        where, params = _filters(campaign, mpan, start, end)
+        with closing(self._connect()) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM events{where}", params).fetchone()[0]
+
+    def sessions_per_month(
+        self,
+        campaign: Optional[str] = None,
+        mpan: Optional[str] = None
+    ) -> List[Tuple[str, int]]:
+        """
+        Distinct events per calendar month (UTC) of their start time.
+
+        Events seen on several MPANs are counted once per month.
+
+        Returns:
+            ("YYYY-MM", count) tuples, oldest month first
+        """
+        where, params = _filters(campaign, mpan, None, None)
+        sql = (
+            "SELECT strftime('%Y-%m', start, 'unixepoch') AS month, COUNT(DISTINCT campaign || ':' || code) "
+            f"FROM events{where} GROUP BY month ORDER BY month"
+        )
+        with closing(self._connect()) as conn:
+            return conn.execute(sql, params).fetchall()
+
+
+def main():
+    """Print sessions per month from the history store."""
+    parser = argparse.ArgumentParser(description="Report on the stored event history")
+    parser.add_argument("--db", default=DEFAULT_HISTORY_DB, help="History database")
+    parser.add_argument("--campaign", help="Only this campaign slug")
+    parser.add_argument("--mpan", help="Only this MPAN")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.db)
+    print(f"{store.count(args.campaign, args.mpan)} event(s) in {args.db}")
+    for month, count in store.sessions_per_month(args.campaign, args.mpan):
+        print(f"  {month}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Per-stage run metrics for the finder scripts
+
+A run is split into stages - `auth`, `account_discovery`,
+`mpan_discovery`, `event_fetch` and `output_write`. Each stage records
+its wall time, and the GraphQL client reports every HTTP attempt (status,
+request and response bytes) and every retry to whichever stage is
+running. At the end of a run the metrics are written as a Prometheus
+textfile (OCTOPUS_METRICS_TEXTFILE, for node_exporter's textfile
+collector) and/or a JSON run report (OCTOPUS_METRICS_JSON). A `{script}`
+placeholder in either path is replaced by the script name, so several
+scripts can share one directory.
+
+Running a script with `--profile` (or OCTOPUS_PROFILE=1) also wraps the
+run in cProfile and tracemalloc and prints the hottest functions and the
+biggest allocations to stderr.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+# Configuration
+METRICS_TEXTFILE = os.getenv("OCTOPUS_METRICS_TEXTFILE")
+METRICS_JSON = os.getenv("OCTOPUS_METRICS_JSON")
+PROFILE_OUTPUT = os.getenv("OCTOPUS_PROFILE_OUTPUT")  # Optional pstats dump for snakeviz etc.
+PROFILE_TOP = int(os.getenv("OCTOPUS_PROFILE_TOP", "25"))
+
+STAGES = ("auth", "account_discovery", "mpan_discovery", "event_fetch", "output_write")
+
+
+class StageMetrics:
+    """Counters for one stage of a run."""
+
+    __slots__ = ("duration", "calls", "errors", "statuses", "request_bytes", "response_bytes", "retries")
+
+    def __init__(self):
+        self.duration = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.statuses: Dict[str, int] = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+
+    def as_dict(self) -> Dict:
+        return {
+            "duration_seconds": round(self.duration, 6),
+            "calls": self.calls,
+            "errors": self.errors,
+            "requests": sum(self.statuses.values()),
+            "statuses": dict(self.statuses),
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "retries": self.retries,
+        }
+
+
+class RunMetrics:
+    """
+    Metrics of one run of a script.
+
+    Stages run one after another, so the running stage is process-wide
+    rather than per thread: requests made by worker threads (e.g. the
+    concurrent meter point fetches) count towards the stage that started
+    them. Requests made outside any stage are counted under `other`.
+
+    Args:
+        script: Name used for the `script` label
+    """
+
+    def __init__(self, script: str):
+        self.script = script
+        self.started_at = time.time()
+        self.stages: Dict[str, StageMetrics] = {}
+        self.current = "other"
+        self._lock = threading.Lock()
+
+    def _stage(self, name: str) -> StageMetrics:
+        metrics = self.stages.get(name)
+        if metrics is None:
+            metrics = self.stages[name] = StageMetrics()
+        return metrics
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage and attribute HTTP requests made meanwhile to it."""
+        previous, self.current = self.current, name
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            with self._lock:
+                self._stage(name).errors += 1
+            raise
+        finally:
+            with self._lock:
+                metrics = self._stage(name)
+                metrics.duration += time.perf_counter() - started
+                metrics.calls += 1
+            self.current = previous
+
+    def record_http(self, status: Optional[int], request_bytes: int, response_bytes: int) -> None:
+        """Record one HTTP attempt; a None status means the request failed without a response."""
+        key = str(status) if status is not None else "error"
+        with self._lock:
+            metrics = self._stage(self.current)
+            metrics.statuses[key] = metrics.statuses.get(key, 0) + 1
+            metrics.request_bytes += request_bytes
+            metrics.response_bytes += response_bytes
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self._stage(self.current).retries += 1
+
+    def report(self, success: Optional[bool] = None) -> Dict:
+        """JSON run report."""
+        finished_at = time.time()
+        with self._lock:
+            stages = {name: metrics.as_dict() for name, metrics in self.stages.items()}
+        return {
+            "script": self.script,
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(timespec="seconds"),
+            "duration_seconds": round(finished_at - self.started_at, 6),
+            "success": success,
+            "stages": stages,
+        }
+
+    def prometheus(self, success: Optional[bool] = None) -> str:
+        """Prometheus text exposition of the run (all gauges, for the textfile collector)."""
+        report = self.report(success)
+        script = self.script.replace("\\", "\\\\").replace('"', '\\"')
+        lines = []
+
+        def gauge(name: str, help_text: str, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                label_text = ",".join([f'script="{script}"'] + [f'{k}="{v}"' for k, v in labels])
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        stages = report["stages"]
+        gauge("octopus_run_success", "1 if the last run succeeded, 0 if it failed",
+              [((), int(bool(success)))])
+        gauge("octopus_run_timestamp_seconds", "When the last run started",
+              [((), round(self.started_at, 3))])
+        gauge("octopus_run_duration_seconds", "Wall time of the last run",
+              [((), report["duration_seconds"])])
+        gauge("octopus_stage_duration_seconds", "Wall time spent in each stage of the last run",
+              [((("stage", name),), stage["duration_seconds"]) for name, stage in stages.items()])
+        gauge("octopus_stage_errors", "Stage invocations that raised in the last run",
+              [((("stage", name),), stage["errors"]) for name, stage in stages.items()])
+        gauge("octopus_stage_http_requests", "HTTP attempts per stage and status in the last run",
+              [((("stage", name), ("status", status)), count)
+               for name, stage in stages.items() for status, count in sorted(stage["statuses"].items())])
+        gauge("octopus_stage_request_bytes", "Request body bytes sent per stage in the last run",
+              [((("stage", name),), stage["request_bytes"]) for name, stage in stages.items()])
+        gauge("octopus_stage_response_bytes", "Response body bytes received per stage in the last run",
+              [((("stage", name),), stage["response_bytes"]) for name, stage in stages.items()])
+        gauge("octopus_stage_retries", "Retried requests per stage in the last run",
+              [((("stage", name),), stage["retries"]) for name, stage in stages.items()])
+        return "\n".join(lines) + "\n"
+
+
+_run = RunMetrics(os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0])
+
+
+def stage(name: str):
+    """Context manager timing a stage of the current run."""
+    return _run.stage(name)
+
+
+def record_http(status: Optional[int], request_bytes: int, response_bytes: int) -> None:
+    """Called by the GraphQL client for every HTTP attempt."""
+    _run.record_http(status, request_bytes, response_bytes)
+
+
+def record_retry() -> None:
+    """Called by the GraphQL client before every retry."""
+    _run.record_retry()
+
+
+def current_run() -> RunMetrics:
+    return _run
+
+
+def reset_metrics(script: Optional[str] = None) -> None:
+    """Start a new run, e.g. for every polling cycle of a long-running process."""
+    global _run
+    _run = RunMetrics(script or _run.script)
+
+
+def _write_atomically(path: str, content: str) -> None:
+    # The textfile collector must never see a half-written file
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def export_metrics(
+    success: Optional[bool] = None,
+    textfile: Optional[str] = METRICS_TEXTFILE,
+    json_path: Optional[str] = METRICS_JSON
+) -> None:
+    """Write the current run's metrics to whichever outputs are configured."""
+    try:
+        if textfile:
+            _write_atomically(textfile.replace("{script}", _run.script), _run.prometheus(success))
+        if json_path:
+            _write_atomically(json_path.replace("{script}", _run.script), json.dumps(_run.report(success), indent=2))
+    except OSError as e:
+        print(f"WARNING: Could not write metrics: {e}", file=sys.stderr)
+
+
+def profile_requested() -> bool:
+    """True if the script was started with --profile or OCTOPUS_PROFILE=1."""
+    return "--profile" in sys.argv[1:] or os.getenv("OCTOPUS_PROFILE", "").lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def profiled(output: Optional[str] = PROFILE_OUTPUT, top: int = PROFILE_TOP):
+    """
+    Run the body under cProfile and tracemalloc and print a summary to stderr.
+
+    Args:
+        output: Also dump the raw cProfile stats to this file
+        top: Number of functions and allocation sites to print
+    """
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        print("\n=== Profile (cumulative time) ===", file=sys.stderr)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(top)
+        print(f"=== Memory: peak {peak / 1024:.0f} KiB traced ===", file=sys.stderr)
+        for statistic in snapshot.statistics("lineno")[:top]:
+            print(f"  {statistic}", file=sys.stderr)
+        if output:
+            profiler.dump_stats(output)
+            print(f"Profile written to {output}", file=sys.stderr)
+
+
+def run_instrumented(main: Callable[[], None]) -> None:
+    """
+    Run a script's main(): profile it if requested and export its metrics
+    when it finishes, whether it succeeds or exits with an error.
+    """
+    success = False
+    try:
+        if profile_requested():
+            with profiled():
+                main()
+        else:
+            main()
+        success = True
+    except SystemExit as e:
+        success = not e.code
+        raise
+    finally:
+        export_metrics(success)
@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Octopus Energy GraphQL API
+
+Implements just enough of the API for the finder scripts to run end to
+end without touching the real service: the `obtainKrakenToken` mutation,
+`viewer.accounts` (with properties and meter points), `account.properties` and `account.campaigns`
+and paginated, optionally aliased, `customerFlexibilityCampaignEvents`.
+The dataset size, response latency and the rate of 503 and 429 responses
+are configurable, and every request is counted per operation so
+benchmark.py can report requests per run.
+
+Usage:
+
+    python mock_server.py --port 8765 --events 500 --latency 0.05 --error-rate 0.01
+
+    OCTOPUS_GRAPHQL_URL=http://127.0.0.1:8765/ OCTOPUS_API_KEY=test python fes_finder_graphql.py
+
+REST half-hourly consumption is served at
+`GET /v1/electricity-meter-points/{mpan}/meters/{serial}/consumption/`
+(set OCTOPUS_REST_URL=http://127.0.0.1:8765/v1), with extra load during
+every event. `GET /v1/accounts/{number}/` returns each import MPAN on the
+mock Agile tariff `MOCK_TARIFF` and
+`GET /v1/products/{product}/electricity-tariffs/{tariff}/standard-unit-rates/`
+its deterministic half-hourly prices.
+
+`GET /stats` returns the request counters as JSON (`?reset=1` also clears them).
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from campaigns import FREE_ELECTRICITY_SLUG, POWER_UPS_UKPN_SLUG
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+TOKEN_LIFETIME = 60 * 60
+REFRESH_LIFETIME = 7 * 24 * 60 * 60
+
+CAMPAIGN_EVENTS_FIELD = re.compile(r"(?:(\w+)\s*:\s*)?customerFlexibilityCampaignEvents\s*\(([^)]*)\)")
+ARGUMENT = re.compile(r"(\w+)\s*:\s*(\$\w+|\"[^\"]*\"|\d+|null)")
+CONSUMPTION_PATH = re.compile(r"^/v1/electricity-meter-points/(\d+)/meters/([^/]+)/consumption/?$")
+ACCOUNT_PATH = re.compile(r"^/v1/accounts/([^/]+)/?$")
+UNIT_RATES_PATH = re.compile(r"^/v1/products/([^/]+)/electricity-tariffs/([^/]+)/standard-unit-rates/?$")
+MOCK_TARIFF = "E-1R-AGILE-MOCK-C"
+ACCOUNT_FIELD = re.compile(r"\baccount\s*\(\s*accountNumber\s*:\s*(\$\w+|\"[^\"]*\")")
+
+
+def make_jwt(expires_at: int) -> str:
+    """An unsigned JWT carrying only an `exp` claim (enough for token_store.jwt_expiry())."""
+    def encode(data: Dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode({'exp': expires_at})}.mock"
+
+
+class MockDataset:
+    """
+    Accounts, meter points and campaign events served by the mock API.
+
+    Every account has one property with `meters` IMPORT meter points and
+    one EXPORT meter point. Each campaign has `events` one-hour events,
+    `future_events` of them still to come, spaced `spacing` apart and
+    returned newest first.
+
+    Args:
+        accounts: Number of accounts visible to the API key
+        meters: IMPORT meter points per account
+        events: Events per campaign
+        future_events: How many of those events are in the future
+        spacing: Time between consecutive events
+        campaigns: Campaign slugs the accounts are enrolled in (others answer with an error)
+    """
+
+    def __init__(
+        self,
+        accounts: int = 1,
+        meters: int = 1,
+        events: int = 120,
+        future_events: int = 3,
+        spacing: timedelta = timedelta(days=3),
+        campaigns: Tuple[str, ...] = (FREE_ELECTRICITY_SLUG, POWER_UPS_UKPN_SLUG)
+    ):
+        self.accounts = []
+        self.mpans: Dict[str, set] = {}
+        for a in range(accounts):
+            number = f"A-{a + 1:08X}"
+            meter_points = [self._meter_point(f"{1900000000000 + a * 1000 + m}", "IMPORT") for m in range(meters)]
+            meter_points.append(self._meter_point(f"{2900000000000 + a}", "EXPORT"))
+            self.accounts.append({
+                "number": number,
+                "properties": [{"id": str(a + 1), "electricityMeterPoints": meter_points}]
+            })
+            self.mpans[number] = {meter_point["mpan"] for meter_point in meter_points}
+
+        today = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+        first = today + spacing * future_events
+        self.events: Dict[str, List[Dict]] = {}
+        for slug in campaigns:
+            self.events[slug] = [
+                {"node": {
+                    "name": f"{slug} event {events - i}",
+                    "code": f"{slug.upper()}-{events - i}",
+                    "startAt": (first - spacing * i).isoformat(),
+                    "endAt": (first - spacing * i + timedelta(hours=1)).isoformat()
+                }}
+                for i in range(events)
+            ]
+
+        # Half-hourly readings from a month before the oldest event until now,
+        # with extra load during events (as if households shifted into them)
+        self.readings_from = int((first - spacing * events - timedelta(days=30)).timestamp()) // 1800 * 1800
+        self.event_load: Dict[int, float] = {}
+        for slug, edges in self.events.items():
+            extra = 1.5 if slug == FREE_ELECTRICITY_SLUG else 0.8
+            for edge in edges:
+                start = int(datetime.fromisoformat(edge["node"]["startAt"]).timestamp())
+                end = int(datetime.fromisoformat(edge["node"]["endAt"]).timestamp())
+                for slot in range(start - start % 1800, end, 1800):
+                    self.event_load[slot] = self.event_load.get(slot, 0.0) + extra
+
+    @staticmethod
+    def _meter_point(mpan: str, direction: str) -> Dict:
+        return {
+            "mpan": mpan,
+            "direction": direction,
+            "meters": [{"meterType": f"ELECTRICITY_{direction}", "serialNumber": f"MOCK{mpan[-6:]}"}],
+            "agreements": [{"validFrom": "2020-01-01T00:00:00+00:00", "validTo": None}]
+        }
+
+    def account(self, number: str) -> Optional[Dict]:
+        for account in self.accounts:
+            if account["number"] == number:
+                return account
+        return None
+
+    def reading(self, slot: int) -> float:
+        """kWh imported in the half hour starting at `slot` (deterministic)."""
+        base = 0.12 + 0.08 * ((slot // 1800 * 2654435761) % 1000) / 1000
+        if 17 <= (slot // 3600) % 24 < 20:
+            base += 0.35
+        return round(base + self.event_load.get(slot, 0.0), 3)
+
+    def consumption_page(self, mpan: str, period_from: int, period_to: int, page: int, page_size: int) -> Optional[Dict]:
+        """One page of REST consumption results, oldest first; None for an unknown MPAN."""
+        if not any(mpan in mpans for mpans in self.mpans.values()):
+            return None
+        first = max(period_from + (-period_from) % 1800, self.readings_from)
+        last = min(period_to, int(time.time()) // 1800 * 1800)
+        count = max((last - first + 1799) // 1800, 0)
+        offset = (page - 1) * page_size
+        slots = range(first + offset * 1800, min(first + (offset + page_size) * 1800, first + count * 1800), 1800)
+        return {
+            "count": count,
+            "has_next": offset + page_size < count,
+            "results": [
+                {
+                    "consumption": self.reading(slot),
+                    "interval_start": datetime.fromtimestamp(slot, timezone.utc).isoformat().replace("+00:00", "Z"),
+                    "interval_end": datetime.fromtimestamp(slot + 1800, timezone.utc).isoformat().replace("+00:00", "Z"),
+                }
+                for slot in slots
+            ]
+        }
+
+    def rest_account(self, number: str) -> Optional[Dict]:
+        """REST account details: every import MPAN on the mock tariff."""
+        account = self.account(number)
+        if account is None:
+            return None
+        agreement = {"tariff_code": MOCK_TARIFF, "valid_from": "2020-01-01T00:00:00Z", "valid_to": None}
+        return {
+            "number": number,
+            "properties": [{
+                "id": int(prop["id"]),
+                "electricity_meter_points": [
+                    {"mpan": point["mpan"], "is_export": point["direction"] == "EXPORT", "agreements": [agreement]}
+                    for point in prop["electricityMeterPoints"]
+                ]
+            } for prop in account["properties"]]
+        }
+
+    @staticmethod
+    def unit_rate(slot: int) -> float:
+        """Agile-like pence per kWh for the half hour starting at `slot` (deterministic)."""
+        hour = (slot // 3600) % 24
+        price = 12.0 + 6.0 * ((slot // 1800 * 2246822519) % 1000) / 1000
+        if 16 <= hour < 19:
+            price += 14.0
+        elif 1 <= hour < 5:
+            price -= 8.0
+        return round(price, 2)
+
+    def unit_rates_page(self, period_from: int, period_to: int, page: int, page_size: int) -> Dict:
+        """One page of REST unit rates, newest first; prices are published up to 23:00 UTC tomorrow."""
+        published = (int(time.time()) // 86400 + 1) * 86400 + 23 * 3600
+        first = period_from - period_from % 1800
+        last = min(period_to, published)
+        count = max((last - first + 1799) // 1800, 0)
+        offset = (page - 1) * page_size
+        slots = range(first + (count - 1 - offset) * 1800, first + (count - 1 - min(offset + page_size, count)) * 1800, -1800)
+        return {
+            "count": count,
+            "has_next": offset + page_size < count,
+            "results": [
+                {
+                    "value_exc_vat": round(self.unit_rate(slot) / 1.05, 4),
+                    "value_inc_vat": self.unit_rate(slot),
+                    "valid_from": datetime.fromtimestamp(slot, timezone.utc).isoformat().replace("+00:00", "Z"),
+                    "valid_to": datetime.fromtimestamp(slot + 1800, timezone.utc).isoformat().replace("+00:00", "Z"),
+                    "payment_method": None,
+                }
+                for slot in slots
+            ]
+        }
+
+    def campaign_page(self, account_number: str, mpan: str, slug: str, first: int, after: Optional[str]) -> Dict:
+        """One page of a campaign's events; cursors are offsets."""
+        if mpan not in self.mpans.get(account_number, ()):
+            raise LookupError(f"Unable to find supply point {mpan} on account {account_number}")
+        if slug not in self.events:
+            raise LookupError(f"Supply point {mpan} is not enrolled in campaign {slug}")
+        edges = self.events[slug]
+        offset = int(after) if after else 0
+        page = edges[offset:offset + first]
+        end = offset + len(page)
+        return {
+            "edges": page,
+            "edgeCount": len(page),
+            "pageInfo": {"hasNextPage": end < len(edges), "endCursor": str(end) if page else None}
+        }
+
+
+def _resolve(value: str, variables: Dict):
+    if value.startswith("$"):
+        return variables.get(value[1:])
+    if value.startswith('"'):
+        return value[1:-1]
+    if value == "null":
+        return None
+    return int(value)
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """Answers GraphQL POSTs, REST consumption, account and unit rate GETs and GET /stats."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms per request
+    disable_nagle_algorithm = True
+    server: "MockGraphQLServer"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.stats(reset="reset" in parse_qs(url.query)))
+            return
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        match = CONSUMPTION_PATH.match(url.path)
+        if match:
+            self._consumption(match.group(1), params)
+            return
+        match = ACCOUNT_PATH.match(url.path)
+        if match:
+            self._rest_account(match.group(1))
+            return
+        match = UNIT_RATES_PATH.match(url.path)
+        if match:
+            self._unit_rates(match.group(2), params)
+            return
+        self._send_json(404, {"detail": "Not found."})
+
+    def _rest_preamble(self, authenticated: bool = True) -> bool:
+        """Apply the configured latency and check basic auth; False once an error was sent."""
+        server = self.server
+        if server.latency or server.latency_jitter:
+            time.sleep(server.latency + random.uniform(0, server.latency_jitter))
+        if authenticated and not self.headers.get("Authorization", "").startswith("Basic "):
+            server.count("unauthenticated")
+            self._send_json(401, {"detail": "Authentication credentials were not provided."})
+            return False
+        return True
+
+    def _send_page(self, params: Dict[str, str], page: int, result: Dict):
+        next_url = None
+        if result.pop("has_next"):
+            query = urlencode({**params, "page": page + 1})
+            next_url = f"http://{self.headers.get('Host')}{urlsplit(self.path).path}?{query}"
+        self._send_json(200, {"count": result["count"], "next": next_url, "previous": None, "results": result["results"]})
+
+    @staticmethod
+    def _epoch(params: Dict[str, str], name: str, default: int) -> int:
+        value = params.get(name)
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()) if value else default
+
+    def _consumption(self, mpan: str, params: Dict[str, str]):
+        """REST /electricity-meter-points/{mpan}/meters/{serial}/consumption/ (basic auth, page numbers)."""
+        if not self._rest_preamble():
+            return
+        server = self.server
+        page = int(params.get("page", "1"))
+        page_size = min(int(params.get("page_size", "100")), 25000)
+        result = server.dataset.consumption_page(
+            mpan, self._epoch(params, "period_from", 0), self._epoch(params, "period_to", int(time.time())),
+            page, page_size
+        )
+        server.count("consumption")
+        if result is None:
+            self._send_json(404, {"detail": "Not found."})
+            return
+        self._send_page(params, page, result)
+
+    def _rest_account(self, number: str):
+        """REST /accounts/{number}/ (basic auth)."""
+        if not self._rest_preamble():
+            return
+        account = self.server.dataset.rest_account(number)
+        self.server.count("rest_account")
+        if account is None:
+            self._send_json(404, {"detail": "Not found."})
+            return
+        self._send_json(200, account)
+
+    def _unit_rates(self, tariff: str, params: Dict[str, str]):
+        """REST /products/{product}/electricity-tariffs/{tariff}/standard-unit-rates/ (no auth)."""
+        if not self._rest_preamble(authenticated=False):
+            return
+        server = self.server
+        server.count("unit_rates")
+        if tariff != MOCK_TARIFF:
+            self._send_json(404, {"detail": "Not found."})
+            return
+        now = int(time.time())
+        page = int(params.get("page", "1"))
+        page_size = min(int(params.get("page_size", "100")), 1500)
+        result = server.dataset.unit_rates_page(
+            self._epoch(params, "period_from", now - 86400), self._epoch(params, "period_to", now + 2 * 86400),
+            page, page_size
+        )
+        self._send_page(params, page, result)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        server = self.server
+
+        if server.latency or server.latency_jitter:
+            time.sleep(server.latency + random.uniform(0, server.latency_jitter))
+
+        roll = random.random()
+        if roll < server.error_rate:
+            server.count("injected_503")
+            self._send_json(503, {"error": "Service Unavailable"})
+            return
+        if roll < server.error_rate + server.throttle_rate:
+            server.count("injected_429")
+            self._send_json(429, {"error": "Too Many Requests"}, {"Retry-After": "1"})
+            return
+
+        try:
+            request = json.loads(body)
+            query = request["query"]
+            variables = request.get("variables") or {}
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {"errors": [{"message": "Malformed GraphQL request"}]})
+            return
+
+        operation, response = self._execute(query, variables)
+        server.count(operation)
+        self._send_json(200, response)
+
+    def _execute(self, query: str, variables: Dict) -> Tuple[str, Dict]:
+        dataset = self.server.dataset
+
+        if "obtainKrakenToken" in query:
+            now = int(time.time())
+            return "obtainKrakenToken", {"data": {"obtainKrakenToken": {
+                "token": make_jwt(now + TOKEN_LIFETIME),
+                "refreshToken": f"mock-refresh-{now}",
+                "refreshExpiresIn": now + REFRESH_LIFETIME
+            }}}
+
+        if not self.headers.get("Authorization"):
+            return "unauthenticated", {"errors": [{"message": "Authentication failed: no token provided"}]}
+
+        fields = CAMPAIGN_EVENTS_FIELD.findall(query)
+        if fields:
+            # Like the real API, a failing field is nulled and reported with its path
+            data = {}
+            errors = []
+            for alias, arguments in fields:
+                name = alias or "customerFlexibilityCampaignEvents"
+                args = {arg: _resolve(value, variables) for arg, value in ARGUMENT.findall(arguments)}
+                try:
+                    data[name] = dataset.campaign_page(
+                        args.get("accountNumber"),
+                        args.get("supplyPointIdentifier"),
+                        args.get("campaignSlug"),
+                        args.get("first") or 50,
+                        args.get("after")
+                    )
+                except LookupError as e:
+                    data[name] = None
+                    errors.append({"message": str(e), "path": [name]})
+            response = {"data": data}
+            if errors:
+                response["errors"] = errors
+            return "customerFlexibilityCampaignEvents", response
+
+        if "viewer" in query:
+            return "viewer", {"data": {"viewer": {"accounts": dataset.accounts}}}
+
+        match = ACCOUNT_FIELD.search(query)
+        if match:
+            account = dataset.account(_resolve(match.group(1), variables))
+            if account is None:
+                return "account", {"errors": [{"message": "Account not found"}]}
+            return "account", {"data": {"account": {
+                "properties": account["properties"],
+                "campaigns": [{"slug": slug, "startDate": "2024-01-01", "expiryDate": None} for slug in dataset.events]
+            }}}
+
+        return "unknown", {"errors": [{"message": "Unsupported operation for the mock API"}]}
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count_bytes(len(body))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class MockGraphQLServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering GraphQL requests from a MockDataset.
+
+    Args:
+        address: (host, port) to listen on (port 0 picks a free port)
+        dataset: Data to serve
+        latency: Seconds added to every POST
+        latency_jitter: Up to this many extra seconds, uniformly random
+        error_rate: Fraction of POSTs answered with 503
+        throttle_rate: Fraction of POSTs answered with 429 and Retry-After
+        verbose: Log every request to stderr
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        dataset: MockDataset,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        verbose: bool = False
+    ):
+        super().__init__(address, MockRequestHandler)
+        self.dataset = dataset
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.verbose = verbose
+        self._counts: Dict[str, int] = {}
+        self._bytes_sent = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def count(self, operation: str) -> None:
+        with self._lock:
+            self._counts[operation] = self._counts.get(operation, 0) + 1
+
+    def count_bytes(self, size: int) -> None:
+        with self._lock:
+            self._bytes_sent += size
+
+    def stats(self, reset: bool = False) -> Dict:
+        """
+        Request counters since the last reset.
+
+        Returns:
+            {"requests": total, "operations": {name: count}, "bytes_sent": n}
+        """
+        with self._lock:
+            stats = {
+                "requests": sum(self._counts.values()),
+                "operations": dict(self._counts),
+                "bytes_sent": self._bytes_sent
+            }
+            if reset:
+                self._counts = {}
+                self._bytes_sent = 0
+        return stats
+
+
+def start_mock_server(
+    dataset: Optional[MockDataset] = None,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    **options
+) -> MockGraphQLServer:
+    """
+    Serve the mock API from a background thread.
+
+    Args:
+        dataset: Data to serve (default: MockDataset())
+        host: Address to bind
+        port: Port to bind (0 picks a free port; see server.url)
+        **options: Latency and error settings passed to MockGraphQLServer
+
+    Returns:
+        The running server (call shutdown() to stop it)
+    """
+    server = MockGraphQLServer((host, port), dataset or MockDataset(), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_dataset_arguments(parser: argparse.ArgumentParser) -> None:
+    """Command line options shared with benchmark.py."""
+    parser.add_argument("--accounts", type=int, default=1, help="Accounts visible to the API key")
+    parser.add_argument("--meters", type=int, default=1, help="IMPORT meter points per account")
+    parser.add_argument("--events", type=int, default=120, help="Events per campaign")
+    parser.add_argument("--future-events", type=int, default=3, help="Events still to come per campaign")
+    parser.add_argument("--campaign", action="append", help="Campaign slug the accounts are enrolled in "
+                        f"(repeatable, default {FREE_ELECTRICITY_SLUG} and {POWER_UPS_UKPN_SLUG})")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="Random extra latency, up to this")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+
+
+def server_options(args: argparse.Namespace) -> Tuple[MockDataset, Dict]:
+    """Build the dataset and server options from add_dataset_arguments() options."""
+    dataset = MockDataset(
+        args.accounts, args.meters, args.events, args.future_events,
+        campaigns=tuple(args.campaign or (FREE_ELECTRICITY_SLUG, POWER_UPS_UKPN_SLUG))
+    )
+    options = {
+        "latency": args.latency,
+        "latency_jitter": args.latency_jitter,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+    }
+    return dataset, options
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Serve a mock Octopus Energy GraphQL API")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to bind")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to bind")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+
+    dataset, options = server_options(args)
+    server = start_mock_server(dataset, args.host, args.port, verbose=args.verbose, **options)
+    print(f"Mock GraphQL API on {server.url} ({len(dataset.accounts)} account(s), "
+          f"{args.events} event(s) per campaign)", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
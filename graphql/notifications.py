@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Change detection and push notifications for campaign events
+
+After each fetch the events of every campaign are compared by `code` with
+the previous run, producing `added`, `removed` and `changed` (start or end
+time moved) notifications. These are posted in batches to the webhooks in
+OCTOPUS_WEBHOOK_URLS from a small worker pool, with retries, and published
+to a ChangeBroadcaster that feed_server.py streams to Server-Sent Events
+clients.
+
+The previous run's events are kept in OCTOPUS_NOTIFY_STATE (default
+`~/.cache/octopus_powerups/notify_state.json`). The first run for a
+campaign only records a baseline, so existing events are not announced.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from cache_file import CACHE_DIR, LockedJSONFile
+from event_model import CampaignEvent
+from resilience import RETRYABLE_STATUS_CODES, RetryPolicy, parse_retry_after
+
+# Configuration
+DEFAULT_NOTIFY_STATE = os.getenv("OCTOPUS_NOTIFY_STATE", os.path.join(CACHE_DIR, "notify_state.json"))
+WEBHOOK_URLS = os.getenv("OCTOPUS_WEBHOOK_URLS", "")
+WEBHOOK_SECRET = os.getenv("OCTOPUS_WEBHOOK_SECRET")
+DEFAULT_WEBHOOK_BATCH_SIZE = int(os.getenv("OCTOPUS_WEBHOOK_BATCH_SIZE", "100"))
+DEFAULT_WEBHOOK_WORKERS = int(os.getenv("OCTOPUS_WEBHOOK_WORKERS", "4"))
+DEFAULT_WEBHOOK_TIMEOUT = float(os.getenv("OCTOPUS_WEBHOOK_TIMEOUT", "10"))
+# Changes kept in memory so reconnecting SSE clients can catch up via Last-Event-ID
+DEFAULT_BROADCAST_HISTORY = int(os.getenv("OCTOPUS_SSE_HISTORY", "1000"))
+
+
+def event_index(events: List[CampaignEvent]) -> Dict[str, Dict]:
+    """Index campaign events by code (events without a code are skipped)."""
+    return {
+        event.code: {"name": event.name, "start": event.start_iso, "end": event.end_iso}
+        for event in events
+        if event.code is not None
+    }
+
+
+def diff_events(campaign: str, old: Dict[str, Dict], new: Dict[str, Dict]) -> List[Dict]:
+    """
+    Compare two event indexes from event_index().
+
+    Returns:
+        List of changes, each with `type` (`added`, `removed` or `changed`),
+        `campaign`, `code`, `name`, `start` and `end`; `changed` entries also
+        carry the `previous` start and end
+    """
+    changes = []
+    for code, event in new.items():
+        before = old.get(code)
+        if before is None:
+            changes.append({"type": "added", "campaign": campaign, "code": code, **event})
+        elif (before["start"], before["end"]) != (event["start"], event["end"]):
+            changes.append({
+                "type": "changed",
+                "campaign": campaign,
+                "code": code,
+                **event,
+                "previous": {"start": before["start"], "end": before["end"]}
+            })
+    for code, event in old.items():
+        if code not in new:
+            changes.append({"type": "removed", "campaign": campaign, "code": code, **event})
+    return changes
+
+
+def detect_changes(events: Dict[str, List[CampaignEvent]], state_path: str = DEFAULT_NOTIFY_STATE) -> List[Dict]:
+    """
+    Diff this run's events against the previous run and remember this run.
+
+    Args:
+        events: Events per campaign slug, as returned by the run
+            functions in campaign_finder_graphql.py
+        state_path: File holding the previous run's events
+
+    Returns:
+        Changes from diff_events() for every campaign that has a baseline
+    """
+    state_file = LockedJSONFile(state_path)
+    changes = []
+    with state_file.locked():
+        state = state_file.read()
+        for campaign, campaign_events in events.items():
+            index = event_index(campaign_events)
+            if campaign in state:
+                changes.extend(diff_events(campaign, state[campaign], index))
+            state[campaign] = index
+        state_file.write(state)
+    return changes
+
+
+def sign_payload(body: bytes, secret: str) -> str:
+    """Value of the X-Octopus-Signature header for a webhook body."""
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class WebhookNotifier:
+    """
+    Posts change batches to webhooks from a worker pool.
+
+    Each webhook receives `{"sent_at": ..., "changes": [...]}` with at most
+    `batch_size` changes per request. Connection errors, timeouts and
+    429/5xx responses are retried with backoff; when a secret is set every
+    request carries an HMAC-SHA256 `X-Octopus-Signature` of its body.
+
+    Args:
+        urls: Webhook URLs
+        secret: Optional shared secret for signing requests
+        batch_size: Maximum changes per request
+        max_workers: Deliveries in flight at once
+        retry_policy: Backoff settings (default: RetryPolicy())
+        timeout: Per-request timeout in seconds
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        secret: Optional[str] = WEBHOOK_SECRET,
+        batch_size: int = DEFAULT_WEBHOOK_BATCH_SIZE,
+        max_workers: int = DEFAULT_WEBHOOK_WORKERS,
+        retry_policy: Optional[RetryPolicy] = None,
+        timeout: float = DEFAULT_WEBHOOK_TIMEOUT
+    ):
+        self.urls = urls
+        self.secret = secret
+        self.batch_size = max(batch_size, 1)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.pool = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="webhook")
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+
+    def notify(self, changes: List[Dict]) -> None:
+        """Queue delivery of `changes` to every webhook; returns immediately."""
+        for start in range(0, len(changes), self.batch_size):
+            batch = changes[start:start + self.batch_size]
+            body = json.dumps({"sent_at": datetime.now(timezone.utc).isoformat(), "changes": batch}).encode()
+            for url in self.urls:
+                future = self.pool.submit(self._deliver, url, body)
+                with self._lock:
+                    self._futures.append(future)
+
+    def _deliver(self, url: str, body: bytes) -> bool:
+        headers = {"X-Octopus-Signature": sign_payload(body, self.secret)} if self.secret else None
+        policy = self.retry_policy
+        deadline = time.monotonic() + policy.deadline
+        attempt = 0
+
+        while True:
+            attempt += 1
+            retry_after = None
+            try:
+                response = self.session.post(url, data=body, headers=headers, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = str(e)
+            else:
+                if response.status_code < 300:
+                    return True
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    print(f"WARNING: Webhook {url} rejected notification: HTTP {response.status_code}", file=sys.stderr)
+                    return False
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                error = f"HTTP {response.status_code}"
+
+            delay = policy.backoff(attempt, retry_after)
+            if attempt >= policy.max_attempts or time.monotonic() + delay >= deadline:
+                print(f"WARNING: Giving up on webhook {url} after {attempt} attempt(s): {error}", file=sys.stderr)
+                return False
+            time.sleep(delay)
+
+    def wait(self) -> Tuple[int, int]:
+        """
+        Wait for queued deliveries to finish.
+
+        Returns:
+            (delivered, failed) request counts
+        """
+        with self._lock:
+            futures, self._futures = self._futures, []
+        outcomes = [future.result() for future in futures]
+        return sum(outcomes), len(outcomes) - sum(outcomes)
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
+        self.session.close()
+
+
+class ChangeBroadcaster:
+    """
+    Fan-out of changes to any number of waiting readers (SSE connections).
+
+    Every published change gets an increasing id. Readers block in
+    `wait_for()` until there is something newer than the last id they saw;
+    the most recent `history` changes are kept so a client that reconnects
+    with Last-Event-ID misses nothing in between.
+
+    Args:
+        history: Number of recent changes kept for catching up
+    """
+
+    def __init__(self, history: int = DEFAULT_BROADCAST_HISTORY):
+        self._items: deque = deque(maxlen=history)
+        self._last_id = 0
+        self._condition = threading.Condition()
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    def publish(self, changes: List[Dict]) -> None:
+        """Append changes and wake every waiting reader."""
+        if not changes:
+            return
+        with self._condition:
+            for change in changes:
+                self._last_id += 1
+                self._items.append((self._last_id, change))
+            self._condition.notify_all()
+
+    def wait_for(self, after_id: int, timeout: float) -> List[Tuple[int, Dict]]:
+        """
+        Return (id, change) pairs newer than `after_id`, waiting up to
+        `timeout` seconds for one to arrive (empty list on timeout).
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._last_id > after_id, timeout)
+            return [(item_id, change) for item_id, change in self._items if item_id > after_id]
+
+
+def webhook_notifier_from_env() -> Optional[WebhookNotifier]:
+    """A WebhookNotifier for OCTOPUS_WEBHOOK_URLS, or None if none are configured."""
+    urls = [url.strip() for url in WEBHOOK_URLS.split(",") if url.strip()]
+    return WebhookNotifier(urls) if urls else None
+
+
+def notify_changes(
+    events: Dict[str, List[CampaignEvent]],
+    notifier: Optional[WebhookNotifier] = None,
+    broadcaster: Optional[ChangeBroadcaster] = None,
+    state_path: str = DEFAULT_NOTIFY_STATE
+) -> List[Dict]:
+    """
+    Detect changes in this run's events and push them out.
+
+    Args:
+        events: Events per campaign slug
+        notifier: Webhooks to post to (not waited for; call notifier.wait())
+        broadcaster: SSE broadcaster to publish to
+
+    Returns:
+        The detected changes
+    """
+    changes = detect_changes(events, state_path)
+    for change in changes:
+        print(f"Event {change['type']}: {change['campaign']} {change['code']} ({change['start']} - {change['end']})",
+              file=sys.stderr)
+    if changes and notifier:
+        notifier.notify(changes)
+    if broadcaster:
+        broadcaster.publish(changes)
+    return changes
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+Shared Octopus Energy GraphQL client
+
+Both finder scripts talk to the API through a single pooled
+requests.Session so that authentication, account discovery and event
+fetches reuse the same keep-alive connections instead of opening a new
+TCP+TLS connection for every call.
+
+How a response settles the circuit breaker, which failures are retried
+and how long to back off live in RetryState, settle_response() and
+graphql_data(), which the asyncio client (async_client.py) uses as well;
+the two clients differ only in their HTTP library and in how they wait.
+"""
+
+import os
+import sys
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+from urllib.parse import urlsplit
+
+from metrics import record_http, record_retry
+from resilience import (
+    RETRYABLE_STATUS_CODES,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    get_breaker,
+    is_retryable_graphql_errors,
+    parse_retry_after,
+)
+
+# Configuration
+GRAPHQL_URL = os.getenv("OCTOPUS_GRAPHQL_URL", "https://api.octopus.energy/v1/graphql/")
+REST_URL = os.getenv("OCTOPUS_REST_URL", "https://api.octopus.energy/v1")
+DEFAULT_POOL_SIZE = int(os.getenv("OCTOPUS_POOL_SIZE", "10"))
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("OCTOPUS_CONNECT_TIMEOUT", "5"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("OCTOPUS_READ_TIMEOUT", "30"))
+
+OBTAIN_TOKEN_MUTATION = """
+mutation ObtainKrakenToken($input: ObtainJSONWebTokenInput!) {
+    obtainKrakenToken(input: $input) {
+        token
+        refreshToken
+        refreshExpiresIn
+    }
+}
+"""
+
+VIEWER_ACCOUNTS_QUERY = """
+query ViewerQuery {
+  viewer {
+    accounts {
+      number
+    }
+  }
+}
+"""
+
+T = TypeVar("T")
+
+
+class GraphQLError(Exception):
+    """
+    Raised when the API answers with a GraphQL `errors` list.
+
+    `data` holds whatever partial `data` came back alongside the errors
+    (e.g. the aliases of a batched query that did succeed), or None.
+    """
+
+    def __init__(self, errors: List[Dict], data: Optional[Dict] = None):
+        self.errors = errors
+        self.data = data
+        super().__init__(f"GraphQL errors: {errors}")
+
+
+class RetryableError(Exception):
+    """
+    An attempt failed in a way that is worth retrying.
+
+    Args:
+        error: What to raise if the retries run out
+        retry_after: Seconds the server asked us to wait, if it said
+    """
+
+    def __init__(self, error: Exception, retry_after: Optional[float] = None):
+        self.error = error
+        self.retry_after = retry_after
+
+
+class RetryState:
+    """
+    Attempts, backoff and deadline of one call, shared by the sync and
+    asyncio clients so that both retry identically.
+
+    Args:
+        policy: Backoff and deadline settings
+        breaker: Circuit breaker of the host being called
+    """
+
+    def __init__(self, policy: RetryPolicy, breaker: CircuitBreaker):
+        self.policy = policy
+        self.breaker = breaker
+        self.deadline = time.monotonic() + policy.deadline
+        self.attempts = 0
+
+    def begin_attempt(self) -> float:
+        """
+        Start an attempt.
+
+        Returns:
+            Seconds left before the deadline, to cap the attempt's timeouts
+
+        Raises:
+            CircuitOpenError: if the host's circuit is open
+        """
+        self.attempts += 1
+        self.breaker.before_call()
+        return max(self.deadline - time.monotonic(), 0.1)
+
+    def retry_delay(self, retry: RetryableError) -> float:
+        """
+        Seconds to wait before retrying a failed attempt.
+
+        Raises:
+            The attempt's error, once the attempts or the deadline run out
+        """
+        delay = self.policy.backoff(self.attempts, retry.retry_after)
+        if self.attempts >= self.policy.max_attempts or time.monotonic() + delay >= self.deadline:
+            raise retry.error
+        record_retry()
+        return delay
+
+
+def settle_response(
+    breaker: CircuitBreaker,
+    status_code: int,
+    retry_after: Optional[str],
+    raise_for_status: Callable[[], None]
+) -> None:
+    """
+    Record an HTTP response with the circuit breaker.
+
+    Args:
+        breaker: Circuit breaker of the host that answered
+        status_code: Response status
+        retry_after: The response's Retry-After header, if any
+        raise_for_status: Raises the HTTP library's error for the response
+
+    Raises:
+        RetryableError: for 429 and retryable 5xx responses
+        The HTTP library's error: for other 4xx/5xx responses
+    """
+    if status_code in RETRYABLE_STATUS_CODES:
+        # 429 means the host is alive, so it doesn't count against the breaker
+        if status_code == 429:
+            breaker.abandon_call()
+        else:
+            breaker.record_failure()
+        try:
+            raise_for_status()
+        except Exception as e:
+            raise RetryableError(e, parse_retry_after(retry_after))
+    if status_code >= 400:
+        # The host answered, so a client error neither trips nor closes the circuit
+        breaker.abandon_call()
+        raise_for_status()
+    breaker.record_success()
+
+
+def graphql_data(response: Dict) -> Dict:
+    """
+    The `data` member of a decoded GraphQL response.
+
+    Raises:
+        GraphQLError: if the response has errors (wrapped in RetryableError
+            when they are worth retrying)
+    """
+    if "errors" not in response:
+        return response["data"]
+
+    error = GraphQLError(response["errors"], response.get("data"))
+    if is_retryable_graphql_errors(response["errors"]):
+        raise RetryableError(error)
+    raise error
+
+
+class GraphQLClient:
+    """
+    Pooled GraphQL client with keep-alive connections, retries and a
+    per-host circuit breaker.
+
+    Args:
+        url: GraphQL endpoint
+        pool_size: Maximum number of pooled connections per host
+        connect_timeout: Seconds to wait for a connection to be established
+        read_timeout: Seconds to wait for the server to send a response
+        retry_policy: Backoff and deadline settings (default: RetryPolicy())
+    """
+
+    def __init__(
+        self,
+        url: str = GRAPHQL_URL,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        retry_policy: Optional[RetryPolicy] = None
+    ):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = get_breaker(urlsplit(url).netloc)
+        self.retries = 0
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def execute(self, query: str, variables: Optional[Dict] = None, token: Optional[str] = None) -> Dict:
+        """
+        Send a GraphQL document and return its `data` member.
+
+        Connection errors, timeouts, 429/5xx responses and GraphQL throttling
+        errors are retried with backoff until the retry policy's attempts or
+        deadline run out; anything else fails immediately.
+
+        Args:
+            query: GraphQL query or mutation
+            variables: Optional query variables
+            token: Optional JWT sent in the Authorization header
+
+        Returns:
+            The `data` dictionary from the response
+
+        Raises:
+            requests.exceptions.HTTPError: on a non-2xx HTTP status
+            requests.exceptions.RequestException: on connection failures
+            GraphQLError: if the response contains GraphQL errors
+            CircuitOpenError: if the API host has been failing repeatedly
+        """
+        payload = {"query": query}
+        if variables is not None:
+            payload["variables"] = variables
+        headers = {"Authorization": token} if token else None
+
+        def attempt(timeout: Tuple[float, float]) -> Dict:
+            return graphql_data(self._send(self.breaker, "POST", self.url, timeout, json=payload, headers=headers).json())
+
+        return self._with_retries(self.breaker, attempt)
+
+    def get_json(self, url: str, params: Optional[Dict] = None, auth: Optional[Tuple[str, str]] = None) -> Dict:
+        """
+        GET a JSON document (e.g. from the REST API) with the same pooling,
+        retries and circuit breaker as execute().
+
+        Args:
+            url: Absolute URL
+            params: Optional query string parameters
+            auth: Optional (username, password) for HTTP basic auth
+
+        Returns:
+            The decoded JSON body
+        """
+        breaker = get_breaker(urlsplit(url).netloc)
+        return self._with_retries(
+            breaker, lambda timeout: self._send(breaker, "GET", url, timeout, params=params, auth=auth).json()
+        )
+
+    def _send(
+        self,
+        breaker: CircuitBreaker,
+        method: str,
+        url: str,
+        timeout: Tuple[float, float],
+        **kwargs
+    ) -> requests.Response:
+        """One HTTP attempt; raises RetryableError for failures worth retrying."""
+        try:
+            response = self.session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            record_http(None, 0, 0)
+            breaker.record_failure()
+            raise RetryableError(e)
+
+        record_http(response.status_code, len(response.request.body or b""), len(response.content))
+        settle_response(breaker, response.status_code, response.headers.get("Retry-After"), response.raise_for_status)
+        return response
+
+    def _with_retries(self, breaker: CircuitBreaker, attempt: Callable[[Tuple[float, float]], T]) -> T:
+        """Call attempt(timeout) until it returns, retrying RetryableError failures with backoff."""
+        state = RetryState(self.retry_policy, breaker)
+        while True:
+            remaining = state.begin_attempt()
+            timeout = (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+
+            try:
+                return attempt(timeout)
+            except RetryableError as e:
+                retry = e
+
+            delay = state.retry_delay(retry)
+            self.retries += 1
+            time.sleep(delay)
+
+    def connection_stats(self) -> Dict[str, int]:
+        """
+        Report how many requests were sent and how many of them reused
+        an already open connection.
+
+        Returns:
+            Dictionary with `requests`, `connections_opened` and
+            `connections_reused` counts
+        """
+        pools = self.adapter.poolmanager.pools
+        sent = 0
+        opened = 0
+        for key in pools.keys():
+            pool = pools[key]
+            sent += pool.num_requests
+            opened += pool.num_connections
+
+        return {
+            "requests": sent,
+            "connections_opened": opened,
+            "connections_reused": max(sent - opened, 0)
+        }
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    True if a failed call says the API is unavailable rather than that the
+    request was wrong: connection errors, timeouts, 429/5xx responses, an
+    open circuit and GraphQL throttling errors.
+
+    Callers may fall back to cached data for these; anything else (an
+    unknown supply point, a rejected token, a bad query) has to surface.
+    Errors of the asyncio client's httpx transport count the same way.
+    """
+    if isinstance(error, (CircuitOpenError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and error.response.status_code in RETRYABLE_STATUS_CODES
+    # Only loaded by async_client.py; don't import it just to check
+    httpx = sys.modules.get("httpx")
+    if httpx is not None:
+        if isinstance(error, httpx.TransportError):
+            return True
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in RETRYABLE_STATUS_CODES
+    if isinstance(error, GraphQLError):
+        return is_retryable_graphql_errors(error.errors)
+    return False
+
+
+_default_client: Optional[GraphQLClient] = None
+
+
+def get_client() -> GraphQLClient:
+    """Return the process-wide shared client, creating it on first use."""
+    global _default_client
+    if _default_client is None:
+        _default_client = GraphQLClient()
+    return _default_client
+
+
+def obtain_kraken_token(token_input: Dict, client: Optional[GraphQLClient] = None) -> Dict:
+    """
+    Run the ObtainKrakenToken mutation and return its full payload.
+
+    Args:
+        token_input: ObtainJSONWebTokenInput, e.g. {"APIKey": ...} or {"refreshToken": ...}
+        client: Optional client (defaults to the shared client)
+
+    Returns:
+        Dictionary with `token`, `refreshToken` and `refreshExpiresIn`
+    """
+    client = client or get_client()
+    data = client.execute(OBTAIN_TOKEN_MUTATION, {"input": token_input})
+    return data["obtainKrakenToken"]
+
+
+def get_token_with_api_key(api_key: str, client: Optional[GraphQLClient] = None) -> str:
+    """
+    Get JWT token using API key via ObtainKrakenToken mutation.
+
+    Args:
+        api_key: Your Octopus Energy API key
+        client: Optional client (defaults to the shared client)
+
+    Returns:
+        JWT token string
+    """
+    return obtain_kraken_token({"APIKey": api_key}, client)["token"]
+
+
+def get_token(email: str, password: str, client: Optional[GraphQLClient] = None) -> str:
+    """
+    Get JWT token using email/password via ObtainKrakenToken mutation.
+
+    Args:
+        email: Your Octopus Energy account email
+        password: Your Octopus Energy account password
+        client: Optional client (defaults to the shared client)
+
+    Returns:
+        JWT token string
+    """
+    return obtain_kraken_token({"email": email, "password": password}, client)["token"]
+
+
+def get_account_numbers(token: str, client: Optional[GraphQLClient] = None) -> List[str]:
+    """
+    List all account numbers visible to the authenticated user.
+
+    Args:
+        token: JWT authentication token
+        client: Optional client (defaults to the shared client)
+
+    Returns:
+        List of account number strings (e.g., A-12345678)
+    """
+    client = client or get_client()
+    return parse_account_numbers(client.execute(VIEWER_ACCOUNTS_QUERY, token=token))
+
+
+def parse_account_numbers(data: Dict) -> List[str]:
+    """
+    Extract the account numbers from a VIEWER_ACCOUNTS_QUERY result.
+
+    Args:
+        data: The `data` member of the response
+
+    Returns:
+        List of account number strings
+    """
+    accounts = data["viewer"]["accounts"]
+
+    if not accounts:
+        raise Exception("No accounts found for authenticated user")
+
+    return [account["number"] for account in accounts]
+
+
+def get_account_number(token: str, client: Optional[GraphQLClient] = None) -> str:
+    """
+    Get the first account number for the authenticated user.
+
+    Args:
+        token: JWT authentication token
+        client: Optional client (defaults to the shared client)
+
+    Returns:
+        Account number string
+    """
+    return get_account_numbers(token, client)[0]
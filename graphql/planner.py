@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+"""
+Load-shifting planner: when should each device run over the next 24 hours
+
+Combines the account's half-hourly unit rates with the upcoming Free
+Electricity Sessions and Power Ups (both treated as zero-cost slots) and
+picks, for each device, the cheapest slots in which it can run:
+
+- a contiguous device (car charger, immersion heater, dishwasher) gets the
+  cheapest run of consecutive half hours, found by sliding a window of the
+  run's length over the price array (prefix sums, one pass)
+- a device that can be split (home battery) gets the cheapest half hours,
+  wherever they are
+
+Each device may be limited to a `not_before` / `ready_by` local time.
+Devices are planned independently; there is no shared supply limit.
+NumPy is used for the window sums when it is installed.
+
+The tariff is read from the account's current agreement for the MPAN, or
+set with OCTOPUS_TARIFF_CODE. Unit rates are fetched once and cached
+(OCTOPUS_RATES_CACHE) until the cached rates no longer cover the planning
+horizon, which for day-ahead tariffs such as Agile happens once a day
+when tomorrow's prices are published.
+
+The schedule is written next to the feeds as schedule_graphql.json.
+
+Usage:
+
+    python planner.py --device car:7.4:4 --device battery:3:2:split
+    python planner.py --devices devices.json
+
+where devices.json is a list such as
+[{"name": "car", "power_kw": 7.4, "hours": 4, "ready_by": "07:00"}].
+"""
+
+import argparse
+import heapq
+import json
+import math
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+import fes_finder_graphql
+from account_cache import DEFAULT_TTL
+from cache_file import CACHE_DIR, LockedJSONFile, cache_key
+from campaigns import FREE_ELECTRICITY_SLUG, POWER_UPS_UKPN_SLUG, fetch_campaign_events_batch
+from event_model import CampaignEvent, parse_timestamp
+from feed_writer import FEED_DIR, report_changes, write_json_if_changed
+from metrics import run_instrumented, stage
+from octopus_client import REST_URL, GraphQLClient, get_client
+from token_store import get_cached_token
+from window_index import SLOT_SECONDS, WindowIndex
+
+try:
+    import numpy as np
+except ImportError:  # Optional: cheapest_run() falls back to prefix sums on lists
+    np = None
+
+# Configuration
+DEFAULT_RATES_CACHE = os.getenv("OCTOPUS_RATES_CACHE", os.path.join(CACHE_DIR, "rates.json"))
+RATES_REFRESH = int(os.getenv("OCTOPUS_RATES_REFRESH", str(30 * 60)))  # Min seconds between refetches
+TARIFF_CODE = os.getenv("OCTOPUS_TARIFF_CODE")
+PLANNER_TIMEZONE = ZoneInfo(os.getenv("OCTOPUS_PLANNER_TIMEZONE", "Europe/London"))
+DEFAULT_HORIZON_HOURS = 24
+
+# Rate as (valid from, valid to or None, pence per kWh inc. VAT)
+Rate = Tuple[int, Optional[int], float]
+
+
+class Device:
+    """
+    A load to schedule.
+
+    Args:
+        name: Label used in the schedule
+        power_kw: Average power draw while running
+        hours: Run time, rounded up to whole half hours
+        contiguous: Whether the run must be in one block
+        not_before: Earliest local start time ("HH:MM")
+        ready_by: Latest local finish time ("HH:MM")
+    """
+
+    def __init__(
+        self,
+        name: str,
+        power_kw: float,
+        hours: float,
+        contiguous: bool = True,
+        not_before: Optional[str] = None,
+        ready_by: Optional[str] = None
+    ):
+        self.name = name
+        self.power_kw = power_kw
+        self.slots = max(math.ceil(hours * 3600 / SLOT_SECONDS), 1)
+        self.contiguous = contiguous
+        self.not_before = not_before
+        self.ready_by = ready_by
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "Device":
+        """Parse `name:kW:hours`, optionally followed by `:split`."""
+        parts = spec.split(":")
+        if len(parts) not in (3, 4) or (len(parts) == 4 and parts[3] != "split"):
+            raise Exception(f"Invalid device '{spec}' (expected name:kW:hours[:split])")
+        return cls(parts[0], float(parts[1]), float(parts[2]), contiguous=len(parts) == 3)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Device":
+        return cls(
+            data["name"], float(data["power_kw"]), float(data["hours"]),
+            data.get("contiguous", True), data.get("not_before"), data.get("ready_by")
+        )
+
+
+def product_code(tariff_code: str) -> str:
+    """Product of a tariff code, e.g. E-1R-AGILE-24-10-01-C -> AGILE-24-10-01."""
+    parts = tariff_code.split("-")
+    if len(parts) < 4:
+        raise Exception(f"Unrecognised tariff code '{tariff_code}'")
+    return "-".join(parts[2:-1])
+
+
+def fetch_tariff_code(api_key: str, account_number: str, mpan: str, client: Optional[GraphQLClient] = None) -> str:
+    """
+    The tariff of the MPAN's current agreement, from the REST account endpoint.
+
+    Args:
+        api_key: Octopus Energy API key (REST basic auth)
+        account_number: Octopus account number
+        mpan: Import MPAN
+        client: Optional client (defaults to the shared client)
+
+    Returns:
+        Tariff code, e.g. E-1R-AGILE-24-10-01-C
+    """
+    client = client or get_client()
+    account = client.get_json(f"{REST_URL}/accounts/{account_number}/", auth=(api_key, ""))
+    now = time.time()
+    for prop in account.get("properties", []):
+        for meter_point in prop.get("electricity_meter_points", []):
+            if meter_point.get("mpan") != mpan:
+                continue
+            for agreement in meter_point.get("agreements", []):
+                valid_from = agreement.get("valid_from")
+                valid_to = agreement.get("valid_to")
+                if valid_from and parse_timestamp(valid_from)[0] > now:
+                    continue
+                if valid_to and parse_timestamp(valid_to)[0] <= now:
+                    continue
+                return agreement["tariff_code"]
+    raise Exception(f"No current tariff agreement found for MPAN {mpan}")
+
+
+def fetch_unit_rates(
+    tariff_code: str,
+    period_from: int,
+    period_to: int,
+    client: Optional[GraphQLClient] = None
+) -> List[Rate]:
+    """
+    Standard unit rates of a tariff overlapping [period_from, period_to).
+
+    Returns:
+        Rates sorted by valid-from time
+    """
+    client = client or get_client()
+    url = f"{REST_URL}/products/{product_code(tariff_code)}/electricity-tariffs/{tariff_code}/standard-unit-rates/"
+    params: Optional[Dict] = {
+        "period_from": datetime.fromtimestamp(period_from, timezone.utc).isoformat(),
+        "period_to": datetime.fromtimestamp(period_to, timezone.utc).isoformat(),
+        "page_size": 1500,
+    }
+    rates = []
+    while url:
+        data = client.get_json(url, params)
+        for row in data["results"]:
+            # Tariffs with both prices list direct debit and non-direct debit rates
+            if row.get("payment_method") not in (None, "DIRECT_DEBIT"):
+                continue
+            rates.append((
+                parse_timestamp(row["valid_from"])[0],
+                parse_timestamp(row["valid_to"])[0] if row.get("valid_to") else None,
+                float(row["value_inc_vat"])
+            ))
+        url, params = data.get("next"), None
+    return sorted(rates)
+
+
+class RateCache:
+    """
+    Tariff codes and unit rates cached on disk.
+
+    Args:
+        path: Location of the JSON cache file
+        tariff_ttl: Seconds before an MPAN's tariff is looked up again
+        refresh: Minimum seconds between unit rate fetches for a tariff
+    """
+
+    def __init__(self, path: str = DEFAULT_RATES_CACHE, tariff_ttl: int = DEFAULT_TTL, refresh: int = RATES_REFRESH):
+        self.file = LockedJSONFile(path)
+        self.tariff_ttl = tariff_ttl
+        self.refresh = refresh
+
+    def _update(self, section: str, key: str, entry: Dict) -> None:
+        with self.file.locked():
+            entries = self.file.read()
+            entries.setdefault(section, {})[key] = entry
+            self.file.write(entries)
+
+    def tariff_code(self, api_key: str, account_number: str, mpan: str, client: Optional[GraphQLClient] = None) -> str:
+        key = f"{cache_key(api_key)}:{mpan}"
+        with self.file.locked():
+            entry = self.file.read().get("tariffs", {}).get(key)
+        if entry and time.time() - entry["fetched_at"] < self.tariff_ttl:
+            return entry["tariff_code"]
+        tariff_code = fetch_tariff_code(api_key, account_number, mpan, client)
+        self._update("tariffs", key, {"fetched_at": time.time(), "tariff_code": tariff_code})
+        return tariff_code
+
+    def unit_rates(self, tariff_code: str, start: int, end: int, client: Optional[GraphQLClient] = None) -> List[Rate]:
+        """
+        Rates covering [start, end), fetched only when the cached ones don't
+        cover it and were not fetched within the refresh interval.
+        """
+        with self.file.locked():
+            entry = self.file.read().get("rates", {}).get(tariff_code)
+        if entry:
+            rates = [tuple(rate) for rate in entry["rates"]]
+            if covered_until(rates, start) >= end or time.time() - entry["fetched_at"] < self.refresh:
+                return rates
+
+        # Fetch from the start of today so an evening run also caches the morning's rates
+        rates = fetch_unit_rates(tariff_code, start - start % 86400, end + 86400, client)
+        self._update("rates", tariff_code, {"fetched_at": time.time(), "rates": rates})
+        return rates
+
+
+def covered_until(rates: Sequence[Rate], start: int) -> float:
+    """How far from `start` the rates cover without a gap (inf for an open-ended rate)."""
+    until: float = start
+    for valid_from, valid_to, _ in rates:
+        if valid_from > until:
+            break
+        if valid_to is None:
+            return math.inf
+        until = max(until, valid_to)
+    return until
+
+
+def slot_prices(
+    rates: Sequence[Rate],
+    free: WindowIndex,
+    start: int,
+    slots: int
+) -> List[float]:
+    """
+    Price per half hour from `start`: zero inside a free window, the unit
+    rate otherwise, or inf where no rate is known.
+    """
+    prices = []
+    i = 0
+    for n in range(slots):
+        slot = start + n * SLOT_SECONDS
+        window = free.current_window(slot)
+        if window and window[1] >= slot + SLOT_SECONDS:
+            prices.append(0.0)
+            continue
+        while i < len(rates) and rates[i][1] is not None and rates[i][1] <= slot:
+            i += 1
+        known = i < len(rates) and rates[i][0] <= slot
+        prices.append(rates[i][2] if known else math.inf)
+    return prices
+
+
+def cheapest_run(prices: Sequence[float], length: int, first: int, last: int) -> Optional[int]:
+    """
+    Start of the cheapest run of `length` consecutive slots starting in
+    [first, last], or None if every such run has an unknown price.
+    """
+    if last < first:
+        return None
+    if np is not None:
+        sums = np.convolve(np.asarray(prices, dtype=np.float64), np.ones(length), "valid")[first:last + 1]
+        best = int(np.argmin(sums))
+        return first + best if math.isfinite(sums[best]) else None
+
+    finite = [price if math.isfinite(price) else 1e12 for price in prices]
+    cumulative = [0.0]
+    cumulative.extend(accumulate(finite))
+    best_start = None
+    best_cost = math.inf
+    for s in range(first, last + 1):
+        cost = cumulative[s + length] - cumulative[s]
+        if cost < best_cost:
+            best_start, best_cost = s, cost
+    return best_start if best_cost < 1e12 else None
+
+
+def cheapest_slots(prices: Sequence[float], count: int, first: int, last: int) -> List[int]:
+    """The `count` cheapest slots in [first, last] (earliest first on ties), sorted."""
+    candidates = [(prices[n], n) for n in range(first, last + 1) if math.isfinite(prices[n])]
+    if len(candidates) < count:
+        return []
+    return sorted(n for _, n in heapq.nsmallest(count, candidates))
+
+
+def _local_time_after(ts: int, hhmm: str) -> int:
+    """The first time at or after `ts` whose local clock reads `hhmm`."""
+    hour, minute = (int(part) for part in hhmm.split(":"))
+    local = datetime.fromtimestamp(ts, PLANNER_TIMEZONE)
+    candidate = local.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate.timestamp() < ts:
+        candidate = (local + timedelta(days=1)).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return int(candidate.timestamp())
+
+
+def _runs(slots: List[int], start: int) -> List[Dict]:
+    """Group slot indexes into consecutive (start, end) runs."""
+    runs: List[List[int]] = []
+    for n in slots:
+        if runs and runs[-1][1] == n:
+            runs[-1][1] = n + 1
+        else:
+            runs.append([n, n + 1])
+    return [
+        {"start": _iso(start + a * SLOT_SECONDS), "end": _iso(start + b * SLOT_SECONDS)}
+        for a, b in runs
+    ]
+
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts, PLANNER_TIMEZONE).isoformat()
+
+
+def plan_device(device: Device, prices: Sequence[float], start: int) -> Dict:
+    """
+    Schedule one device over the price array.
+
+    Args:
+        device: Device to schedule
+        prices: Pence per kWh for each half hour from `start`
+        start: Epoch seconds of the first slot
+
+    Returns:
+        Schedule entry with `runs`, `cost_pence`, `free_slots` and the
+        device settings; `runs` is empty if the device cannot be fitted in
+    """
+    first = 0
+    last = len(prices) - 1
+    if device.ready_by:
+        deadline = _local_time_after(start, device.ready_by)
+        last = min(last, (deadline - start) // SLOT_SECONDS - 1)
+    if device.not_before:
+        earliest = _local_time_after(start, device.not_before)
+        if device.ready_by and earliest >= _local_time_after(start, device.ready_by):
+            earliest -= 86400
+        first = max(first, math.ceil((earliest - start) / SLOT_SECONDS))
+
+    if device.contiguous:
+        run_start = cheapest_run(prices, device.slots, first, last - device.slots + 1)
+        slots = list(range(run_start, run_start + device.slots)) if run_start is not None else []
+    else:
+        slots = cheapest_slots(prices, device.slots, first, last)
+
+    kwh_per_slot = device.power_kw * SLOT_SECONDS / 3600
+    cost = sum(prices[n] for n in slots) * kwh_per_slot
+    return {
+        "name": device.name,
+        "power_kw": device.power_kw,
+        "hours": device.slots * SLOT_SECONDS / 3600,
+        "contiguous": device.contiguous,
+        "runs": _runs(slots, start),
+        "cost_pence": round(cost, 2) if slots else None,
+        "free_slots": sum(1 for n in slots if prices[n] == 0),
+    }
+
+
+def build_schedule(
+    devices: List[Device],
+    rates: Sequence[Rate],
+    events: Sequence[CampaignEvent],
+    now: Optional[float] = None,
+    horizon_hours: int = DEFAULT_HORIZON_HOURS
+) -> Dict:
+    """
+    Plan every device over the next `horizon_hours`, starting at the next half hour.
+
+    Args:
+        devices: Devices to schedule
+        rates: Unit rates (see fetch_unit_rates())
+        events: Upcoming free sessions and Power Ups
+        now: Current time (default: time.time())
+        horizon_hours: Planning horizon
+
+    Returns:
+        Schedule document
+    """
+    now = int(now if now is not None else time.time())
+    start = now + (-now) % SLOT_SECONDS
+    slots = horizon_hours * 3600 // SLOT_SECONDS
+    free = WindowIndex.from_events(events)
+    prices = slot_prices(rates, free, start, slots)
+
+    # Day-ahead prices may not reach the end of the horizon yet
+    known = len(prices)
+    while known and not math.isfinite(prices[known - 1]):
+        known -= 1
+    prices = prices[:known]
+
+    return {
+        "horizon": {"start": _iso(start), "end": _iso(start + known * SLOT_SECONDS)},
+        "free_windows": [
+            {"start": _iso(a), "end": _iso(b)} for a, b in free.windows_between(start, start + known * SLOT_SECONDS)
+        ],
+        "devices": [plan_device(device, prices, start) for device in devices],
+    }
+
+
+def write_schedule(schedule: Dict, filename: str = "schedule_graphql.json", output_dir: Optional[str] = None) -> str:
+    """Write the schedule next to the feeds (OCTOPUS_FEED_DIR, the repository root by default)."""
+    if output_dir is None:
+        output_dir = FEED_DIR
+    output_file = os.path.join(output_dir, filename)
+    write_json_if_changed(output_file, schedule)
+    return output_file
+
+
+def load_devices(args: argparse.Namespace) -> List[Device]:
+    devices = [Device.from_spec(spec) for spec in args.device or []]
+    if args.devices:
+        with open(args.devices) as f:
+            devices.extend(Device.from_dict(entry) for entry in json.load(f))
+    return devices
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Plan device run times around free sessions and unit rates")
+    parser.add_argument("--device", action="append", help="Device as name:kW:hours[:split] (repeatable)")
+    parser.add_argument("--devices", help="JSON file with a list of devices")
+    parser.add_argument("--horizon", type=int, default=DEFAULT_HORIZON_HOURS, help="Hours to plan ahead")
+    parser.add_argument("--output", default="schedule_graphql.json", help="Schedule file name")
+    parser.add_argument("--profile", action="store_true", help="Print a cProfile and tracemalloc summary to stderr")
+    args = parser.parse_args()
+
+    api_key = os.getenv("OCTOPUS_API_KEY")
+    if not api_key:
+        print("ERROR: OCTOPUS_API_KEY environment variable not set", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        devices = load_devices(args)
+        if not devices:
+            print("ERROR: No devices given (use --device or --devices)", file=sys.stderr)
+            sys.exit(1)
+
+        with stage("auth"):
+            token = get_cached_token(api_key)
+        account_number, mpan = fes_finder_graphql.discover_account_and_mpan(
+            api_key, token, os.getenv("OCTOPUS_ACCOUNT_NUMBER"), os.getenv("OCTOPUS_MPAN")
+        )
+
+        now = int(time.time())
+        with stage("event_fetch"):
+            batch, batch_errors = fetch_campaign_events_batch(
+                token, account_number, [(FREE_ELECTRICITY_SLUG, mpan), (POWER_UPS_UKPN_SLUG, mpan)]
+            )
+            events = [event for slug_events in batch.values() for event in slug_events if event.end > now]
+            for (slug, _), e in batch_errors.items():
+                # Planning without one campaign's free slots only costs money, so carry on
+                print(f"WARNING: Could not fetch {slug} events: {e}", file=sys.stderr)
+
+            cache = RateCache()
+            tariff_code = TARIFF_CODE or cache.tariff_code(api_key, account_number, mpan)
+            rates = cache.unit_rates(tariff_code, now, now + args.horizon * 3600)
+
+        schedule = build_schedule(devices, rates, events, now, args.horizon)
+        schedule["tariff_code"] = tariff_code
+
+        with stage("output_write"):
+            output_file = write_schedule(schedule, args.output)
+        for device in schedule["devices"]:
+            runs = ", ".join(f"{run['start'][11:16]}-{run['end'][11:16]}" for run in device["runs"]) or "no slot fits"
+            cost = f"{device['cost_pence']:.1f}p" if device["cost_pence"] is not None else "-"
+            print(f"{device['name']}: {runs} ({cost}, {device['free_slots']} free half hour(s))")
+        print(f"Schedule written to {output_file}", file=sys.stderr)
+        report_changes()
+
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_instrumented(main)
@@ -6,214 +6,119 @@ Fetches UKPN Power Up events for your account
 
 import os
 import sys
-import json
-import requests
-from datetime import datetime, timezone
-from typing import Dict, List
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from account_cache import (
+    all_mpans,
+    fetch_account_topology,
+    get_account_cache,
+    import_mpans,
+    is_unknown_supply_point_error,
+)
+from campaigns import DEFAULT_PAGE_SIZE, POWER_UP_SLUG, iter_campaign_events
+from event_model import CampaignEvent, not_ended
+from feed_variants import write_feed_variants
+from feed_writer import FEED_DIR, report_changes, write_json_if_changed
+from metrics import run_instrumented, stage
+from octopus_client import (
+    GraphQLClient,
+    GraphQLError,
+    get_client,
+    get_account_number,
+    is_transient_error,
+    get_token_with_api_key,
+)
+from response_cache import StaleWhileRevalidateClient, write_feed_metadata
+from token_store import get_cached_token
 
 # Configuration
-GRAPHQL_URL = "https://api.octopus.energy/v1/graphql/"
-CAMPAIGN_SLUG = "power_ups_ukpn"
+CAMPAIGN_SLUG = POWER_UP_SLUG  # OCTOPUS_POWER_UP_SLUG, see campaigns.py
 
 
-def get_token_with_api_key(api_key: str) -> str:
-    """
-    Get JWT token using API key via ObtainKrakenToken mutation.
-    
-    Args:
-        api_key: Your Octopus Energy API key
-    
-    Returns:
-        JWT token string
+def get_mpan(token: str, account_number: str, client: Optional[GraphQLClient] = None) -> str:
     """
-    mutation = """
-    mutation ObtainKrakenToken($input: ObtainJSONWebTokenInput!) {
-        obtainKrakenToken(input: $input) {
-            token
-            refreshToken
-            refreshExpiresIn
-        }
-    }
-    """
-    
-    variables = {
-        "input": {
-            "APIKey": api_key
-        }
-    }
-    
-    response = requests.post(
-        GRAPHQL_URL,
-        json={"query": mutation, "variables": variables}
-    )
-    response.raise_for_status()
-    data = response.json()
+    Get the first IMPORT electricity meter point (MPAN) for the account.
     
-    if "errors" in data:
-        raise Exception(f"GraphQL errors: {data['errors']}")
-    
-    return data["data"]["obtainKrakenToken"]["token"]
-
-
-def get_account_number(token: str) -> str:
-    """
-    Get the account number for the authenticated user.
+    The finder itself reads this from the account cache; this fetches the
+    account topology directly.
     
     Args:
         token: JWT token
+        account_number: Account number
+        client: Optional client (defaults to the shared client)
     
     Returns:
-        Account number string
-    """
-    query = """
-    {
-        viewer {
-            accounts {
-                number
-            }
-        }
-    }
+        MPAN string
     """
+    accounts = fetch_account_topology(token, client)
     
-    response = requests.post(
-        GRAPHQL_URL,
-        json={"query": query},
-        headers={"Authorization": token}
-    )
-    response.raise_for_status()
-    data = response.json()
-    
-    if "errors" in data:
-        raise Exception(f"GraphQL errors: {data['errors']}")
-    
-    accounts = data["data"]["viewer"]["accounts"]
-    if not accounts:
-        raise Exception("No accounts found")
-    
-    return accounts[0]["number"]
+    # Prefer an IMPORT meter (not EXPORT for solar panels), otherwise take the first MPAN
+    mpans = import_mpans(accounts, account_number, require_agreement=False) or all_mpans(accounts, account_number)
+    if not mpans:
+        raise Exception("No electricity meter points found")
+    return mpans[0]
 
 
-def get_mpan(token: str, account_number: str) -> str:
+def get_power_up_events(
+    token: str,
+    account_number: str,
+    mpan: str,
+    client: Optional[GraphQLClient] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    ends_after: Optional[datetime] = None
+) -> List[CampaignEvent]:
     """
-    Get the first IMPORT electricity meter point (MPAN) for the account.
+    Get Power Up events for the account, following pagination cursors.
     
     Args:
         token: JWT token
         account_number: Account number
+        mpan: Meter point administration number
+        client: Optional client (defaults to the shared client)
+        page_size: Events requested per page
+        ends_after: Skip events that end at or before this time
     
     Returns:
-        MPAN string
-    """
-    query = """
-    query GetAccount($accountNumber: String!) {
-        account(accountNumber: $accountNumber) {
-            properties {
-                electricityMeterPoints {
-                    mpan
-                    meters {
-                        meterType
-                    }
-                }
-            }
-        }
-    }
+        List of Power Up events
     """
-    
-    variables = {"accountNumber": account_number}
-    
-    response = requests.post(
-        GRAPHQL_URL,
-        json={"query": query, "variables": variables},
-        headers={"Authorization": token}
-    )
-    response.raise_for_status()
-    data = response.json()
-    
-    if "errors" in data:
-        raise Exception(f"GraphQL errors: {data['errors']}")
-    
-    properties = data["data"]["account"]["properties"]
-    if not properties:
-        raise Exception("No properties found")
-    
-    # Find first IMPORT meter
-    for prop in properties:
-        for meter_point in prop["electricityMeterPoints"]:
-            # Check if it's an IMPORT meter (not EXPORT for solar panels)
-            for meter in meter_point["meters"]:
-                if meter["meterType"] == "ELECTRICITY_IMPORT":
-                    return meter_point["mpan"]
-    
-    # If no IMPORT meter found, just return the first MPAN
-    if properties[0]["electricityMeterPoints"]:
-        return properties[0]["electricityMeterPoints"][0]["mpan"]
-    
-    raise Exception("No electricity meter points found")
+    return list(iter_campaign_events(
+        token,
+        account_number,
+        mpan,
+        CAMPAIGN_SLUG,
+        page_size=page_size,
+        ends_after=ends_after,
+        client=client
+    ))
 
 
-def get_power_up_events(token: str, account_number: str, mpan: str) -> List[Dict]:
+def discover_account_and_mpan(api_key: str, token: str, refresh: bool = False) -> Tuple[str, str]:
     """
-    Get Power Up events for the account.
+    Get the account number and first IMPORT MPAN from the cached account topology.
     
     Args:
+        api_key: API key (used as the cache key)
         token: JWT token
-        account_number: Account number
-        mpan: Meter point administration number
+        refresh: Ignore the cached topology and rediscover it
     
     Returns:
-        List of Power Up events
-    """
-    query = """
-    query GetPowerUpEvents($accountNumber: String!, $mpan: String!, $campaignSlug: String!) {
-        customerFlexibilityCampaignEvents(
-            accountNumber: $accountNumber,
-            supplyPointIdentifier: $mpan,
-            campaignSlug: $campaignSlug,
-            first: 50
-        ) {
-            edges {
-                node {
-                    code
-                    startAt
-                    endAt
-                }
-            }
-        }
-    }
+        (account_number, mpan) tuple
     """
+    with stage("account_discovery"):
+        accounts = get_account_cache().get_accounts(api_key, token, refresh=refresh)
+        account_number = accounts[0]["number"]
     
-    variables = {
-        "accountNumber": account_number,
-        "mpan": mpan,
-        "campaignSlug": CAMPAIGN_SLUG
-    }
+    # Prefer an IMPORT meter, otherwise fall back to the first MPAN
+    with stage("mpan_discovery"):
+        mpans = import_mpans(accounts, account_number, require_agreement=False) or all_mpans(accounts, account_number)
+        if not mpans:
+            raise Exception("No electricity meter points found")
     
-    response = requests.post(
-        GRAPHQL_URL,
-        json={"query": query, "variables": variables},
-        headers={"Authorization": token}
-    )
-    response.raise_for_status()
-    data = response.json()
-    
-    if "errors" in data:
-        raise Exception(f"GraphQL errors: {data['errors']}")
-    
-    events = []
-    edges = data["data"]["customerFlexibilityCampaignEvents"]["edges"]
-    
-    for edge in edges:
-        node = edge["node"]
-        events.append({
-            "code": node["code"],
-            "start": node["startAt"],
-            "end": node["endAt"]
-        })
-    
-    return events
+    return account_number, mpans[0]
 
 
-def filter_future_events(events: List[Dict]) -> List[Dict]:
+def filter_future_events(events: List[CampaignEvent]) -> List[CampaignEvent]:
     """
     Filter events to only include those that haven't ended yet.
     
@@ -223,18 +128,10 @@ def filter_future_events(events: List[Dict]) -> List[Dict]:
     Returns:
         List of future events
     """
-    now = datetime.now(timezone.utc)
-    future_events = []
-    
-    for event in events:
-        end_time = datetime.fromisoformat(event["end"].replace("Z", "+00:00"))
-        if end_time > now:
-            future_events.append(event)
-    
-    return future_events
+    return not_ended(events)
 
 
-def format_output(events: List[Dict]) -> List[Dict]:
+def format_output(events: List[CampaignEvent]) -> List[Dict]:
     """
     Format events to match the Google Apps Script output format.
     
@@ -250,13 +147,39 @@ def format_output(events: List[Dict]) -> List[Dict]:
     formatted = []
     for event in events:
         formatted.append({
-            "start": event["start"],
-            "end": event["end"]
+            "start": event.start_iso,
+            "end": event.end_iso
         })
     
     return formatted
 
 
+def write_events_to_file(
+    future_events: List[CampaignEvent],
+    filename: str = "powerup_graphql.json",
+    output_dir: Optional[str] = None
+) -> str:
+    """
+    Write future events to a JSON file at the repository root.
+    
+    Args:
+        future_events: Events that haven't ended yet
+        filename: Output filename (default: powerup_graphql.json)
+        output_dir: Directory to write to (default: OCTOPUS_FEED_DIR, the repository root)
+    
+    Returns:
+        Path of the written file
+    """
+    output = format_output(future_events)
+    
+    if output_dir is None:
+        output_dir = FEED_DIR
+    output_file = os.path.join(output_dir, filename)
+    write_json_if_changed(output_file, output)
+    
+    return output_file
+
+
 def main():
     """Main function"""
     try:
@@ -271,44 +194,70 @@ def main():
         
         # Authenticate
         print("Authenticating with API key...")
-        token = get_token_with_api_key(api_key)
-        print("✓ Authenticated")
+        try:
+            with stage("auth"):
+                token = get_cached_token(api_key)
+            print("✓ Authenticated")
+        except Exception as e:
+            # Carry on through outages so that cached responses can still be served
+            if not is_transient_error(e):
+                raise
+            print(f"⚠️ Authentication failed, falling back to cached data: {e}")
+            token = None
+        swr_client = StaleWhileRevalidateClient(get_client())
         
         # Get account details
         print("Getting account details...")
-        account_number = get_account_number(token)
+        account_number, mpan = discover_account_and_mpan(api_key, token)
         print(f"✓ Account: {account_number}")
-        
-        mpan = get_mpan(token, account_number)
         print(f"✓ MPAN: {mpan}")
         
         # Get Power Up events
         print(f"Fetching Power Up events for campaign '{CAMPAIGN_SLUG}'...")
-        events = get_power_up_events(token, account_number, mpan)
+        try:
+            with stage("event_fetch"):
+                events = get_power_up_events(token, account_number, mpan, swr_client)
+        except GraphQLError as e:
+            if not is_unknown_supply_point_error(e):
+                raise
+            # Cached account details are out of date - rediscover once
+            print("Supply point rejected, refreshing account details...")
+            account_number, mpan = discover_account_and_mpan(api_key, token, refresh=True)
+            print(f"✓ MPAN: {mpan}")
+            with stage("event_fetch"):
+                events = get_power_up_events(token, account_number, mpan, swr_client)
         print(f"✓ Found {len(events)} total events")
         
         # Filter to future events only
         future_events = filter_future_events(events)
         print(f"✓ Found {len(future_events)} future events")
         
-        # Format output
-        output = format_output(future_events)
-        
         # Write to JSON file at repository root
-        output_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), "powerup_graphql.json")
-        with open(output_file, "w") as f:
-            json.dump(output, f, indent=2)
+        with stage("output_write"):
+            output_file = write_events_to_file(future_events)
+            write_feed_variants(output_file)
+            write_feed_metadata(output_file, swr_client)
+        report_changes()
+        swr_client.wait()
         
         print(f"✓ Wrote output to {output_file}")
+        if swr_client.stale:
+            print("⚠️ API unavailable - output was built from cached data")
         print()
         
         if future_events:
             print(f"Next Power Up event:")
-            print(f"  Start: {future_events[0]['start']}")
-            print(f"  End:   {future_events[0]['end']}")
+            print(f"  Start: {future_events[0].start_iso}")
+            print(f"  End:   {future_events[0].end_iso}")
         else:
             print("No upcoming Power Up events")
         
+        stats = get_client().connection_stats()
+        print(
+            f"✓ HTTP: {stats['requests']} request(s), {stats['connections_opened']} connection(s) opened, "
+            f"{stats['connections_reused']} reused"
+        )
+        
         print()
         print("✅ Done!")
         
@@ -318,4 +267,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    run_instrumented(main)
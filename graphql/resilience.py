@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Retry and circuit breaker primitives for the GraphQL client
+
+Transient failures (connection resets, timeouts, 429 and 5xx responses,
+and GraphQL throttling errors) are retried with exponential backoff and
+full jitter, honouring `Retry-After`, within a total deadline budget. A
+per-host circuit breaker stops hammering an API that keeps failing, so
+batch workers fail fast instead of all queueing behind a dead host.
+"""
+
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+
+# Configuration
+DEFAULT_MAX_ATTEMPTS = int(os.getenv("OCTOPUS_MAX_ATTEMPTS", "4"))
+DEFAULT_BASE_DELAY = float(os.getenv("OCTOPUS_RETRY_BASE_DELAY", "0.5"))
+DEFAULT_MAX_DELAY = float(os.getenv("OCTOPUS_RETRY_MAX_DELAY", "30"))
+DEFAULT_DEADLINE = float(os.getenv("OCTOPUS_REQUEST_DEADLINE", "60"))
+DEFAULT_BREAKER_THRESHOLD = int(os.getenv("OCTOPUS_BREAKER_THRESHOLD", "5"))
+DEFAULT_BREAKER_RESET = float(os.getenv("OCTOPUS_BREAKER_RESET", "30"))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Substrings identifying GraphQL errors that are worth retrying (throttling)
+RETRYABLE_GRAPHQL_MARKERS = ("too many requests", "rate limit", "throttl", "try again")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while a host's circuit is open."""
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter and a total deadline.
+
+    Args:
+        max_attempts: Maximum number of attempts per call (including the first)
+        base_delay: Delay in seconds before the first retry
+        max_delay: Upper bound for any single delay
+        deadline: Total seconds a call may spend including retries
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        deadline: float = DEFAULT_DEADLINE
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Seconds to wait before retry number `attempt` (1-based).
+
+        A server-supplied Retry-After takes precedence over the computed delay.
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header given as seconds or an HTTP date.
+
+    Returns:
+        Seconds to wait, or None if absent or unparseable
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable_graphql_errors(errors: List[Dict]) -> bool:
+    """True if every GraphQL error is a throttling error that may succeed on retry."""
+    if not errors:
+        return False
+    for error in errors:
+        text = str(error.get("message", "")).lower()
+        code = str((error.get("extensions") or {}).get("errorCode", "")).lower()
+        if not any(marker in text or marker in code for marker in RETRYABLE_GRAPHQL_MARKERS):
+            return False
+    return True
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls fail immediately. After `reset_timeout` seconds one trial call is
+    let through (half-open); its outcome closes or re-opens the circuit.
+
+    Args:
+        failure_threshold: Consecutive failures before opening
+        reset_timeout: Seconds to stay open before a trial call
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = DEFAULT_BREAKER_THRESHOLD,
+        reset_timeout: float = DEFAULT_BREAKER_RESET
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """`closed`, `open` or `half-open`."""
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError if a call may not be made right now."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            raise CircuitOpenError(f"Circuit open after {self.failures} failures; retry in {max(remaining, 0):.0f}s")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def abandon_call(self) -> None:
+        """
+        Release a call that says nothing about the host's health (cancelled,
+        throttled, or rejected with a client error), so a half-open circuit
+        lets the next trial call through.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """Return the process-wide circuit breaker for a host."""
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+        return _breakers[host]
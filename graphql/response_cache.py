@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Stale-while-revalidate cache for campaign event responses
+
+The last good response for every query + variables combination is kept
+on disk with the time it was fetched. Depending on its age a cached
+response is served directly (fresh), served while a background thread
+revalidates it (stale-while-revalidate), or replaced by a synchronous
+fetch. If that fetch fails - or no token could be obtained because the
+API is down - the cached response is served instead and the run is
+flagged as stale, so the feeds keep their last known contents.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from cache_file import CACHE_DIR
+from feed_writer import write_json_if_changed
+from octopus_client import is_transient_error
+
+# Configuration
+DEFAULT_RESPONSE_CACHE_DIR = os.getenv("OCTOPUS_RESPONSE_CACHE_DIR", os.path.join(CACHE_DIR, "responses"))
+# Serve cached responses younger than this without contacting the API
+DEFAULT_FRESH_FOR = float(os.getenv("OCTOPUS_RESPONSE_FRESH_FOR", "0"))
+# Beyond the fresh window, serve cached responses for this long while revalidating in the background
+DEFAULT_REVALIDATE_WINDOW = float(os.getenv("OCTOPUS_RESPONSE_REVALIDATE_WINDOW", "0"))
+# Never fall back to responses older than this
+DEFAULT_MAX_STALE = float(os.getenv("OCTOPUS_RESPONSE_MAX_STALE", str(7 * 24 * 60 * 60)))
+
+
+def request_key(query: str, variables: Optional[Dict]) -> str:
+    """Cache key for a GraphQL document and its variables."""
+    canonical = json.dumps({"query": " ".join(query.split()), "variables": variables or {}}, sort_keys=True)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    One JSON file per cached response.
+
+    Args:
+        directory: Where cached responses are stored
+    """
+
+    def __init__(self, directory: str = DEFAULT_RESPONSE_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return {"stored_at": epoch, "data": ...} or None."""
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, key: str, data: Dict) -> None:
+        """Atomically store a response."""
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"stored_at": time.time(), "data": data}, f)
+        os.replace(tmp_path, path)
+
+    def delete(self, key: str) -> None:
+        """Drop a cached response."""
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class StaleWhileRevalidateClient:
+    """
+    Wraps a GraphQLClient (or anything with the same `execute`) with a
+    response cache. Pass it as the `client` of the campaign event functions.
+
+    Cached responses stand in only for transient failures (see
+    octopus_client.is_transient_error()); other errors, such as an unknown
+    supply point or a rejected token, are raised as usual. A fatal error
+    from a background revalidation drops the cached response and is raised
+    by the next execute() or by wait().
+
+    Args:
+        client: The client that talks to the API
+        cache: Response cache (default: ResponseCache())
+        fresh_for: Seconds a cached response is served without revalidation
+        revalidate_window: Seconds after that during which the cached response
+            is served while being revalidated in the background
+        max_stale: Oldest cached response that may be served on failure
+    """
+
+    def __init__(
+        self,
+        client,
+        cache: Optional[ResponseCache] = None,
+        fresh_for: float = DEFAULT_FRESH_FOR,
+        revalidate_window: float = DEFAULT_REVALIDATE_WINDOW,
+        max_stale: float = DEFAULT_MAX_STALE
+    ):
+        self.client = client
+        self.cache = cache or ResponseCache()
+        self.fresh_for = fresh_for
+        self.revalidate_window = revalidate_window
+        self.max_stale = max_stale
+        self.stale = False
+        self.last_error: Optional[str] = None
+        self.oldest_served: Optional[float] = None
+        self._pending: Dict[str, threading.Thread] = {}
+        self._fatal: Optional[Exception] = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _served(self, entry: Dict, stale: bool = False) -> Dict:
+        with self._lock:
+            if self.oldest_served is None or entry["stored_at"] < self.oldest_served:
+                self.oldest_served = entry["stored_at"]
+            self.stale = self.stale or stale
+        return entry["data"]
+
+    def _revalidate(self, key: str, query: str, variables: Optional[Dict], token: Optional[str]) -> None:
+        try:
+            self.cache.put(key, self.client.execute(query, variables, token=token))
+        except Exception as e:
+            if is_transient_error(e):
+                print(f"Background revalidation failed: {e}", file=sys.stderr)
+            else:
+                # The cached response is no longer trustworthy; don't serve it again
+                self.cache.delete(key)
+                with self._lock:
+                    self._fatal = self._fatal or e
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def execute(self, query: str, variables: Optional[Dict] = None, token: Optional[str] = None) -> Dict:
+        """Same contract as GraphQLClient.execute(), served through the cache."""
+        self._raise_fatal()
+        key = request_key(query, variables)
+        entry = self.cache.get(key)
+        age = time.time() - entry["stored_at"] if entry else None
+
+        if entry and age < self.fresh_for:
+            return self._served(entry)
+
+        if entry and token and age < self.fresh_for + self.revalidate_window:
+            with self._lock:
+                if key not in self._pending:
+                    thread = threading.Thread(
+                        target=self._revalidate, args=(key, query, variables, token), daemon=True
+                    )
+                    self._pending[key] = thread
+                    thread.start()
+            return self._served(entry)
+
+        try:
+            if not token:
+                raise Exception("No API token available")
+            data = self.client.execute(query, variables, token=token)
+        except Exception as e:
+            # Callers only go without a token when authentication failed transiently
+            if entry and age < self.max_stale and (not token or is_transient_error(e)):
+                print(f"API request failed, serving cached response from {age:.0f}s ago: {e}", file=sys.stderr)
+                self.last_error = str(e)
+                return self._served(entry, stale=True)
+            raise
+
+        self.cache.put(key, data)
+        return data
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Wait for background revalidations to finish (e.g. before exiting)."""
+        with self._lock:
+            threads = list(self._pending.values())
+        for thread in threads:
+            thread.join(timeout)
+        self._raise_fatal()
+
+    def _raise_fatal(self) -> None:
+        with self._lock:
+            error, self._fatal = self._fatal, None
+        if error is not None:
+            raise error
+
+
+def metadata_path(output_path: str) -> str:
+    """Sidecar metadata path for a feed, e.g. powerup_graphql.meta.json."""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.meta{ext}"
+
+
+def write_feed_metadata(output_path: str, client: StaleWhileRevalidateClient) -> None:
+    """
+    Write the sidecar metadata file for a feed.
+
+    While data is fresh the file only says `{"stale": false}`, so it does not
+    change from run to run; when cached data had to be served it records
+    when that data was last fetched successfully and why the fetch failed.
+
+    Args:
+        output_path: Path of the feed that was just written
+        client: The client used to fetch the feed's data
+    """
+    metadata: Dict = {"stale": client.stale}
+    if client.stale:
+        metadata["last_success"] = datetime.fromtimestamp(client.oldest_served, timezone.utc).isoformat()
+        metadata["error"] = client.last_error
+
+    write_json_if_changed(metadata_path(output_path), metadata)
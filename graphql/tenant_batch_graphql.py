@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Multi-tenant batch runner for the Octopus Energy GraphQL finders
+Runs the Free Electricity Session and Power Up finders for every tenant in
+a manifest with bounded global concurrency, writing each tenant's feeds to
+its own directory
+
+Manifest format (JSON):
+
+    [
+      {"name": "house-1", "api_key": "sk_live_..."},
+      {"name": "house-2", "api_key_env": "HOUSE2_API_KEY",
+       "account_number": "A-12345678", "mpan": "1234567890123"}
+    ]
+
+Usage:
+
+    python tenant_batch_graphql.py tenants.json --output-dir feeds --workers 16
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from account_cache import all_mpans, get_account_cache, import_mpans
+from campaigns import FREE_ELECTRICITY_SLUG, fetch_campaign_events_batch
+from fes_finder_graphql import write_sessions_to_file
+from history_store import HistoryStore, history_rows
+from octopus_client import GraphQLClient
+from power_up_finder_graphql import CAMPAIGN_SLUG as POWER_UP_SLUG, filter_future_events, write_events_to_file
+from token_store import get_cached_token
+
+DEFAULT_WORKERS = int(os.getenv("OCTOPUS_MAX_WORKERS", "8"))
+
+
+def load_manifest(path: str) -> List[Dict]:
+    """
+    Load and validate a tenant manifest.
+
+    Args:
+        path: Path to the JSON manifest
+
+    Returns:
+        List of tenants, each with `name` and `api_key` plus optional
+        `account_number` and `mpan` overrides
+    """
+    with open(path) as f:
+        entries = json.load(f)
+
+    tenants = []
+    used_names = set()
+    for i, entry in enumerate(entries, 1):
+        api_key = entry.get("api_key") or os.getenv(entry.get("api_key_env", ""), "")
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", str(entry.get("name") or f"tenant-{i}"))
+        if name in used_names:
+            raise Exception(f"Duplicate tenant name in manifest: {name}")
+        used_names.add(name)
+        tenants.append({
+            "name": name,
+            "api_key": api_key,
+            "account_number": entry.get("account_number"),
+            "mpan": entry.get("mpan")
+        })
+    return tenants
+
+
+def resolve_meter_point(
+    api_key: str,
+    token: str,
+    account_number: Optional[str],
+    mpan: Optional[str],
+    client: GraphQLClient
+) -> Tuple[str, str]:
+    """Fill in whichever of account number and MPAN was not overridden."""
+    if account_number and mpan:
+        return account_number, mpan
+
+    accounts = get_account_cache().get_accounts(api_key, token, client)
+    account_number = account_number or accounts[0]["number"]
+    if not mpan:
+        mpans = import_mpans(accounts, account_number) or all_mpans(accounts, account_number)
+        if not mpans:
+            raise Exception(f"No electricity meter points found on account {account_number}")
+        mpan = mpans[0]
+    return account_number, mpan
+
+
+def run_tenant(tenant: Dict, output_root: str, client: GraphQLClient, history: Optional[HistoryStore] = None) -> Dict:
+    """
+    Fetch both campaigns for one tenant in a single batched request and
+    write its feeds. Errors are captured, never raised.
+
+    Args:
+        tenant: Tenant from the manifest
+        output_root: Directory holding one sub-directory per tenant
+        client: Shared pooled client
+        history: Event history to record the tenant's events in
+
+    Returns:
+        Result dictionary with `name`, `ok`, `seconds` and `error`
+    """
+    started = time.perf_counter()
+    result = {"name": tenant["name"], "ok": False, "error": None}
+    try:
+        if not tenant["api_key"]:
+            raise Exception("No API key configured")
+
+        token = get_cached_token(tenant["api_key"], client)
+        account_number, mpan = resolve_meter_point(
+            tenant["api_key"], token, tenant["account_number"], tenant["mpan"], client
+        )
+
+        results, errors = fetch_campaign_events_batch(
+            token, account_number, [(FREE_ELECTRICITY_SLUG, mpan), (POWER_UP_SLUG, mpan)], client=client
+        )
+
+        output_dir = os.path.join(output_root, tenant["name"])
+        os.makedirs(output_dir, exist_ok=True)
+        # A campaign that failed keeps its previous feed; the other is still written
+        if (FREE_ELECTRICITY_SLUG, mpan) in results:
+            write_sessions_to_file(results[(FREE_ELECTRICITY_SLUG, mpan)], output_dir=output_dir)
+        if (POWER_UP_SLUG, mpan) in results:
+            write_events_to_file(filter_future_events(results[(POWER_UP_SLUG, mpan)]), output_dir=output_dir)
+
+        if history is not None:
+            try:
+                history.record([
+                    row for (slug, _), events in results.items()
+                    for row in history_rows(slug, mpan, events, account_number)
+                ])
+            except (sqlite3.Error, OSError) as e:
+                # The feeds are already written; a history failure shouldn't fail the tenant
+                print(f"WARNING: Could not record event history for {tenant['name']}: {e}", file=sys.stderr)
+
+        if errors:
+            raise Exception("; ".join(f"{slug}: {e}" for (slug, _), e in errors.items()))
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = str(e)
+
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an unsorted list (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def run_batch(tenants: List[Dict], output_root: str, workers: int = DEFAULT_WORKERS) -> Dict:
+    """
+    Run every tenant with at most `workers` tenants in flight.
+
+    Args:
+        tenants: Tenants from load_manifest()
+        output_root: Directory holding one sub-directory per tenant
+        workers: Global concurrency limit
+
+    Returns:
+        Summary dictionary including per-tenant results
+    """
+    started = time.perf_counter()
+    try:
+        history = HistoryStore()
+    except (sqlite3.Error, OSError) as e:
+        print(f"WARNING: Event history disabled: {e}", file=sys.stderr)
+        history = None
+    with GraphQLClient(pool_size=workers) as client:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            results = list(pool.map(lambda t: run_tenant(t, output_root, client, history), tenants))
+        stats = client.connection_stats()
+    elapsed = time.perf_counter() - started
+
+    latencies = [r["seconds"] for r in results]
+    failures = [r for r in results if not r["ok"]]
+    return {
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "tenants": len(results),
+        "failures": len(failures),
+        "elapsed_seconds": elapsed,
+        "tenants_per_second": len(results) / elapsed if elapsed else 0.0,
+        "p50_seconds": percentile(latencies, 50),
+        "p95_seconds": percentile(latencies, 95),
+        "http": stats,
+        "results": results
+    }
+
+
+def print_summary(summary: Dict) -> None:
+    """Print a throughput summary for a batch run."""
+    print(f"Tenants:     {summary['tenants']} ({summary['failures']} failed)")
+    print(f"Elapsed:     {summary['elapsed_seconds']:.2f}s")
+    print(f"Throughput:  {summary['tenants_per_second']:.2f} tenants/s")
+    print(f"Latency:     p50 {summary['p50_seconds']:.3f}s, p95 {summary['p95_seconds']:.3f}s")
+    print(
+        f"HTTP:        {summary['http']['requests']} request(s), "
+        f"{summary['http']['connections_reused']} reused connection(s)"
+    )
+    for result in summary["results"]:
+        if not result["ok"]:
+            print(f"  FAILED {result['name']}: {result['error']}")
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Run the GraphQL finders for many tenants")
+    parser.add_argument("manifest", help="JSON tenant manifest")
+    parser.add_argument("--output-dir", default="tenants", help="Directory for per-tenant feeds")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Maximum tenants in flight")
+    args = parser.parse_args()
+
+    try:
+        tenants = load_manifest(args.manifest)
+    except Exception as e:
+        print(f"ERROR: Could not load manifest: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    summary = run_batch(tenants, args.output_dir, args.workers)
+    print_summary(summary)
+
+    if summary["failures"] == summary["tenants"] and summary["tenants"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Persistent JWT cache for the Octopus Energy GraphQL API
+
+Tokens are kept in a small JSON file (mode 0600) keyed by a hash of the
+API key, so the FES and Power Up finders - and concurrent processes -
+share them. A cached token is reused until shortly before its `exp`
+claim; after that it is renewed with the refresh token, and only when
+that fails do we fall back to a full API key authentication.
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+from typing import Dict, Optional
+
+import requests
+
+from cache_file import CACHE_DIR, LockedJSONFile, cache_key
+from octopus_client import GraphQLClient, GraphQLError, obtain_kraken_token
+
+# Configuration
+DEFAULT_TOKEN_CACHE = os.getenv("OCTOPUS_TOKEN_CACHE", os.path.join(CACHE_DIR, "tokens.json"))
+# Renew tokens this many seconds before they actually expire
+EXPIRY_MARGIN = 60
+
+
+def jwt_expiry(token: str) -> Optional[int]:
+    """
+    Read the `exp` claim (epoch seconds) from a JWT without verifying it.
+
+    Args:
+        token: JWT string
+
+    Returns:
+        Expiry as epoch seconds, or None if the token cannot be decoded
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return int(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _refresh_expiry(refresh_expires_in: Optional[int], now: float) -> float:
+    """Normalise `refreshExpiresIn`, which Kraken returns as an epoch timestamp."""
+    if not refresh_expires_in:
+        return 0
+    # Treat small values as a relative lifetime rather than a timestamp
+    if refresh_expires_in < 10 ** 9:
+        return now + refresh_expires_in
+    return float(refresh_expires_in)
+
+
+class TokenStore:
+    """
+    File-backed, file-locked store of JWT and refresh tokens.
+
+    Args:
+        path: Location of the JSON cache file
+    """
+
+    def __init__(self, path: str = DEFAULT_TOKEN_CACHE):
+        self.file = LockedJSONFile(path)
+
+    def get_token(self, api_key: str, client: Optional[GraphQLClient] = None) -> str:
+        """
+        Return a valid JWT for the API key, authenticating only when needed.
+
+        Args:
+            api_key: Your Octopus Energy API key
+            client: Optional client (defaults to the shared client)
+
+        Returns:
+            JWT token string
+        """
+        key = cache_key(api_key)
+        with self.file.locked():
+            entry = self.file.read().get(key, {})
+        if self._is_valid(entry):
+            return entry["token"]
+
+        # Only one caller per API key renews; other keys are not blocked meanwhile
+        with self.file.key_locked(key):
+            with self.file.locked():
+                entry = self.file.read().get(key, {})
+            if self._is_valid(entry):
+                return entry["token"]
+
+            now = time.time()
+            payload = None
+            if entry.get("refresh_token") and entry.get("refresh_expires_at", 0) - EXPIRY_MARGIN > now:
+                try:
+                    payload = obtain_kraken_token({"refreshToken": entry["refresh_token"]}, client)
+                except (GraphQLError, requests.RequestException) as e:
+                    # A revoked refresh token comes back as a GraphQL error or a 400/401
+                    print(f"Token refresh failed, re-authenticating with API key: {e}", file=sys.stderr)
+
+            if payload is None:
+                payload = obtain_kraken_token({"APIKey": api_key}, client)
+
+            token = payload["token"]
+            new_entry = {
+                "token": token,
+                "expires_at": jwt_expiry(token) or now + 3600,
+                "refresh_token": payload.get("refreshToken") or entry.get("refresh_token"),
+                "refresh_expires_at": _refresh_expiry(payload.get("refreshExpiresIn"), now)
+                or entry.get("refresh_expires_at", 0)
+            }
+            with self.file.locked():
+                entries = self.file.read()
+                entries[key] = new_entry
+                self.file.write(entries)
+            return token
+
+    @staticmethod
+    def _is_valid(entry: Dict) -> bool:
+        return bool(entry.get("token")) and entry.get("expires_at", 0) - EXPIRY_MARGIN > time.time()
+
+    def invalidate(self, api_key: str) -> None:
+        """Drop the cached tokens for an API key (e.g. after an auth error)."""
+        key = cache_key(api_key)
+        with self.file.locked():
+            entries = self.file.read()
+            if entries.pop(key, None) is not None:
+                self.file.write(entries)
+
+
+_default_store: Optional[TokenStore] = None
+
+
+def get_cached_token(api_key: str, client: Optional[GraphQLClient] = None) -> str:
+    """
+    Get a JWT for the API key from the shared on-disk token store.
+
+    Args:
+        api_key: Your Octopus Energy API key
+        client: Optional client (defaults to the shared client)
+
+    Returns:
+        JWT token string
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = TokenStore()
+    return _default_store.get_token(api_key, client)
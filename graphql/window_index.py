@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Fast "is a session active / what's next" queries over campaign events
+
+Events are merged into sorted, non-overlapping windows per campaign and
+MPAN, so `is_active()`, `next_window()` and `windows_between()` are
+answered with a binary search instead of a scan over the feed. Each index
+also precomputes one 48-bit half-hour slot bitmap per (UTC) day, for
+schedulers that think in settlement periods.
+
+All times are epoch seconds. Indexes can be built from fetched events,
+from the history store (which knows the MPAN of every event) or from the
+published feed files.
+
+Usage:
+
+    python window_index.py        # status of every campaign from the feed files
+"""
+
+import json
+import os
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from campaign_registry import load_registry
+from event_model import CampaignEvent, parse_timestamp
+from feed_writer import FEED_DIR
+from history_store import HistoryStore
+
+SLOT_SECONDS = 30 * 60
+SLOTS_PER_DAY = 48
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+Window = Tuple[int, int]  # (start, end) epoch seconds, end exclusive
+
+
+def merge_windows(intervals: Iterable[Window]) -> List[Window]:
+    """Sort intervals and merge any that overlap or touch."""
+    merged: List[List[int]] = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+class WindowIndex:
+    """
+    Sorted, merged windows with binary-search lookups.
+
+    Args:
+        intervals: (start, end) pairs in epoch seconds, in any order
+    """
+
+    __slots__ = ("starts", "ends", "_slots")
+
+    def __init__(self, intervals: Iterable[Window] = ()):
+        windows = merge_windows(intervals)
+        self.starts = [start for start, _ in windows]
+        self.ends = [end for _, end in windows]
+        self._slots: Dict[int, int] = {}
+        for start, end in windows:
+            for slot in range(start // SLOT_SECONDS, (end - 1) // SLOT_SECONDS + 1):
+                day, bit = divmod(slot, SLOTS_PER_DAY)
+                self._slots[day] = self._slots.get(day, 0) | (1 << bit)
+
+    @classmethod
+    def from_events(cls, events: Iterable[CampaignEvent]) -> "WindowIndex":
+        return cls((event.start, event.end) for event in events)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def current_window(self, ts: float) -> Optional[Window]:
+        """The window containing `ts`, or None."""
+        i = bisect_right(self.starts, ts) - 1
+        if i >= 0 and ts < self.ends[i]:
+            return self.starts[i], self.ends[i]
+        return None
+
+    def is_active(self, ts: float) -> bool:
+        """True if `ts` falls inside a window."""
+        i = bisect_right(self.starts, ts) - 1
+        return i >= 0 and ts < self.ends[i]
+
+    def next_window(self, ts: float) -> Optional[Window]:
+        """The first window starting after `ts`, or None."""
+        i = bisect_right(self.starts, ts)
+        if i < len(self.starts):
+            return self.starts[i], self.ends[i]
+        return None
+
+    def windows_between(self, a: float, b: float) -> List[Window]:
+        """Windows overlapping [a, b), oldest first."""
+        first = bisect_right(self.ends, a)
+        last = bisect_left(self.starts, b)
+        return list(zip(self.starts[first:last], self.ends[first:last]))
+
+    def day_slots(self, day: date) -> int:
+        """
+        Half-hour slot bitmap for a UTC day.
+
+        Bit n is set if any part of the half hour starting at n * 30 minutes
+        past midnight UTC lies inside a window.
+        """
+        return self._slots.get(day.toordinal() - EPOCH_ORDINAL, 0)
+
+    def slot_is_active(self, ts: float) -> bool:
+        """True if any part of the half hour containing `ts` lies inside a window."""
+        day, bit = divmod(int(ts) // SLOT_SECONDS, SLOTS_PER_DAY)
+        return bool(self._slots.get(day, 0) >> bit & 1)
+
+
+def slot_list(bitmap: int) -> List[int]:
+    """Indexes (0-47) of the slots set in a day's bitmap."""
+    return [bit for bit in range(SLOTS_PER_DAY) if bitmap >> bit & 1]
+
+
+class EventWindows:
+    """
+    WindowIndex per campaign and MPAN, including the "any" combinations.
+
+    Indexes are precomputed for (campaign, mpan), (campaign, None),
+    (None, mpan) and (None, None), so a query for any campaign or any MPAN
+    is still a single binary search.
+
+    Args:
+        intervals: Mapping of (campaign, mpan) to (start, end) pairs; use
+            None as the MPAN when it is not known
+    """
+
+    def __init__(self, intervals: Dict[Tuple[str, Optional[str]], Iterable[Window]]):
+        grouped: Dict[Tuple[Optional[str], Optional[str]], List[Window]] = {}
+        for (campaign, mpan), windows in intervals.items():
+            windows = list(windows)
+            keys = {(campaign, mpan), (campaign, None), (None, mpan), (None, None)}
+            for key in keys:
+                grouped.setdefault(key, []).extend(windows)
+        self.indexes = {key: WindowIndex(windows) for key, windows in grouped.items()}
+        self._empty = WindowIndex()
+
+    @classmethod
+    def from_events(cls, events: Dict[str, List[CampaignEvent]], mpan: Optional[str] = None) -> "EventWindows":
+        """Build from events per campaign slug, as returned by the campaign finder."""
+        return cls({
+            (campaign, mpan): [(event.start, event.end) for event in campaign_events]
+            for campaign, campaign_events in events.items()
+        })
+
+    @classmethod
+    def from_history(cls, store: Optional[HistoryStore] = None, since: Optional[int] = None) -> "EventWindows":
+        """Build per-MPAN indexes from the history store (events starting at or after `since`)."""
+        intervals: Dict[Tuple[str, Optional[str]], List[Window]] = {}
+        for campaign, mpan, _, _, _, start, end in (store or HistoryStore()).events(start=since):
+            intervals.setdefault((campaign, mpan), []).append((start, end))
+        return cls(intervals)
+
+    @classmethod
+    def from_feeds(cls, feed_files: Dict[str, str]) -> "EventWindows":
+        """
+        Build from published feed files.
+
+        Args:
+            feed_files: Mapping of campaign slug to feed path
+        """
+        intervals = {}
+        for campaign, path in feed_files.items():
+            with open(path) as f:
+                entries = json.load(f)
+            intervals[(campaign, None)] = [
+                (parse_timestamp(entry["start"])[0], parse_timestamp(entry["end"])[0])
+                for entry in entries
+                if entry.get("start") and entry.get("end")
+            ]
+        return cls(intervals)
+
+    def index(self, campaign: Optional[str] = None, mpan: Optional[str] = None) -> WindowIndex:
+        """The index for a campaign and MPAN (None means any)."""
+        return self.indexes.get((campaign, mpan), self._empty)
+
+    def is_active(self, ts: float, campaign: Optional[str] = None, mpan: Optional[str] = None) -> bool:
+        return self.index(campaign, mpan).is_active(ts)
+
+    def next_window(self, ts: float, campaign: Optional[str] = None, mpan: Optional[str] = None) -> Optional[Window]:
+        return self.index(campaign, mpan).next_window(ts)
+
+    def windows_between(
+        self,
+        a: float,
+        b: float,
+        campaign: Optional[str] = None,
+        mpan: Optional[str] = None
+    ) -> List[Window]:
+        return self.index(campaign, mpan).windows_between(a, b)
+
+
+def _format(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def main():
+    """Print whether each campaign is active now and when its next window starts."""
+    feed_files = {
+        campaign.slug: os.path.join(FEED_DIR, campaign.output)
+        for campaign in load_registry().enabled()
+        if os.path.exists(os.path.join(FEED_DIR, campaign.output))
+    }
+    if not feed_files:
+        print("ERROR: No feed files found", file=sys.stderr)
+        sys.exit(1)
+
+    windows = EventWindows.from_feeds(feed_files)
+    now = time.time()
+    for slug in feed_files:
+        current = windows.index(slug).current_window(now)
+        upcoming = windows.next_window(now, slug)
+        print(f"{slug}:")
+        print(f"  Active: {'yes, until ' + _format(current[1]) if current else 'no'}")
+        print(f"  Next:   {_format(upcoming[0]) + ' - ' + _format(upcoming[1]) if upcoming else 'none scheduled'}")
+
+
+if __name__ == "__main__":
+    main()